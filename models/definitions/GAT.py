@@ -1,8 +1,14 @@
+import math
+
+
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
 
-from utils.constants import LayerType
+from utils.constants import LayerType, Precision
+from utils.graph import as_graph, get_edge_index
+from models.definitions.fused_attention import fused_neighborhood_attention, recomputed_neighborhood_attention
 
 
 class GAT(torch.nn.Module):
@@ -15,18 +21,63 @@ class GAT(torch.nn.Module):
     Tip on how to approach this:
         understand implementation 2 first, check out the differences it has with imp1, and finally tackle imp #3.
 
+    fused_aggregation (imp3 only) switches imp3 to an execution mode that never materializes the (E, NH, FOUT) lifted
+    features tensor (check out fused_attention.py) - same params, same outputs, much lower peak memory on big graphs.
+
+    precision other than FP32 runs the forward pass under autocast (mixed precision): projections run in bf16/fp16
+    while the neighborhood softmax statistics stay in fp32. The output scores are always returned in fp32.
+
+    checkpoint_layers (ids of GAT layers or True for all of them) enables activation recomputation (gradient
+    checkpointing): those layers only keep their inputs around and recompute everything else during the backward. Imp3
+    layers also run their attention through the recomputed fused path (check out fused_attention.py) - no per-edge
+    tensors are kept nor created in full (except for the bool dropout mask), so the peak grows with N not with E.
+
+    compile (imp3 only) runs the layers through their graph-capture friendly forward (plain tensors in/out instead of
+    tuples through nn.Sequential, same helpers as the eager forward) wrapped in torch.compile, so that the elementwise chains like
+    leakyReLU -> exp and skip -> bias -> ELU get fused into single kernels.
+
+    Imp3 also accepts the input node features as a torch sparse CSR tensor (bag-of-words features are mostly zeros):
+    the first layer then applies dropout only to the stored values and projects them with a sparse-dense matmul.
+
+    num_of_replicas (imp3 only) turns this into K independent GATs trained as a single batched model (check out
+    ReplicatedGATLayerImp3), the output scores are (K, N, C) - one set per replica.
+
     """
 
     def __init__(self, num_of_layers, num_heads_per_layer, num_features_per_layer, add_skip_connection=True, bias=True,
-                 dropout=0.6, layer_type=LayerType.IMP3, log_attention_weights=False):
+                 dropout=0.6, layer_type=LayerType.IMP3, log_attention_weights=False, fused_aggregation=False,
+                 precision=Precision.FP32, checkpoint_layers=None, compile=False, num_of_replicas=None):
         super().__init__()
         assert num_of_layers == len(num_heads_per_layer) == len(num_features_per_layer) - 1, f'Enter valid arch params.'
+        assert not fused_aggregation or layer_type == LayerType.IMP3, f'Fused aggregation is only supported by {LayerType.IMP3}.'
+        assert isinstance(precision, Precision), f'Expected {Precision} got {type(precision)}.'
+        assert not compile or layer_type == LayerType.IMP3, f'Compile mode is only supported by {LayerType.IMP3}.'
+        assert not compile or not (fused_aggregation or checkpoint_layers or log_attention_weights), \
+            'Compile mode does not support fused aggregation, checkpointing nor attention logging.'
+        assert num_of_replicas is None or layer_type == LayerType.IMP3, f'Replicas are only supported by {LayerType.IMP3}.'
+        assert num_of_replicas is None or not (fused_aggregation or checkpoint_layers or log_attention_weights or compile or precision != Precision.FP32), \
+            'Replicas support only eager FP32 without fused aggregation, checkpointing nor attention logging.'
+
+        self.precision = precision
+        self.layer_type = layer_type
+
+        if checkpoint_layers is True:
+            checkpoint_layers = range(num_of_layers)
+        self.checkpoint_layers = set(checkpoint_layers) if checkpoint_layers else set()
+        assert all(0 <= layer_id < num_of_layers for layer_id in self.checkpoint_layers), f'Invalid checkpoint layer ids {checkpoint_layers}.'
 
         GATLayer = get_layer_type(layer_type)  # fetch one of 3 available implementations
         num_heads_per_layer = [1] + num_heads_per_layer  # trick - so that I can nicely create GAT layers below
+        if num_of_replicas is not None:
+            GATLayer = ReplicatedGATLayerImp3
 
         gat_layers = []  # collect GAT layers
         for i in range(num_of_layers):
+            # Imp3-specific execution options (imp1/imp2 layers don't know about these), checkpointed imp3 layers
+            # recompute their attention chunk by chunk so that the recomputation never creates per-edge tensors
+            imp3_kwargs = {'fused_aggregation': fused_aggregation, 'recompute_attention': i in self.checkpoint_layers} if layer_type == LayerType.IMP3 else {}
+            if num_of_replicas is not None:
+                imp3_kwargs = {'num_of_replicas': num_of_replicas}
             layer = GATLayer(
                 num_in_features=num_features_per_layer[i] * num_heads_per_layer[i],  # consequence of concatenation
                 num_out_features=num_features_per_layer[i+1],
@@ -36,7 +87,8 @@ class GAT(torch.nn.Module):
                 dropout_prob=dropout,
                 add_skip_connection=add_skip_connection,
                 bias=bias,
-                log_attention_weights=log_attention_weights
+                log_attention_weights=log_attention_weights,
+                **imp3_kwargs
             )
             gat_layers.append(layer)
 
@@ -44,10 +96,70 @@ class GAT(torch.nn.Module):
             *gat_layers,
         )
 
+        # Compilation itself is lazy - it happens on the first forward pass (and again if the input shapes change a lot)
+        self.compiled_gat_net = torch.compile(self.run_gat_net_compilable) if compile else None
+
     # data is just a (in_nodes_features, topology) tuple, I had to do it like this because of the nn.Sequential:
     # https://discuss.pytorch.org/t/forward-takes-2-positional-arguments-but-3-were-given-for-nn-sqeuential-with-linear-layers/65698
     def forward(self, data):
-        return self.gat_net(data)
+        if self.precision == Precision.FP32:
+            return self.run_gat_net(data)
+
+        in_nodes_features, topology = data
+        with torch.autocast(device_type=in_nodes_features.device.type, dtype=get_autocast_dtype(self.precision)):
+            out_nodes_features, topology = self.run_gat_net((in_nodes_features, topology))
+
+        # Loss and metrics should be computed in fp32 (that's also what the rest of the code expects)
+        return (out_nodes_features.float(), topology)
+
+    def run_gat_net(self, data):
+        in_nodes_features, topology = data
+        if self.compiled_gat_net is not None:
+            return (self.compiled_gat_net(in_nodes_features, get_edge_index(topology)), topology)
+
+        # Imp3 - wrap a raw edge index into a Graph once so that all of the layers share its cached views (utils/graph.py)
+        if self.layer_type == LayerType.IMP3:
+            data = (in_nodes_features, as_graph(topology, in_nodes_features.shape[0]))
+
+        # Nothing to recompute if we're not going to backprop (e.g. val/test loops run under torch.no_grad())
+        if not self.checkpoint_layers or not torch.is_grad_enabled():
+            return (self.gat_net(data)[0], topology)
+
+        for layer_id, layer in enumerate(self.gat_net):
+            if layer_id in self.checkpoint_layers:
+                # Only the layer's inputs are stored, the rest is recomputed during the backward pass. The RNG state is
+                # stashed and restored so the recomputation draws exactly the same dropout masks as the original pass.
+                # Note: tensors are passed unpacked so that checkpoint can find the (CUDA) devices whose RNG to restore
+                data = checkpoint(lambda features, topology, layer=layer: layer((features, topology)), *data, use_reentrant=False, preserve_rng_state=True)
+            else:
+                data = layer(data)
+
+        return (data[0], topology)
+
+    def run_gat_net_compilable(self, in_nodes_features, edge_index):
+        for layer in self.gat_net:
+            in_nodes_features = layer.forward_compilable(in_nodes_features, edge_index)
+
+        return in_nodes_features
+
+    #
+    # Replicas (num_of_replicas) only
+    #
+
+    def set_replica_generators(self, generators):
+        # Replica k draws all of its dropout masks from generators[k] (they have to be on the same device as the model)
+        for layer in self.gat_net:
+            assert len(generators) == layer.num_of_replicas, f'Expected {layer.num_of_replicas} generators got {len(generators)}.'
+            layer.replica_generators = generators
+
+    def load_replica(self, replica_id, gat):
+        # Copies the weights of a standalone (imp3) GAT with the same architecture into replica replica_id
+        for layer, standalone_layer in zip(self.gat_net, gat.gat_net):
+            layer.load_replica(replica_id, standalone_layer)
+
+    def get_replica_state_dict(self, replica_id):
+        # Loadable into a standalone GAT with the same architecture
+        return {f'gat_net.{layer_id}.{name}': param for layer_id, layer in enumerate(self.gat_net) for name, param in layer.get_replica_state_dict(replica_id).items()}
 
 
 class GATLayer(torch.nn.Module):
@@ -58,6 +170,11 @@ class GATLayer(torch.nn.Module):
 
     head_dim = 1
 
+    # Tile sizes (target node rows x source node columns) used by imp1/imp2 when they get a compact connectivity mask
+    # Note: column tile size has to be a multiple of 8 so that the tiles align with the bytes of bit-packed masks
+    dense_row_tile_size = 512
+    dense_col_tile_size = 4096
+
     def __init__(self, num_in_features, num_out_features, num_of_heads, layer_type, concat=True, activation=nn.ELU(),
                  dropout_prob=0.6, add_skip_connection=True, bias=True, log_attention_weights=False):
 
@@ -69,6 +186,21 @@ class GATLayer(torch.nn.Module):
         self.concat = concat  # whether we should concatenate or average the attention heads
         self.add_skip_connection = add_skip_connection
 
+        self.init_trainable_weights(num_in_features, num_out_features, num_of_heads, layer_type, concat, add_skip_connection, bias)
+
+        self.leakyReLU = nn.LeakyReLU(0.2)  # using 0.2 as in the paper, no need to expose every setting
+        self.softmax = nn.Softmax(dim=-1)  # -1 stands for apply the log-softmax along the last dimension
+        self.activation = activation
+        # Probably not the nicest design but I use the same module in 3 locations, before/after features projection
+        # and for attention coefficients. Functionality-wise it's the same as using independent modules.
+        self.dropout = nn.Dropout(p=dropout_prob)
+
+        self.log_attention_weights = log_attention_weights  # whether we should log the attention weights
+        self.attention_weights = None  # for later visualization purposes, I cache the weights here
+
+        self.init_params(layer_type)
+
+    def init_trainable_weights(self, num_in_features, num_out_features, num_of_heads, layer_type, concat, add_skip_connection, bias):
         #
         # Trainable weights: linear projection matrix (denoted as "W" in the paper), attention target/source
         # (denoted as "a" in the paper) and bias (not mentioned in the paper but present in the official GAT repo)
@@ -106,22 +238,6 @@ class GATLayer(torch.nn.Module):
         else:
             self.register_parameter('skip_proj', None)
 
-        #
-        # End of trainable weights
-        #
-
-        self.leakyReLU = nn.LeakyReLU(0.2)  # using 0.2 as in the paper, no need to expose every setting
-        self.softmax = nn.Softmax(dim=-1)  # -1 stands for apply the log-softmax along the last dimension
-        self.activation = activation
-        # Probably not the nicest design but I use the same module in 3 locations, before/after features projection
-        # and for attention coefficients. Functionality-wise it's the same as using independent modules.
-        self.dropout = nn.Dropout(p=dropout_prob)
-
-        self.log_attention_weights = log_attention_weights  # whether we should log the attention weights
-        self.attention_weights = None  # for later visualization purposes, I cache the weights here
-
-        self.init_params(layer_type)
-
     def init_params(self, layer_type):
         """
         The reason we're using Glorot (aka Xavier uniform) initialization is because it's a default TF initialization:
@@ -138,6 +254,109 @@ class GATLayer(torch.nn.Module):
         if self.bias is not None:
             torch.nn.init.zeros_(self.bias)
 
+    def is_compact_connectivity_mask(self, connectivity_mask, num_of_nodes):
+        """
+        Imp1/imp2 accept 3 types of connectivity masks:
+            * the original additive float mask (N, N) (-inf where there is no edge, 0 otherwise) - dense NxN attention
+            * boolean mask (N, N) (True where there is an edge) - tiled attention (check out tiled_attention)
+            * bit-packed uint8 mask (N, ceil(N/8)), bit j % 8 of byte j // 8 in row i is set if j -> i - tiled attention
+
+        """
+        if connectivity_mask.dtype == torch.uint8:
+            expected_shape = (num_of_nodes, (num_of_nodes + 7) // 8)
+        else:
+            expected_shape = (num_of_nodes, num_of_nodes)
+        assert connectivity_mask.shape == expected_shape, \
+            f'Expected connectivity matrix with shape={expected_shape}, got shape={connectivity_mask.shape}.'
+
+        return connectivity_mask.dtype in (torch.bool, torch.uint8)
+
+    def tiled_attention(self, scores_source, scores_target, nodes_features_proj, connectivity_mask):
+        """
+        Does the same thing as the dense imp1/imp2 attention (leakyReLU -> masked softmax -> bmm) but tile by tile so
+        that neither the NxN float mask nor the (NH, N, N) scores/attention tensors ever get created.
+
+        We go over blocks of target nodes (rows) and for every block we sweep over the source nodes (columns) in tiles
+        using the "online softmax" trick: keep the running max and the running (exp) sum per row, and rescale the
+        partial results whenever the running max changes. The end result is exactly the softmax over the whole row.
+
+        During training every row block is checkpointed (recomputed in the backward pass) otherwise autograd would keep
+        all of the tiles alive and we'd be back to O(N^2) memory.
+
+        scores_source/scores_target shape = (NH, N), nodes_features_proj shape = (NH, N, FOUT)
+        Returns shape = (NH, N, FOUT). Note: attention coefficients are not available (nothing to log) in this mode.
+
+        """
+        num_of_nodes = nodes_features_proj.shape[1]
+
+        # Softmax statistics are kept in (at least) fp32 even in mixed precision
+        softmax_dtype = torch.promote_types(scores_source.dtype, torch.float32)
+        scores_source, scores_target = scores_source.to(softmax_dtype), scores_target.to(softmax_dtype)
+
+        out_row_blocks = []
+        for row_start in range(0, num_of_nodes, self.dense_row_tile_size):
+            row_end = min(row_start + self.dense_row_tile_size, num_of_nodes)
+            row_block_args = (scores_source[:, row_start:row_end], scores_target, nodes_features_proj, connectivity_mask[row_start:row_end])
+
+            if torch.is_grad_enabled():
+                out_row_blocks.append(checkpoint(self.tiled_attention_row_block, *row_block_args, use_reentrant=False))
+            else:
+                out_row_blocks.append(self.tiled_attention_row_block(*row_block_args))
+
+        # shape = NB * (NH, TR, FOUT) -> (NH, N, FOUT), where NB is the number of row blocks and TR the row tile size
+        return torch.cat(out_row_blocks, dim=1).to(nodes_features_proj.dtype)
+
+    def tiled_attention_row_block(self, scores_source, scores_target, nodes_features_proj, connectivity_mask):
+        num_of_heads, num_of_rows = scores_source.shape
+        num_of_nodes = scores_target.shape[1]
+
+        # Running max, running sum and the running (un-normalized) weighted sum of the features, for every row
+        running_max = scores_source.new_full((num_of_heads, num_of_rows), float('-inf'))
+        running_sum = scores_source.new_zeros((num_of_heads, num_of_rows))
+        out_nodes_features = scores_source.new_zeros((num_of_heads, num_of_rows, nodes_features_proj.shape[-1]))
+
+        for col_start in range(0, num_of_nodes, self.dense_col_tile_size):
+            col_end = min(col_start + self.dense_col_tile_size, num_of_nodes)
+
+            # shape = (NH, TR, 1) + (NH, 1, TC) -> (NH, TR, TC) same as in imp1/imp2 just for a single tile
+            tile_scores = self.leakyReLU(scores_source.unsqueeze(-1) + scores_target[:, col_start:col_end].unsqueeze(1))
+            tile_mask = unpack_connectivity_mask_tile(connectivity_mask, col_start, col_end)  # shape = (TR, TC)
+            tile_scores = tile_scores.masked_fill(~tile_mask, float('-inf'))
+
+            # Rows that haven't seen a single edge so far have -inf max, use 0 there to avoid (-inf) - (-inf) = NaN
+            # Note: the max is just a shift (softmax doesn't change) so there is no need to backprop through it
+            new_max = torch.maximum(running_max, tile_scores.detach().max(dim=-1)[0])
+            new_max_safe = torch.where(torch.isinf(new_max), torch.zeros_like(new_max), new_max)
+
+            tile_exp_scores = (tile_scores - new_max_safe.unsqueeze(-1)).exp()
+            rescale = (running_max - new_max_safe).exp()  # how much the old partial results shrink, exp(-inf) = 0
+
+            running_sum = running_sum * rescale + tile_exp_scores.sum(dim=-1)
+            # shape = (NH, TR, TC) * (NH, TC, FOUT) -> (NH, TR, FOUT)
+            tile_out = torch.bmm(tile_exp_scores.to(nodes_features_proj.dtype), nodes_features_proj[:, col_start:col_end])
+            out_nodes_features = out_nodes_features * rescale.unsqueeze(-1) + tile_out
+            running_max = new_max
+
+        # Finally normalize - this is the softmax denominator
+        return out_nodes_features / running_sum.unsqueeze(-1)
+
+    def sparse_aware_dropout(self, in_nodes_features):
+        if not is_sparse_csr(in_nodes_features):
+            return self.dropout(in_nodes_features)
+
+        # Dropping only the stored (non-zero) values is the same thing as dropping the whole dense matrix
+        return torch.sparse_csr_tensor(in_nodes_features.crow_indices(), in_nodes_features.col_indices(),
+                                       self.dropout(in_nodes_features.values()), size=in_nodes_features.shape)
+
+    def sparse_aware_projection(self, linear, in_nodes_features):
+        if not is_sparse_csr(in_nodes_features):
+            return linear(in_nodes_features)
+
+        # shape = (N, FIN) * (FIN, NH*FOUT) -> (N, NH*FOUT), autograd takes care of the (dense) weight gradient
+        # Note: sparse matmul has no bf16/fp16 kernels - it runs in fp32 (autocast takes over from the next op)
+        with torch.autocast(device_type=in_nodes_features.device.type, enabled=False):
+            return torch.sparse.mm(in_nodes_features, linear.weight.float().t())
+
     def skip_concat_bias(self, attention_coefficients, in_nodes_features, out_nodes_features):
         if self.log_attention_weights:  # potentially log for later visualization in playground.py
             self.attention_weights = attention_coefficients
@@ -151,11 +370,11 @@ class GATLayer(torch.nn.Module):
             if out_nodes_features.shape[-1] == in_nodes_features.shape[-1]:  # if FIN == FOUT
                 # unsqueeze does this: (N, FIN) -> (N, 1, FIN), out features are (N, NH, FOUT) so 1 gets broadcast to NH
                 # thus we're basically copying input vectors NH times and adding to processed vectors
-                out_nodes_features += in_nodes_features.unsqueeze(1)
+                out_nodes_features += (in_nodes_features.to_dense() if is_sparse_csr(in_nodes_features) else in_nodes_features).unsqueeze(1)
             else:
                 # FIN != FOUT so we need to project input feature vectors into dimension that can be added to output
                 # feature vectors. skip_proj adds lots of additional capacity which may cause overfitting.
-                out_nodes_features += self.skip_proj(in_nodes_features).view(-1, self.num_of_heads, self.num_out_features)
+                out_nodes_features += self.sparse_aware_projection(self.skip_proj, in_nodes_features).view(-1, self.num_of_heads, self.num_out_features)
 
         if self.concat:
             # shape = (N, NH, FOUT) -> (N, NH*FOUT)
@@ -188,30 +407,67 @@ class GATLayerImp3(GATLayer):
     nodes_dim = 0      # node dimension
     head_dim = 1       # attention head dim
 
+    # Number of edges processed at once in the fused mode, (C, NH, FOUT) is the biggest per-edge tensor we'll create
+    fused_edge_chunk_size = 2**16
+
     def __init__(self, num_in_features, num_out_features, num_of_heads, concat=True, activation=nn.ELU(),
-                 dropout_prob=0.6, add_skip_connection=True, bias=True, log_attention_weights=False):
+                 dropout_prob=0.6, add_skip_connection=True, bias=True, log_attention_weights=False, fused_aggregation=False,
+                 recompute_attention=False):
 
         # Delegate initialization to the base class
         super().__init__(num_in_features, num_out_features, num_of_heads, LayerType.IMP3, concat, activation, dropout_prob,
                       add_skip_connection, bias, log_attention_weights)
 
+        self.fused_aggregation = fused_aggregation  # whether to use the memory-efficient fused softmax + aggregation
+        self.recompute_attention = recompute_attention  # same but nothing per-edge is stored, it's recomputed in backward
+
     def forward(self, data):
+        in_nodes_features, graph = data  # unpack data
+        num_of_nodes = in_nodes_features.shape[self.nodes_dim]
+        # Graph with its cached views (check out utils/graph.py), a raw (2, E) edge index works as well
+        graph = as_graph(graph, num_of_nodes)
+        # int64 or int32 (--int32_indices) - index_select/index_add_/scatter_reduce_ take both as is, no int64 copies
+        edge_index = graph.edge_index
+
+        # Steps 1 and 2 (the per-node part): projection + regularization and the source/target scores
+        in_nodes_features, nodes_features_proj, scores_source, scores_target = self.project_and_score(in_nodes_features)
+
+        if self.fused_aggregation or self.recompute_attention:  # steps 2 and 3 in one go without ever creating (E, NH, FOUT) tensors
+            out_nodes_features, attentions_per_edge = self.fused_attention_and_aggregation(scores_source, scores_target, nodes_features_proj, graph)
+        else:  # steps 2 (the per-edge part) and 3: edge attention calculation and neighborhood aggregation
+            out_nodes_features, attentions_per_edge = self.attention_and_aggregation(scores_source, scores_target, nodes_features_proj, edge_index, num_of_nodes)
+
         #
-        # Step 1: Linear Projection + regularization
+        # Step 4: Residual/skip connections, concat and bias
         #
 
-        in_nodes_features, edge_index = data  # unpack data
+        out_nodes_features = self.skip_concat_bias(attentions_per_edge, in_nodes_features, out_nodes_features)
+        return (out_nodes_features, graph)
+
+    def forward_compilable(self, in_nodes_features, edge_index):
+        """
+        Does the same thing as forward (non-fused) and through the same helpers, but torch.compile can capture it as a
+        single graph: tensors in and out (no tuples, no Graph) and the attention is not logged.
+
+        """
         num_of_nodes = in_nodes_features.shape[self.nodes_dim]
-        assert edge_index.shape[0] == 2, f'Expected edge index with shape=(2,E) got {edge_index.shape}'
+        in_nodes_features, nodes_features_proj, scores_source, scores_target = self.project_and_score(in_nodes_features)
+        out_nodes_features, _ = self.attention_and_aggregation(scores_source, scores_target, nodes_features_proj, edge_index, num_of_nodes)
+        return self.skip_concat_bias(None, in_nodes_features, out_nodes_features)
+
+    def project_and_score(self, in_nodes_features):
+        #
+        # Step 1: Linear Projection + regularization
+        #
 
         # shape = (N, FIN) where N - number of nodes in the graph, FIN - number of input features per node
         # We apply the dropout to all of the input node features (as mentioned in the paper)
         # Note: for Cora features are already super sparse so it's questionable how much this actually helps
-        in_nodes_features = self.dropout(in_nodes_features)
+        in_nodes_features = self.sparse_aware_dropout(in_nodes_features)
 
         # shape = (N, FIN) * (FIN, NH*FOUT) -> (N, NH, FOUT) where NH - number of heads, FOUT - num of output features
         # We project the input node features into NH independent output features (one for each attention head)
-        nodes_features_proj = self.linear_proj(in_nodes_features).view(-1, self.num_of_heads, self.num_out_features)
+        nodes_features_proj = self.sparse_aware_projection(self.linear_proj, in_nodes_features).view(-1, self.num_of_heads, self.num_out_features)
 
         nodes_features_proj = self.dropout(nodes_features_proj)  # in the official GAT imp they did dropout here as well
 
@@ -225,6 +481,10 @@ class GATLayerImp3(GATLayer):
         scores_source = (nodes_features_proj * self.scoring_fn_source).sum(dim=-1)
         scores_target = (nodes_features_proj * self.scoring_fn_target).sum(dim=-1)
 
+        # The (dropped out) input features are needed for the skip connection
+        return in_nodes_features, nodes_features_proj, scores_source, scores_target
+
+    def attention_and_aggregation(self, scores_source, scores_target, nodes_features_proj, edge_index, num_of_nodes):
         # We simply copy (lift) the scores for source/target nodes based on the edge index. Instead of preparing all
         # the possible combinations of scores we just prepare those that will actually be used and those are defined
         # by the edge index.
@@ -243,23 +503,60 @@ class GATLayerImp3(GATLayer):
 
         # Element-wise (aka Hadamard) product. Operator * does the same thing as torch.mul
         # shape = (E, NH, FOUT) * (E, NH, 1) -> (E, NH, FOUT), 1 gets broadcast into FOUT
-        nodes_features_proj_lifted_weighted = nodes_features_proj_lifted * attentions_per_edge
+        # Note: the cast is a no-op in fp32, in mixed precision it keeps the biggest tensor in the low precision dtype
+        nodes_features_proj_lifted_weighted = nodes_features_proj_lifted * attentions_per_edge.to(nodes_features_proj_lifted.dtype)
 
         # This part sums up weighted and projected neighborhood feature vectors for every target node
         # shape = (N, NH, FOUT)
-        out_nodes_features = self.aggregate_neighbors(nodes_features_proj_lifted_weighted, edge_index, in_nodes_features, num_of_nodes)
-
-        #
-        # Step 4: Residual/skip connections, concat and bias
-        #
+        out_nodes_features = self.aggregate_neighbors(nodes_features_proj_lifted_weighted, edge_index, nodes_features_proj, num_of_nodes)
 
-        out_nodes_features = self.skip_concat_bias(attentions_per_edge, in_nodes_features, out_nodes_features)
-        return (out_nodes_features, edge_index)
+        return out_nodes_features, attentions_per_edge
 
     #
     # Helper functions (without comments there is very little code so don't be scared!)
     #
 
+    def fused_attention_and_aggregation(self, scores_source, scores_target, nodes_features_proj, graph):
+        """
+        Does the same thing as lift -> leakyReLU -> neighborhood_aware_softmax -> dropout -> aggregate_neighbors
+        but over a target-sorted (CSR) edge ordering and with a custom backward, check out fused_attention.py.
+
+        """
+        # CSR ordering - all of the edges pointing to the same target node become contiguous (sorted once per graph)
+        sort_permutation = graph.trg_sort_permutation
+        src_index_sorted, trg_index_sorted = graph.trg_sorted_edge_index
+
+        # Softmax statistics are kept in (at least) fp32 even in mixed precision, same as in neighborhood_aware_softmax
+        softmax_dtype = torch.promote_types(scores_source.dtype, torch.float32)
+        scores_source, scores_target = scores_source.to(softmax_dtype), scores_target.to(softmax_dtype)
+
+        # Same Bernoulli draws as the nn.Dropout of the default path (in the original edge order, it's the same random
+        # stream on CPU) kept as a bool mask - a quarter of the float one - and sorted like the edges. The unsorted
+        # mask is a temporary that's freed right away.
+        dropout_mask, dropout_prob = None, self.dropout.p
+        if self.training and dropout_prob > 0:
+            num_of_edges, num_of_heads = trg_index_sorted.shape[0], scores_source.shape[-1]
+            dropout_mask = torch.empty((num_of_edges, num_of_heads), dtype=torch.bool, device=scores_source.device).bernoulli_(1 - dropout_prob)
+            dropout_mask = dropout_mask.index_select(0, sort_permutation)
+
+        dropout_scale = 1 / (1 - dropout_prob) if dropout_mask is not None else 1.
+        if self.recompute_attention:  # checkpointed layer, the attention coefficients are only created for logging
+            out_nodes_features, attentions_per_edge = recomputed_neighborhood_attention(
+                scores_source, scores_target, nodes_features_proj, src_index_sorted, trg_index_sorted, dropout_mask,
+                dropout_scale, self.leakyReLU.negative_slope, self.fused_edge_chunk_size, self.log_attention_weights
+            )
+        else:
+            out_nodes_features, attentions_per_edge = fused_neighborhood_attention(
+                scores_source, scores_target, nodes_features_proj, src_index_sorted, trg_index_sorted, dropout_mask,
+                dropout_scale, self.leakyReLU.negative_slope, self.fused_edge_chunk_size
+            )
+
+        # Only needed for visualization - bring the attention back into the original edge order, shape = (E, NH, 1)
+        if self.log_attention_weights:
+            attentions_per_edge = torch.zeros_like(attentions_per_edge).index_copy_(0, sort_permutation, attentions_per_edge)
+
+        return out_nodes_features, attentions_per_edge.unsqueeze(-1) if attentions_per_edge is not None else None
+
     def neighborhood_aware_softmax(self, scores_per_edge, trg_index, num_of_nodes):
         """
         As the fn name suggest it does softmax over the neighborhoods. Example: say we have 5 nodes in a graph.
@@ -276,9 +573,15 @@ class GATLayerImp3(GATLayer):
 
         https://stats.stackexchange.com/questions/338285/how-does-the-subtraction-of-the-logit-maximum-improve-learning
 
+        Note2:
+        We subtract the max of every neighborhood (per target node, per head) and not the global max. With a global max
+        a neighborhood whose scores are all much smaller than the biggest score in the graph underflows to 0 after exp()
+        which is what happens all the time in bf16/fp16. The softmax statistics are always computed in (at least) fp32.
+
         """
         # Calculate the numerator. Make logits <= 0 so that e^logit <= 1 (this will improve the numerical stability)
-        scores_per_edge = scores_per_edge - scores_per_edge.max()
+        scores_per_edge = scores_per_edge.to(torch.promote_types(scores_per_edge.dtype, torch.float32))
+        scores_per_edge = scores_per_edge - self.max_edge_scores_neighborhood_aware(scores_per_edge, trg_index, num_of_nodes)
         exp_scores_per_edge = scores_per_edge.exp()  # softmax
 
         # Calculate the denominator. shape = (E, NH)
@@ -291,18 +594,31 @@ class GATLayerImp3(GATLayer):
         # shape = (E, NH) -> (E, NH, 1) so that we can do element-wise multiplication with projected node features
         return attentions_per_edge.unsqueeze(-1)
 
-    def sum_edge_scores_neighborhood_aware(self, exp_scores_per_edge, trg_index, num_of_nodes):
-        # The shape must be the same as in exp_scores_per_edge (required by scatter_add_) i.e. from E -> (E, NH)
-        trg_index_broadcasted = self.explicit_broadcast(trg_index, exp_scores_per_edge)
+    def max_edge_scores_neighborhood_aware(self, scores_per_edge, trg_index, num_of_nodes):
+        # Same idea as in sum_edge_scores_neighborhood_aware below just with max instead of sum
+        trg_index_broadcasted = self.explicit_broadcast(trg_index, scores_per_edge)
 
+        # shape = (N, NH), nodes without incoming edges stay at -inf but no edge will ever read those
+        size = list(scores_per_edge.shape)  # convert to list otherwise assignment is not possible
+        size[self.nodes_dim] = num_of_nodes
+        neighborhood_maxes = torch.full(size, float('-inf'), dtype=scores_per_edge.dtype, device=scores_per_edge.device)
+
+        # The max is just a constant shift (softmax doesn't change) so there is no need to backprop through it
+        neighborhood_maxes.scatter_reduce_(self.nodes_dim, trg_index_broadcasted, scores_per_edge.detach(), reduce='amax')
+
+        # shape = (N, NH) -> (E, NH)
+        return neighborhood_maxes.index_select(self.nodes_dim, trg_index)
+
+    def sum_edge_scores_neighborhood_aware(self, exp_scores_per_edge, trg_index, num_of_nodes):
         # shape = (N, NH), where N is the number of nodes and NH the number of attention heads
         size = list(exp_scores_per_edge.shape)  # convert to list otherwise assignment is not possible
         size[self.nodes_dim] = num_of_nodes
         neighborhood_sums = torch.zeros(size, dtype=exp_scores_per_edge.dtype, device=exp_scores_per_edge.device)
 
         # position i will contain a sum of exp scores of all the nodes that point to the node i (as dictated by the
-        # target index)
-        neighborhood_sums.scatter_add_(self.nodes_dim, trg_index_broadcasted, exp_scores_per_edge)
+        # target index). index_add_ takes the (E) index as is - no need to broadcast it to (E, NH) like for scatter_add_
+        # and it works with both int64 and int32 indices.
+        neighborhood_sums.index_add_(self.nodes_dim, trg_index, exp_scores_per_edge)
 
         # Expand again so that we can use it as a softmax denominator. e.g. node i's sum will be copied to
         # all the locations where the source nodes pointed to i (as dictated by the target index)
@@ -312,13 +628,12 @@ class GATLayerImp3(GATLayer):
     def aggregate_neighbors(self, nodes_features_proj_lifted_weighted, edge_index, in_nodes_features, num_of_nodes):
         size = list(nodes_features_proj_lifted_weighted.shape)  # convert to list otherwise assignment is not possible
         size[self.nodes_dim] = num_of_nodes  # shape = (N, NH, FOUT)
-        out_nodes_features = torch.zeros(size, dtype=in_nodes_features.dtype, device=in_nodes_features.device)
+        # Note: dtype comes from the weighted features as in mixed precision they may differ from the input features
+        out_nodes_features = torch.zeros(size, dtype=nodes_features_proj_lifted_weighted.dtype, device=in_nodes_features.device)
 
-        # shape = (E) -> (E, NH, FOUT)
-        trg_index_broadcasted = self.explicit_broadcast(edge_index[self.trg_nodes_dim], nodes_features_proj_lifted_weighted)
         # aggregation step - we accumulate projected, weighted node features for all the attention heads
-        # shape = (E, NH, FOUT) -> (N, NH, FOUT)
-        out_nodes_features.scatter_add_(self.nodes_dim, trg_index_broadcasted, nodes_features_proj_lifted_weighted)
+        # shape = (E, NH, FOUT) -> (N, NH, FOUT) (index_add_ - same as in sum_edge_scores_neighborhood_aware)
+        out_nodes_features.index_add_(self.nodes_dim, edge_index[self.trg_nodes_dim], nodes_features_proj_lifted_weighted)
 
         return out_nodes_features
 
@@ -347,6 +662,182 @@ class GATLayerImp3(GATLayer):
         return this.expand_as(other)
 
 
+class ReplicatedGATLayerImp3(GATLayerImp3):
+    """
+    num_of_replicas (K) independent imp3 layers in one - e.g. the same GAT trained from K different seeds.
+
+    Every trainable weight and every intermediate tensor gets a leading replica dimension (K, ...). The projections
+    become batched matmuls and the lift -> softmax -> aggregation part runs once for all of the replicas - they share
+    the edge index, the gathers/scatters just move K rows per node/edge instead of one.
+
+    Features are (K, N, F) in and out, the first layer also takes the (N, FIN) input features shared by all replicas.
+    Note: the replica dim is first (not e.g. folded into the heads) so that every reduction, incl. the ones in the
+    backward pass, runs over the same memory layout as in a standalone layer and gives bit-identical results.
+
+    Replica k draws its dropout masks from its own generator (check out set_replica_generators) in the same order and
+    with the same shapes as a standalone GATLayerImp3 does from the global RNG. Load the weights of K standalone layers
+    with load_replica and every replica computes exactly what its standalone layer would've computed.
+
+    """
+
+    nodes_dim = 1  # replica dim comes first
+    head_dim = 2
+
+    def __init__(self, num_in_features, num_out_features, num_of_heads, concat=True, activation=nn.ELU(),
+                 dropout_prob=0.6, add_skip_connection=True, bias=True, log_attention_weights=False, num_of_replicas=1):
+
+        self.num_of_replicas = num_of_replicas  # set before the base class creates the (stacked) weights
+        self.replica_generators = None  # one torch.Generator per replica, needed for the dropout during training
+
+        super().__init__(num_in_features, num_out_features, num_of_heads, concat, activation, dropout_prob,
+                         add_skip_connection, bias, log_attention_weights)
+
+    def init_trainable_weights(self, num_in_features, num_out_features, num_of_heads, layer_type, concat, add_skip_connection, bias):
+        # Same weights as in GATLayer, just stacked, shape = (K, ...) - plain Parameters instead of nn.Linear modules
+        num_of_replicas = self.num_of_replicas
+        self.linear_proj = nn.Parameter(torch.Tensor(num_of_replicas, num_of_heads * num_out_features, num_in_features))
+        self.scoring_fn_target = nn.Parameter(torch.Tensor(num_of_replicas, num_of_heads, num_out_features))
+        self.scoring_fn_source = nn.Parameter(torch.Tensor(num_of_replicas, num_of_heads, num_out_features))
+
+        if bias:
+            self.bias = nn.Parameter(torch.Tensor(num_of_replicas, num_of_heads * num_out_features if concat else num_out_features))
+        else:
+            self.register_parameter('bias', None)
+
+        if add_skip_connection:
+            self.skip_proj = nn.Parameter(torch.Tensor(num_of_replicas, num_of_heads * num_out_features, num_in_features))
+        else:
+            self.register_parameter('skip_proj', None)
+
+    def init_params(self, layer_type):
+        # Every replica is initialized like a standalone layer (check out GATLayer.init_params)
+        for replica_id in range(self.num_of_replicas):
+            nn.init.xavier_uniform_(self.linear_proj[replica_id])
+            nn.init.xavier_uniform_(self.scoring_fn_target[replica_id].unsqueeze(0))
+            nn.init.xavier_uniform_(self.scoring_fn_source[replica_id].unsqueeze(0))
+            if self.skip_proj is not None:  # nn.Linear's default init
+                nn.init.kaiming_uniform_(self.skip_proj[replica_id], a=math.sqrt(5))
+
+        if self.bias is not None:
+            torch.nn.init.zeros_(self.bias)
+
+    def load_replica(self, replica_id, layer):
+        # Copies the weights of a standalone GATLayerImp3 into replica replica_id
+        with torch.no_grad():
+            self.linear_proj[replica_id].copy_(layer.linear_proj.weight)
+            self.scoring_fn_target[replica_id].copy_(layer.scoring_fn_target[0])
+            self.scoring_fn_source[replica_id].copy_(layer.scoring_fn_source[0])
+            if self.bias is not None:
+                self.bias[replica_id].copy_(layer.bias)
+            if self.skip_proj is not None:
+                self.skip_proj[replica_id].copy_(layer.skip_proj.weight)
+
+    def get_replica_state_dict(self, replica_id):
+        # The state dict of a standalone GATLayerImp3 with replica replica_id's weights
+        state_dict = {
+            'scoring_fn_target': self.scoring_fn_target[replica_id].unsqueeze(0),
+            'scoring_fn_source': self.scoring_fn_source[replica_id].unsqueeze(0),
+            'linear_proj.weight': self.linear_proj[replica_id]
+        }
+        if self.bias is not None:
+            state_dict['bias'] = self.bias[replica_id]
+        if self.skip_proj is not None:
+            state_dict['skip_proj.weight'] = self.skip_proj[replica_id]
+
+        return {name: param.detach().clone() for name, param in state_dict.items()}
+
+    def explicit_broadcast(self, this, other):
+        # shape = (E) -> (E, ...) -> (K, E, ...), same for every replica
+        return super().explicit_broadcast(this, other[0]).unsqueeze(0).expand_as(other)
+
+    def replica_dropout(self, features):
+        # shape = (K, ...) (or broadcastable to it), replica k's mask comes from its own generator exactly as nn.Dropout
+        # (on the CPU) would draw it: bernoulli(1 - p) scaled by 1 / (1 - p)
+        keep_prob = 1 - self.dropout.p
+        if not self.training or keep_prob == 1:
+            return features
+
+        if keep_prob == 0:  # nn.Dropout doesn't draw anything either
+            return features * 0
+
+        assert self.replica_generators is not None, 'Training needs the replica generators, call set_replica_generators.'
+        dropout_masks = features.new_empty((self.num_of_replicas, *features.shape[1:]))
+        for replica_dropout_mask, generator in zip(dropout_masks, self.replica_generators):
+            replica_dropout_mask.bernoulli_(keep_prob, generator=generator)
+
+        # Nothing to backprop into (e.g. the first layer's input features) - the masks become the output, which saves a
+        # (K, N, FIN) allocation - by far the biggest tensor (the product is the same, multiplication commutes)
+        if not features.requires_grad:
+            return dropout_masks.div_(keep_prob).mul_(features)
+
+        return features * dropout_masks.div_(keep_prob)
+
+    def forward(self, data):
+        #
+        # Step 1: Linear Projection + regularization, every replica with its own weights and dropout masks
+        #
+
+        in_nodes_features, graph = data  # unpack data
+        num_of_nodes = in_nodes_features.shape[-2]  # the input features may not have the replica dim
+        graph = as_graph(graph, num_of_nodes)
+        edge_index = graph.edge_index
+        num_of_replicas = self.num_of_replicas
+
+        # shape = (N, FIN) or (K, N, FIN) -> (K, N, FIN), the first layer's input features are shared by the replicas
+        in_nodes_features = self.replica_dropout(in_nodes_features.expand(num_of_replicas, *in_nodes_features.shape[-2:]))
+
+        # shape = (K, N, FIN) * (K, FIN, NH*FOUT) -> (K, N, NH*FOUT) -> (K, N, NH, FOUT)
+        nodes_features_proj = self.replica_dropout(torch.bmm(in_nodes_features, self.linear_proj.transpose(1, 2)))
+        nodes_features_proj = nodes_features_proj.view(num_of_replicas, num_of_nodes, self.num_of_heads, self.num_out_features)
+
+        #
+        # Step 2: Edge attention calculation - same as imp3 just with a leading replica dim (nodes_dim = 1), the edge
+        # index is shared so every gather/scatter below runs once for all of the replicas
+        #
+
+        # shape = (K, N, NH, FOUT) * (K, 1, NH, FOUT) -> (K, N, NH)
+        scores_source = (nodes_features_proj * self.scoring_fn_source.unsqueeze(self.nodes_dim)).sum(dim=-1)
+        scores_target = (nodes_features_proj * self.scoring_fn_target.unsqueeze(self.nodes_dim)).sum(dim=-1)
+
+        # scores shape = (K, E, NH), nodes_features_proj_lifted shape = (K, E, NH, FOUT)
+        scores_source_lifted, scores_target_lifted, nodes_features_proj_lifted = self.lift(scores_source, scores_target, nodes_features_proj, edge_index)
+        scores_per_edge = self.leakyReLU(scores_source_lifted + scores_target_lifted)
+
+        # shape = (K, E, NH, 1)
+        attentions_per_edge = self.neighborhood_aware_softmax(scores_per_edge, edge_index[self.trg_nodes_dim], num_of_nodes)
+        attentions_per_edge = self.replica_dropout(attentions_per_edge)
+
+        #
+        # Step 3: Neighborhood aggregation, shape = (K, E, NH, FOUT) -> (K, N, NH, FOUT)
+        #
+
+        nodes_features_proj_lifted_weighted = nodes_features_proj_lifted * attentions_per_edge
+        out_nodes_features = self.aggregate_neighbors(nodes_features_proj_lifted_weighted, edge_index, in_nodes_features, num_of_nodes)
+
+        #
+        # Step 4: Residual/skip connections, concat and bias
+        #
+
+        if self.add_skip_connection:
+            if out_nodes_features.shape[-1] == in_nodes_features.shape[-1]:  # if FIN == FOUT
+                out_nodes_features += in_nodes_features.unsqueeze(self.head_dim)
+            else:
+                out_nodes_features += torch.bmm(in_nodes_features, self.skip_proj.transpose(1, 2)).view_as(out_nodes_features)
+
+        if self.concat:
+            # shape = (K, N, NH, FOUT) -> (K, N, NH*FOUT)
+            out_nodes_features = out_nodes_features.view(num_of_replicas, num_of_nodes, self.num_of_heads * self.num_out_features)
+        else:
+            # shape = (K, N, NH, FOUT) -> (K, N, FOUT)
+            out_nodes_features = out_nodes_features.mean(dim=self.head_dim)
+
+        if self.bias is not None:
+            out_nodes_features += self.bias.unsqueeze(self.nodes_dim)
+
+        out_nodes_features = out_nodes_features if self.activation is None else self.activation(out_nodes_features)
+        return (out_nodes_features, graph)
+
+
 class GATLayerImp2(GATLayer):
     """
         Implementation #2 was inspired by the official GAT implementation: https://github.com/PetarV-/GAT
@@ -370,8 +861,7 @@ class GATLayerImp2(GATLayer):
 
         in_nodes_features, connectivity_mask = data  # unpack data
         num_of_nodes = in_nodes_features.shape[0]
-        assert connectivity_mask.shape == (num_of_nodes, num_of_nodes), \
-            f'Expected connectivity matrix with shape=({num_of_nodes},{num_of_nodes}), got shape={connectivity_mask.shape}.'
+        is_tiled = self.is_compact_connectivity_mask(connectivity_mask, num_of_nodes)
 
         # shape = (N, FIN) where N - number of nodes in the graph, FIN - number of input features per node
         # We apply the dropout to all of the input node features (as mentioned in the paper)
@@ -397,6 +887,12 @@ class GATLayerImp2(GATLayer):
         scores_source = scores_source.transpose(0, 1)
         scores_target = scores_target.permute(1, 2, 0)
 
+        if is_tiled:  # steps 2 and 3 tile by tile without ever creating NxN tensors
+            # shape = (NH, N, FOUT) -> (N, NH, FOUT)
+            out_nodes_features = self.tiled_attention(scores_source.squeeze(-1), scores_target.squeeze(1), nodes_features_proj.transpose(0, 1), connectivity_mask).transpose(0, 1)
+            out_nodes_features = self.skip_concat_bias(None, in_nodes_features, out_nodes_features)
+            return (out_nodes_features, connectivity_mask)
+
         # shape = (NH, N, 1) + (NH, 1, N) -> (NH, N, N) with the magic of automatic broadcast <3
         # In Implementation 3 we are much smarter and don't have to calculate all NxN scores! (only E!)
         # Tip: it's conceptually easier to understand what happens here if you delete the NH dimension
@@ -439,8 +935,7 @@ class GATLayerImp1(GATLayer):
 
         in_nodes_features, connectivity_mask = data  # unpack data
         num_of_nodes = in_nodes_features.shape[0]
-        assert connectivity_mask.shape == (num_of_nodes, num_of_nodes), \
-            f'Expected connectivity matrix with shape=({num_of_nodes},{num_of_nodes}), got shape={connectivity_mask.shape}.'
+        is_tiled = self.is_compact_connectivity_mask(connectivity_mask, num_of_nodes)
 
         # shape = (N, FIN) where N - number of nodes in the graph, FIN number of input features per node
         # We apply the dropout to all of the input node features (as mentioned in the paper)
@@ -461,6 +956,12 @@ class GATLayerImp1(GATLayer):
         scores_source = torch.bmm(nodes_features_proj, self.scoring_fn_source)
         scores_target = torch.bmm(nodes_features_proj, self.scoring_fn_target)
 
+        if is_tiled:  # steps 2 and 3 tile by tile without ever creating NxN tensors
+            # shape = (NH, N, FOUT) -> (N, NH, FOUT)
+            out_nodes_features = self.tiled_attention(scores_source.squeeze(-1), scores_target.squeeze(-1), nodes_features_proj, connectivity_mask).transpose(0, 1)
+            out_nodes_features = self.skip_concat_bias(None, in_nodes_features, out_nodes_features)
+            return (out_nodes_features, connectivity_mask)
+
         # shape = (NH, N, 1) + (NH, 1, N) -> (NH, N, N) with the magic of automatic broadcast <3
         # In Implementation 3 we are much smarter and don't have to calculate all NxN scores! (only E!)
         # Tip: it's conceptually easier to understand what happens here if you delete the NH dimension
@@ -503,3 +1004,32 @@ def get_layer_type(layer_type):
         raise Exception(f'Layer type {layer_type} not yet supported.')
 
 
+def is_sparse_csr(tensor):
+    return tensor.layout == torch.sparse_csr
+
+
+def unpack_connectivity_mask_tile(connectivity_mask, col_start, col_end):
+    # Boolean masks are already in the right format
+    if connectivity_mask.dtype == torch.bool:
+        return connectivity_mask[:, col_start:col_end]
+
+    # Bit-packed masks (little bit order), shape = (TR, TC/8) -> (TR, TC/8, 8) -> (TR, TC)
+    assert col_start % 8 == 0, f'Expected tiles aligned to bytes got col_start={col_start}.'
+    packed_tile = connectivity_mask[:, col_start // 8:(col_end + 7) // 8]
+    bit_shifts = torch.arange(8, dtype=torch.uint8, device=connectivity_mask.device)
+    tile_mask = (packed_tile.unsqueeze(-1) >> bit_shifts) & 1
+
+    return tile_mask.flatten(start_dim=1)[:, :col_end - col_start].bool()
+
+
+def get_autocast_dtype(precision):
+    assert isinstance(precision, Precision), f'Expected {Precision} got {type(precision)}.'
+
+    if precision == Precision.BF16:
+        return torch.bfloat16
+    elif precision == Precision.FP16:
+        return torch.float16
+    else:
+        raise Exception(f'Precision {precision} does not need autocast.')
+
+
@@ -0,0 +1,209 @@
+"""
+    Fused neighborhood attention for GAT implementation #3.
+
+    The default imp3 path lifts the projected node features into a (E, NH, FOUT) tensor, weights it by the attention
+    coefficients and scatter-adds it back into (N, NH, FOUT). Autograd keeps that lifted tensor alive (and creates
+    another one of the same size for its gradient) which, for graphs with tens of millions of edges, is where most of
+    the peak memory goes.
+
+    The function below does the neighborhood-aware softmax and the weighted aggregation in one go over a target-sorted
+    (CSR) edge ordering. Only per-edge scores (E, NH) are ever kept around, the (E, NH, FOUT) products are computed
+    in chunks of edges and immediately reduced into the output, both in the forward and in the (hand-written) backward.
+
+    The recomputed variant (used by the checkpointed layers) goes one step further - it keeps no per-edge scores at all
+    (only the bool dropout mask). Every pass goes over chunks of edges and the softmax is rebuilt from the per-node
+    maxes and sums (N, NH), the backward recomputes the scores chunk by chunk. More compute, but the memory grows with
+    N (+ the chunk size) instead of with E.
+
+"""
+
+import torch
+
+
+class FusedNeighborhoodAttention(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, scores_source, scores_target, nodes_features_proj, src_index, trg_index, dropout_mask, dropout_scale, negative_slope, chunk_size):
+        """
+        scores_source/scores_target shape = (N, NH), nodes_features_proj shape = (N, NH, FOUT)
+        src_index/trg_index shape = (E), the edges are expected to be sorted by the target node (CSR ordering)
+        dropout_mask shape = (E, NH) bool (True - keep) or None if we're not dropping the attention, the kept attention
+        coefficients are scaled by dropout_scale (1/(1-p))
+
+        The softmax is computed in the scores' dtype (keep those in fp32) and the aggregation in the features' dtype
+        (which may be bf16/fp16 in mixed precision).
+
+        Returns the aggregated node features (N, NH, FOUT) and the attention coefficients (E, NH).
+
+        """
+        num_of_nodes = nodes_features_proj.shape[0]
+
+        # Same as imp3's lift + leakyReLU except we only lift the (E, NH) scores and never the features
+        _, scores_per_edge = lift_scores(scores_source, scores_target, src_index, trg_index, negative_slope)
+
+        # Neighborhood aware softmax (check out GATLayerImp3.neighborhood_aware_softmax for the details)
+        trg_index_broadcasted = trg_index.unsqueeze(-1).expand_as(scores_per_edge)
+        neighborhood_maxes = torch.full_like(scores_source, float('-inf')).scatter_reduce_(0, trg_index_broadcasted, scores_per_edge, reduce='amax')
+        exp_scores_per_edge = (scores_per_edge - neighborhood_maxes.index_select(0, trg_index)).exp()
+        neighborhood_sums = torch.zeros_like(scores_source).index_add_(0, trg_index, exp_scores_per_edge)
+        probabilities_per_edge = exp_scores_per_edge / (neighborhood_sums.index_select(0, trg_index) + 1e-16)
+
+        attentions_per_edge = probabilities_per_edge if dropout_mask is None else probabilities_per_edge * dropout_mask * dropout_scale
+
+        # Aggregation - since edges are sorted by target every chunk touches a contiguous block of output rows
+        out_nodes_features = nodes_features_proj.new_zeros((num_of_nodes,) + nodes_features_proj.shape[1:])
+        for start in range(0, src_index.shape[0], chunk_size):
+            src_chunk = src_index[start:start + chunk_size]
+            trg_chunk = trg_index[start:start + chunk_size]
+            # shape = (C, NH, FOUT) * (C, NH, 1), where C is the chunk size (C << E)
+            weighted_chunk = nodes_features_proj.index_select(0, src_chunk) * attentions_per_edge[start:start + chunk_size].unsqueeze(-1).to(nodes_features_proj.dtype)
+            out_nodes_features.index_add_(0, trg_chunk, weighted_chunk)
+
+        # Everything we save is either (N, ...) or (E, NH) - the whole point of this function
+        ctx.save_for_backward(scores_source, scores_target, nodes_features_proj, src_index, trg_index, probabilities_per_edge, dropout_mask)
+        ctx.dropout_scale = dropout_scale
+        ctx.negative_slope = negative_slope
+        ctx.chunk_size = chunk_size
+        ctx.mark_non_differentiable(attentions_per_edge)  # only returned for logging/visualization purposes
+
+        return out_nodes_features, attentions_per_edge
+
+    @staticmethod
+    def backward(ctx, grad_out_nodes_features, grad_attentions_unused):
+        scores_source, scores_target, nodes_features_proj, src_index, trg_index, probabilities_per_edge, dropout_mask = ctx.saved_tensors
+        chunk_size = ctx.chunk_size
+
+        attentions_per_edge = probabilities_per_edge if dropout_mask is None else probabilities_per_edge * dropout_mask * ctx.dropout_scale
+
+        # out_i = sum_j a_ji * h_j, hence dL/dh_j = sum_i a_ji * dL/dout_i and dL/da_ji = <dL/dout_i, h_j>
+        grad_nodes_features_proj = torch.zeros_like(nodes_features_proj)
+        grad_attentions_per_edge = torch.empty_like(probabilities_per_edge)
+        for start in range(0, src_index.shape[0], chunk_size):
+            src_chunk = src_index[start:start + chunk_size]
+            trg_chunk = trg_index[start:start + chunk_size]
+            grad_out_chunk = grad_out_nodes_features.index_select(0, trg_chunk)  # shape = (C, NH, FOUT)
+
+            grad_attentions_per_edge[start:start + chunk_size] = (grad_out_chunk * nodes_features_proj.index_select(0, src_chunk)).sum(dim=-1, dtype=grad_attentions_per_edge.dtype)
+            grad_nodes_features_proj.index_add_(0, src_chunk, grad_out_chunk * attentions_per_edge[start:start + chunk_size].unsqueeze(-1).to(grad_out_chunk.dtype))
+
+        # Backprop through the dropout
+        grad_probabilities_per_edge = grad_attentions_per_edge if dropout_mask is None else grad_attentions_per_edge * dropout_mask * ctx.dropout_scale
+
+        # Backprop through the neighborhood softmax: ds_ji = p_ji * (dp_ji - sum_k p_ki * dp_ki), k - i's neighbors
+        weighted_sums = torch.zeros_like(scores_source).index_add_(0, trg_index, probabilities_per_edge * grad_probabilities_per_edge)
+        grad_scores_per_edge = probabilities_per_edge * (grad_probabilities_per_edge - weighted_sums.index_select(0, trg_index))
+
+        # Backprop through the leakyReLU (recompute the raw scores instead of storing yet another (E, NH) tensor)
+        scores_per_edge_raw = scores_source.index_select(0, src_index) + scores_target.index_select(0, trg_index)
+        grad_scores_per_edge = torch.where(scores_per_edge_raw > 0, grad_scores_per_edge, grad_scores_per_edge * ctx.negative_slope)
+
+        # And finally through the lift - edges scatter their gradients back into the nodes they were lifted from
+        grad_scores_source = torch.zeros_like(scores_source).index_add_(0, src_index, grad_scores_per_edge)
+        grad_scores_target = torch.zeros_like(scores_target).index_add_(0, trg_index, grad_scores_per_edge)
+
+        return grad_scores_source, grad_scores_target, grad_nodes_features_proj, None, None, None, None, None, None
+
+
+class RecomputedNeighborhoodAttention(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, scores_source, scores_target, nodes_features_proj, src_index, trg_index, dropout_mask, dropout_scale, negative_slope, chunk_size, return_attentions):
+        """
+        Same inputs and outputs as FusedNeighborhoodAttention.forward except that the attention coefficients (E, NH)
+        are only materialized if return_attentions is set (otherwise None is returned in their place).
+
+        """
+        num_of_nodes, num_of_edges = nodes_features_proj.shape[0], src_index.shape[0]
+
+        # Pass 1 and 2: per-neighborhood max and sum of the exp scores, shape = (N, NH)
+        neighborhood_maxes = torch.full_like(scores_source, float('-inf'))
+        for start in range(0, num_of_edges, chunk_size):
+            trg_chunk = trg_index[start:start + chunk_size]
+            _, scores_chunk = lift_scores(scores_source, scores_target, src_index[start:start + chunk_size], trg_chunk, negative_slope)
+            neighborhood_maxes.scatter_reduce_(0, trg_chunk.unsqueeze(-1).expand_as(scores_chunk), scores_chunk, reduce='amax')
+
+        neighborhood_sums = torch.zeros_like(scores_source)
+        for start in range(0, num_of_edges, chunk_size):
+            trg_chunk = trg_index[start:start + chunk_size]
+            _, scores_chunk = lift_scores(scores_source, scores_target, src_index[start:start + chunk_size], trg_chunk, negative_slope)
+            neighborhood_sums.index_add_(0, trg_chunk, (scores_chunk - neighborhood_maxes.index_select(0, trg_chunk)).exp())
+
+        # Pass 3: attention coefficients of the chunk and the aggregation
+        out_nodes_features = nodes_features_proj.new_zeros((num_of_nodes,) + nodes_features_proj.shape[1:])
+        attentions_per_edge = scores_source.new_empty((num_of_edges, scores_source.shape[-1])) if return_attentions else None
+        for start in range(0, num_of_edges, chunk_size):
+            src_chunk, trg_chunk = src_index[start:start + chunk_size], trg_index[start:start + chunk_size]
+            _, probabilities_chunk = recompute_probabilities(scores_source, scores_target, src_chunk, trg_chunk, neighborhood_maxes, neighborhood_sums, negative_slope)
+            attentions_chunk = probabilities_chunk if dropout_mask is None else probabilities_chunk * dropout_mask[start:start + chunk_size] * dropout_scale
+            out_nodes_features.index_add_(0, trg_chunk, nodes_features_proj.index_select(0, src_chunk) * attentions_chunk.unsqueeze(-1).to(nodes_features_proj.dtype))
+            if attentions_per_edge is not None:
+                attentions_per_edge[start:start + chunk_size] = attentions_chunk
+
+        # Nothing per-edge except for the (bool) dropout mask
+        ctx.save_for_backward(scores_source, scores_target, nodes_features_proj, src_index, trg_index, neighborhood_maxes, neighborhood_sums, dropout_mask)
+        ctx.dropout_scale = dropout_scale
+        ctx.negative_slope = negative_slope
+        ctx.chunk_size = chunk_size
+        if attentions_per_edge is not None:
+            ctx.mark_non_differentiable(attentions_per_edge)  # only returned for logging/visualization purposes
+
+        return out_nodes_features, attentions_per_edge
+
+    @staticmethod
+    def backward(ctx, grad_out_nodes_features, grad_attentions_unused):
+        scores_source, scores_target, nodes_features_proj, src_index, trg_index, neighborhood_maxes, neighborhood_sums, dropout_mask = ctx.saved_tensors
+        num_of_edges, chunk_size = src_index.shape[0], ctx.chunk_size
+
+        def backprop_chunk_aggregation(start):
+            # Same as the first part of FusedNeighborhoodAttention.backward, just for a single chunk of edges
+            src_chunk, trg_chunk = src_index[start:start + chunk_size], trg_index[start:start + chunk_size]
+            scores_raw_chunk, probabilities_chunk = recompute_probabilities(scores_source, scores_target, src_chunk, trg_chunk, neighborhood_maxes, neighborhood_sums, ctx.negative_slope)
+            dropout_mask_chunk = None if dropout_mask is None else dropout_mask[start:start + chunk_size] * ctx.dropout_scale
+            attentions_chunk = probabilities_chunk if dropout_mask_chunk is None else probabilities_chunk * dropout_mask_chunk
+
+            grad_out_chunk = grad_out_nodes_features.index_select(0, trg_chunk)  # shape = (C, NH, FOUT)
+            grad_attentions_chunk = (grad_out_chunk * nodes_features_proj.index_select(0, src_chunk)).sum(dim=-1, dtype=probabilities_chunk.dtype)
+            grad_probabilities_chunk = grad_attentions_chunk if dropout_mask_chunk is None else grad_attentions_chunk * dropout_mask_chunk
+
+            return src_chunk, trg_chunk, scores_raw_chunk, probabilities_chunk, attentions_chunk, grad_out_chunk, grad_probabilities_chunk
+
+        # Pass 1: gradient of the projected features and the softmax's per-neighborhood sum_k p_ki * dp_ki, shape = (N, NH)
+        grad_nodes_features_proj = torch.zeros_like(nodes_features_proj)
+        weighted_sums = torch.zeros_like(scores_source)
+        for start in range(0, num_of_edges, chunk_size):
+            src_chunk, trg_chunk, _, probabilities_chunk, attentions_chunk, grad_out_chunk, grad_probabilities_chunk = backprop_chunk_aggregation(start)
+            grad_nodes_features_proj.index_add_(0, src_chunk, grad_out_chunk * attentions_chunk.unsqueeze(-1).to(grad_out_chunk.dtype))
+            weighted_sums.index_add_(0, trg_chunk, probabilities_chunk * grad_probabilities_chunk)
+
+        # Pass 2: backprop through the softmax, the leakyReLU and the lift (check out FusedNeighborhoodAttention.backward)
+        grad_scores_source = torch.zeros_like(scores_source)
+        grad_scores_target = torch.zeros_like(scores_target)
+        for start in range(0, num_of_edges, chunk_size):
+            src_chunk, trg_chunk, scores_raw_chunk, probabilities_chunk, _, _, grad_probabilities_chunk = backprop_chunk_aggregation(start)
+            grad_scores_chunk = probabilities_chunk * (grad_probabilities_chunk - weighted_sums.index_select(0, trg_chunk))
+            grad_scores_chunk = torch.where(scores_raw_chunk > 0, grad_scores_chunk, grad_scores_chunk * ctx.negative_slope)
+            grad_scores_source.index_add_(0, src_chunk, grad_scores_chunk)
+            grad_scores_target.index_add_(0, trg_chunk, grad_scores_chunk)
+
+        return grad_scores_source, grad_scores_target, grad_nodes_features_proj, None, None, None, None, None, None, None
+
+
+def lift_scores(scores_source, scores_target, src_index, trg_index, negative_slope):
+    # shape = (N, NH) -> (E, NH), returns the scores before and after the leakyReLU
+    scores_per_edge_raw = scores_source.index_select(0, src_index) + scores_target.index_select(0, trg_index)
+    return scores_per_edge_raw, torch.nn.functional.leaky_relu(scores_per_edge_raw, negative_slope)
+
+
+def recompute_probabilities(scores_source, scores_target, src_index, trg_index, neighborhood_maxes, neighborhood_sums, negative_slope):
+    # Softmax of the edges given the per-neighborhood max and sum (N, NH), returns the raw scores and the probabilities
+    scores_per_edge_raw, scores_per_edge = lift_scores(scores_source, scores_target, src_index, trg_index, negative_slope)
+    exp_scores_per_edge = (scores_per_edge - neighborhood_maxes.index_select(0, trg_index)).exp()
+    return scores_per_edge_raw, exp_scores_per_edge / (neighborhood_sums.index_select(0, trg_index) + 1e-16)
+
+
+def fused_neighborhood_attention(scores_source, scores_target, nodes_features_proj, src_index, trg_index, dropout_mask=None, dropout_scale=1., negative_slope=0.2, chunk_size=2**16):
+    return FusedNeighborhoodAttention.apply(scores_source, scores_target, nodes_features_proj, src_index, trg_index, dropout_mask, dropout_scale, negative_slope, chunk_size)
+
+
+def recomputed_neighborhood_attention(scores_source, scores_target, nodes_features_proj, src_index, trg_index, dropout_mask=None, dropout_scale=1., negative_slope=0.2, chunk_size=2**16, return_attentions=False):
+    return RecomputedNeighborhoodAttention.apply(scores_source, scores_target, nodes_features_proj, src_index, trg_index, dropout_mask, dropout_scale, negative_slope, chunk_size, return_attentions)
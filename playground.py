@@ -1,9 +1,15 @@
 import time
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
 from collections import defaultdict
 
 
 import torch
+import torch.multiprocessing as mp
 import scipy.sparse as sp
 from scipy.stats import entropy
 from sklearn.manifold import TSNE
@@ -13,11 +19,23 @@ import igraph as ig
 
 
 from utils.data_loading import normalize_features_sparse, normalize_features_dense, pickle_save, pickle_read, load_graph_data
-from utils.constants import CORA_PATH, BINARIES_PATH, DatasetType, LayerType, DATA_DIR_PATH, cora_label_to_color_map, VisualizationType
+from utils.data_loading import build_edge_index, build_edge_index_loop, build_edge_index_nx, load_or_convert_cora_graph_store
+from utils.constants import CORA_PATH, CORA_STORE_PATH, BINARIES_PATH, DatasetType, LayerType, NodeOrdering, Precision, SearchType, DATA_DIR_PATH, cora_label_to_color_map, VisualizationType
 from utils.visualizations import draw_entropy_histogram
 from models.definitions.GAT import GAT
-from utils.utils import print_model_metadata, convert_adj_to_edge_index, name_to_layer_type
-from training_script import train_gat, get_training_args
+from utils.utils import print_model_metadata, convert_adj_to_edge_index, name_to_layer_type, get_training_state, get_commit_hash, get_available_binary_name
+from utils.incremental_inference import IncrementalGATInference
+from utils.graph_store import open_graph_store, compress_graph_store_topology, read_edge_index, compressed_topology_array_names
+from utils.topology_compression import compress_topology, decompress_topology
+from utils.connectivity_mask import build_connectivity_mask, build_connectivity_mask_nx
+from utils.ingestion import ingest_graph
+from utils.quantization import quantize_binary, load_quantized_gat
+from utils.reordering import NodeReordering
+from utils.graph import Graph
+from utils.shared_graph import SharedGraphData
+from utils.checkpointing import CheckpointManager
+from training_script import train_gat, train_gat_distributed, train_gat_replicas, get_training_args, get_gat
+from sweep import run_sweep, DEFAULT_SEARCH_SPACE
 
 
 def profile_sparse_matrix_formats(node_features_csr):
@@ -60,6 +78,112 @@ def to_GBs(memory_in_bytes):  # beautify memory output - helper function
     return f'{memory_in_bytes / 2**30:.2f} GBs'
 
 
+def profile_edge_index_construction(num_of_nodes=200000, avg_num_of_neighbors=10):
+    """
+    Compares the vectorized build_edge_index against the original Python loop and the networkx-based builder, on Cora
+    and on a random graph (adjacency list dict) with num_of_nodes * avg_num_of_neighbors edges (with duplicates).
+
+    """
+    cora_adjacency_list_dict = pickle_read(os.path.join(CORA_PATH, 'adjacency_list.dict'))
+
+    rng = np.random.default_rng(0)
+    num_of_neighbors = rng.poisson(avg_num_of_neighbors, size=num_of_nodes)
+    source_nodes_ids = np.repeat(np.arange(num_of_nodes), num_of_neighbors)
+    # Shift away from the source node so that there are no self edges (build_edge_index_loop doesn't remove those)
+    neighbors = (source_nodes_ids + rng.integers(1, num_of_nodes, size=len(source_nodes_ids))) % num_of_nodes
+    random_adjacency_list_dict = {node_id: list(node_neighbors) for node_id, node_neighbors in enumerate(np.split(neighbors, np.cumsum(num_of_neighbors)[:-1]))}
+
+    for graph_name, adjacency_list_dict in [('Cora', cora_adjacency_list_dict), ('random', random_adjacency_list_dict)]:
+        graph_num_of_nodes = len(adjacency_list_dict)
+        print(f'{graph_name} graph, {graph_num_of_nodes} nodes and {sum(map(len, adjacency_list_dict.values()))} edges (with duplicates):')
+
+        builders = [
+            ('vectorized', lambda: build_edge_index(adjacency_list_dict, graph_num_of_nodes, add_self_edges=True)),
+            ('vectorized sorted', lambda: build_edge_index(adjacency_list_dict, graph_num_of_nodes, add_self_edges=True, keep_input_order=False)),
+            ('python loop', lambda: build_edge_index_loop(adjacency_list_dict, graph_num_of_nodes, add_self_edges=True)),
+            ('networkx', lambda: build_edge_index_nx(adjacency_list_dict))
+        ]
+        for builder_name, builder in builders:
+            ts = time.time()
+            edge_index = builder()
+            print(f'{builder_name:>20}: {time.time() - ts:.3f} [s], E = {edge_index.shape[1]}')
+
+        # The vectorized builder produces exactly the same edge index as the loop (same edges, same order)
+        assert np.array_equal(builders[0][1](), builders[2][1]()), 'Vectorized edge index differs from the loop one.'
+
+
+def profile_streaming_ingestion(num_of_nodes=100000, avg_num_of_neighbors=20, num_of_features=10000, avg_num_of_nonzero_features=20, chunk_size=2**18):
+    """
+    Writes a random graph as text files (edge list, sparse feature triplets and labels) and ingests it out-of-core into
+    a graph store (check out utils/ingestion.py), reporting rows/sec and peak RSS. The result is checked against the
+    in-memory builders (build_edge_index and scipy's CSR).
+
+    """
+    rng = np.random.default_rng(0)
+    num_of_edges, num_of_nonzeros = num_of_nodes * avg_num_of_neighbors, num_of_nodes * avg_num_of_nonzero_features
+    edges = rng.integers(0, num_of_nodes, size=(num_of_edges, 2))
+    features_rows, features_cols = rng.integers(0, num_of_nodes, size=num_of_nonzeros), rng.integers(0, num_of_features, size=num_of_nonzeros)
+    features_values = rng.random(num_of_nonzeros, dtype=np.float32)
+    labels = rng.integers(0, 7, size=num_of_nodes)
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        edge_list_path, features_path, labels_path = [os.path.join(tmp_dir_path, file_name) for file_name in ['edges.tsv', 'features.tsv', 'labels.tsv']]
+        np.savetxt(edge_list_path, edges, fmt='%d', delimiter='\t')
+        # %.9g round-trips float32 exactly, so the reference below can use the unrounded values
+        np.savetxt(features_path, np.column_stack([features_rows, features_cols, features_values]), fmt=['%d', '%d', '%.9g'], delimiter='\t')
+        with open(labels_path, 'w') as file:
+            file.writelines(f'{node_id}\t{label}\t{"train" if node_id < 1000 else "test"}\n' for node_id, label in enumerate(labels))
+
+        store_path = os.path.join(tmp_dir_path, 'store')
+        stats = ingest_graph(store_path, edge_list_path, features_path, labels_path, num_of_nodes=num_of_nodes, chunk_size=chunk_size)
+        print(f'Rows/sec = {stats["rows_per_second"]:.0f}, peak RSS of this process = {to_GBs(stats["peak_rss_bytes"])} (chunk size = {chunk_size}).')
+
+        manifest, graph_arrays = open_graph_store(store_path)
+        edge_index = build_edge_index((edges[:, 0], edges[:, 1]), num_of_nodes, add_self_edges=True, keep_input_order=False)
+        # build_edge_index appends the self edges at the end, the store has everything sorted by (source, target)
+        edge_index = edge_index[:, np.lexsort((edge_index[1], edge_index[0]))]
+        assert np.array_equal(graph_arrays['edge_index'], edge_index), 'Ingested edge index differs from the in-memory one.'
+
+        # Duplicates - the first occurrence wins (scipy would sum them up so dedup first)
+        _, first_occurrence_ids = np.unique(features_rows * num_of_features + features_cols, return_index=True)
+        node_features_csr = normalize_features_sparse(sp.csr_matrix((features_values[first_occurrence_ids], (features_rows[first_occurrence_ids], features_cols[first_occurrence_ids])), shape=(num_of_nodes, manifest['num_of_features'])))
+        ingested_node_features_csr = sp.csr_matrix((graph_arrays['features_data'], graph_arrays['features_indices'], graph_arrays['features_indptr']), shape=node_features_csr.shape)
+        assert abs(node_features_csr - ingested_node_features_csr).max() < 1e-6, 'Ingested node features differ from the in-memory ones.'
+        assert np.array_equal(graph_arrays['labels'], labels) and graph_arrays['train_mask'].sum() == 1000
+        print('Ingested graph store matches the in-memory graph.')
+
+
+def profile_startup_time(num_of_runs=5):
+    """
+    Cold start of a short-lived process: importing training_script and a whole `training_script.py --num_of_epochs 1`
+    run (fresh interpreter every time, so nothing is cached in sys.modules - only the OS file cache is warm).
+
+    """
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        'import training_script': [sys.executable, '-c', 'import training_script'],
+        'training_script.py --num_of_epochs 1': [sys.executable, 'training_script.py', '--num_of_epochs', '1']
+    }
+    runs_path = os.path.join(project_dir, 'runs')
+    existing_binaries = set(os.listdir(BINARIES_PATH))
+    num_of_existing_runs = len(os.listdir(runs_path)) if os.path.exists(runs_path) else 0
+
+    for name, command in commands.items():
+        subprocess.run(command, cwd=project_dir, check=True, capture_output=True)  # warm up the OS file cache
+        timings = []
+        for _ in range(num_of_runs):
+            ts = time.time()
+            subprocess.run(command, cwd=project_dir, check=True, capture_output=True)
+            timings.append(time.time() - ts)
+        print(f'{name}: {np.median(timings):.2f} [s] (median of {num_of_runs} runs)')
+
+    # The 1 epoch runs don't need their binaries and without --enable_tensorboard nothing should end up in runs/
+    for binary_name in set(os.listdir(BINARIES_PATH)) - existing_binaries:
+        os.remove(os.path.join(BINARIES_PATH, binary_name))
+    num_of_runs_dirs = (len(os.listdir(runs_path)) if os.path.exists(runs_path) else 0) - num_of_existing_runs
+    print(f'Tensorboard run directories created: {num_of_runs_dirs}.')
+
+
 def profile_gat_implementations(skip_if_profiling_info_cached=False, store_cache=False):
     """
     Currently for 500 epochs of GAT training the time and memory consumption are  (on my machine - RTX 2080):
@@ -144,6 +268,748 @@ def profile_gat_implementations(skip_if_profiling_info_cached=False, store_cache
         print(f'Max mem allocated = {to_GBs(max_memory_allocated)}, max mem reserved = {to_GBs(max_memory_reserved)}.')
 
 
+def validate_imp3_against_dense_implementation(dense_layer_type=LayerType.IMP2, tolerance=1e-4):
+    """
+    Uses imp1/imp2 (the dense reference implementations) to validate imp3 on the same weights and the same graph.
+
+    With the tiled attention (bit-packed mask, no NxN tensors) this is feasible on graphs way bigger than Cora.
+
+    Note: imp1/imp2 apply the "source" scoring fn to the node whose neighborhood is being aggregated (the row of the
+    attention matrix) which is what imp3 calls the target node - so the 2 scoring vectors swap places below.
+
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    training_config = get_training_args()
+
+    imp3_config = {'dataset_name': training_config['dataset_name'], 'layer_type': LayerType.IMP3, 'should_visualize': False}
+    dense_config = {**imp3_config, 'layer_type': dense_layer_type, 'tiled_attention': True}
+    node_features, _, graph, _, _, _ = load_graph_data(imp3_config, device)
+    _, _, packed_connectivity_mask, _, _, _ = load_graph_data(dense_config, device)
+
+    gat_models = {}
+    for layer_type in [dense_layer_type, LayerType.IMP3]:
+        gat_models[layer_type] = GAT(
+            num_of_layers=training_config['num_of_layers'],
+            num_heads_per_layer=training_config['num_heads_per_layer'],
+            num_features_per_layer=training_config['num_features_per_layer'],
+            add_skip_connection=training_config['add_skip_connection'],
+            bias=training_config['bias'],
+            dropout=training_config['dropout'],
+            layer_type=layer_type
+        ).to(device).eval()
+
+    # Copy the weights from imp3 into the dense implementation (imp1 keeps them in a slightly different shape)
+    dense_gat, imp3_gat = gat_models[dense_layer_type], gat_models[LayerType.IMP3]
+    with torch.no_grad():
+        for dense_layer, imp3_layer in zip(dense_gat.gat_net, imp3_gat.gat_net):
+            if dense_layer_type == LayerType.IMP1:
+                # shape = (NH*FOUT, FIN) -> (FIN, NH, FOUT) -> (NH, FIN, FOUT)
+                dense_layer.proj_param.copy_(imp3_layer.linear_proj.weight.t().view(-1, imp3_layer.num_of_heads, imp3_layer.num_out_features).transpose(0, 1))
+            else:
+                dense_layer.linear_proj.weight.copy_(imp3_layer.linear_proj.weight)
+            dense_layer.scoring_fn_source.copy_(imp3_layer.scoring_fn_target.view_as(dense_layer.scoring_fn_source))
+            dense_layer.scoring_fn_target.copy_(imp3_layer.scoring_fn_source.view_as(dense_layer.scoring_fn_target))
+            if imp3_layer.bias is not None:
+                dense_layer.bias.copy_(imp3_layer.bias)
+            if imp3_layer.skip_proj is not None:
+                dense_layer.skip_proj.weight.copy_(imp3_layer.skip_proj.weight)
+
+        imp3_out = imp3_gat((node_features, graph))[0]
+        dense_out = dense_gat((node_features, packed_connectivity_mask))[0]
+
+    max_abs_diff = (imp3_out - dense_out).abs().max().item()
+    print(f'Max abs difference between {LayerType.IMP3.name} and {dense_layer_type.name} (tiled) = {max_abs_diff}')
+    assert max_abs_diff < tolerance, f'{LayerType.IMP3.name} and {dense_layer_type.name} outputs differ.'
+
+
+def profile_compiled_gat(num_of_epochs=100, num_of_warmup_epochs=5):
+    """
+    Per-epoch (forward + backward + optimizer step) CPU time of the imp3 GAT in eager mode vs in compile mode.
+
+    """
+    device = torch.device('cpu')
+    config = {
+        'dataset_name': DatasetType.CORA.name,
+        'layer_type': LayerType.IMP3,
+        'should_visualize': False
+    }
+    node_features, node_labels, graph, train_indices, _, _ = load_graph_data(config, device)
+    training_config = get_training_args()
+
+    for compile_mode in [False, True]:
+        torch.manual_seed(0)
+        gat = GAT(
+            num_of_layers=training_config['num_of_layers'],
+            num_heads_per_layer=training_config['num_heads_per_layer'],
+            num_features_per_layer=training_config['num_features_per_layer'],
+            add_skip_connection=training_config['add_skip_connection'],
+            bias=training_config['bias'],
+            dropout=training_config['dropout'],
+            layer_type=LayerType.IMP3,
+            compile=compile_mode
+        ).to(device)
+        gat.train()
+        optimizer = torch.optim.Adam(gat.parameters(), lr=training_config['lr'], weight_decay=training_config['weight_decay'])
+        loss_fn = torch.nn.CrossEntropyLoss()
+
+        def training_epoch():
+            nodes_unnormalized_scores = gat((node_features, graph))[0].index_select(0, train_indices)
+            loss = loss_fn(nodes_unnormalized_scores, node_labels.index_select(0, train_indices))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        # The warmup epochs also include the compilation time (first forward/backward)
+        ts = time.time()
+        for _ in range(num_of_warmup_epochs):
+            training_epoch()
+        warmup_time = time.time() - ts
+
+        ts = time.time()
+        for _ in range(num_of_epochs):
+            training_epoch()
+        epoch_time = (time.time() - ts) / num_of_epochs
+
+        print(f'{"Compiled" if compile_mode else "Eager"} imp3 GAT: {epoch_time * 1000:.2f} [ms] per epoch (warmup took {warmup_time:.2f} [s]).')
+
+
+def build_shuffled_local_graph(num_of_nodes, avg_num_of_neighbors, rng):
+    # Neighbors are nearby on a ring, then the node ids get shuffled - edge index shape = (2, E), with self edges
+    ring_offsets = rng.integers(-avg_num_of_neighbors * 5, avg_num_of_neighbors * 5 + 1, size=num_of_nodes * avg_num_of_neighbors)
+    source_nodes_ids = np.repeat(np.arange(num_of_nodes), avg_num_of_neighbors)
+    shuffled_ids = rng.permutation(num_of_nodes)
+    graph = (shuffled_ids[source_nodes_ids], shuffled_ids[(source_nodes_ids + ring_offsets) % num_of_nodes])
+    return build_edge_index(graph, num_of_nodes, add_self_edges=True, symmetrize=True)
+
+
+def training_epochs_worker(rank, gat_kwargs, index_dtype, num_of_nodes, avg_num_of_neighbors, num_of_features, num_of_epochs, results_queue):
+    rng = np.random.default_rng(0)
+    edge_index = torch.from_numpy(build_shuffled_local_graph(num_of_nodes, avg_num_of_neighbors, rng))
+    node_features = torch.randn((num_of_nodes, num_of_features))
+    node_labels = torch.from_numpy(rng.integers(0, 7, size=num_of_nodes))
+
+    graph = Graph(edge_index.to(index_dtype), num_of_nodes)
+    del edge_index
+    torch.manual_seed(0)
+    gat = GAT(num_of_layers=2, num_heads_per_layer=[8, 1], num_features_per_layer=[num_of_features, 8, 7], dropout=0.6, layer_type=LayerType.IMP3, **gat_kwargs)
+    optimizer = torch.optim.Adam(gat.parameters(), lr=5e-3)
+    loss_fn = torch.nn.CrossEntropyLoss()
+
+    def training_epoch():
+        loss = loss_fn(gat((node_features, graph))[0], node_labels)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    # Peak = the highest RSS during the training epochs minus the RSS once everything is loaded (the graph building
+    # temporaries above don't count)
+    rss_before = reset_peak_rss_in_bytes()
+    training_epoch()  # warmup
+    ts = time.time()
+    for _ in range(num_of_epochs):
+        training_epoch()
+    epoch_time = (time.time() - ts) / num_of_epochs
+
+    edge_index_size = graph.edge_index.numel() * graph.edge_index.element_size()
+    results_queue.put((epoch_time, edge_index_size, get_peak_rss_in_bytes() - rss_before))
+
+
+def profile_training_epochs(gat_kwargs, index_dtype, num_of_nodes, avg_num_of_neighbors, num_of_features, num_of_epochs):
+    """
+    Trains the imp3 GAT (+ gat_kwargs) on the synthetic graph from profile_node_reordering, returns the time per epoch,
+    the edge index size and the peak memory of the training epochs (on top of the loaded graph and model).
+
+    Every run gets a fresh process - otherwise the memory the allocator keeps around from a previous run would hide the
+    peak of the next one. The process also gets every allocation bigger than 64 KBs straight from mmap (and returns it
+    to the OS once it's freed), otherwise glibc keeps the freed blocks around and the peak RSS is mostly allocator noise.
+
+    """
+    malloc_mmap_threshold = os.environ.get('MALLOC_MMAP_THRESHOLD_')
+    os.environ['MALLOC_MMAP_THRESHOLD_'] = str(2**16)  # read by glibc on the (spawned) process startup
+    try:
+        results_queue = mp.get_context('spawn').SimpleQueue()
+        mp.spawn(training_epochs_worker, args=(gat_kwargs, index_dtype, num_of_nodes, avg_num_of_neighbors, num_of_features, num_of_epochs, results_queue), nprocs=1, join=True)
+    finally:
+        if malloc_mmap_threshold is None:
+            del os.environ['MALLOC_MMAP_THRESHOLD_']
+        else:
+            os.environ['MALLOC_MMAP_THRESHOLD_'] = malloc_mmap_threshold
+
+    return results_queue.get()
+
+
+def profile_int32_indices(num_of_nodes=100000, avg_num_of_neighbors=5, num_of_features=64, num_of_epochs=10):
+    """
+    Per-epoch (forward + backward + optimizer step) CPU time, edge index memory and the peak memory of the training
+    epochs of the imp3 GAT with int64 vs int32 edge index (same synthetic graph as in profile_node_reordering).
+
+    """
+    for index_dtype in [torch.int64, torch.int32]:
+        epoch_time, edge_index_size, peak_memory = profile_training_epochs({}, index_dtype, num_of_nodes, avg_num_of_neighbors, num_of_features, num_of_epochs)
+        print(f'{str(index_dtype):>11}: {epoch_time * 1000:.1f} [ms] per epoch, edge index = {edge_index_size / 2**20:.1f} MBs, '
+              f'peak training memory = {peak_memory / 2**20:.1f} MBs (on top of the loaded graph and model)')
+
+
+def validate_fused_aggregation(num_of_nodes=20000, avg_num_of_neighbors=5, num_of_features=64, tolerance=1e-5, num_of_epochs=3):
+    """
+    Checks that the fused imp3 path (check out models/definitions/fused_attention.py) computes the same outputs and
+    gradients as the default one in training mode - same seed so both have to draw the same dropout masks. Then
+    compares the time and the peak memory of their training epochs.
+
+    """
+    rng = np.random.default_rng(0)
+    graph = Graph(torch.from_numpy(build_shuffled_local_graph(num_of_nodes, avg_num_of_neighbors, rng)), num_of_nodes)
+    node_features = torch.randn((num_of_nodes, num_of_features))
+    node_labels = torch.from_numpy(rng.integers(0, 7, size=num_of_nodes))
+
+    results = {}
+    for fused_aggregation in [False, True]:
+        torch.manual_seed(0)
+        gat = GAT(num_of_layers=2, num_heads_per_layer=[8, 1], num_features_per_layer=[num_of_features, 8, 7], dropout=0.6,
+                  layer_type=LayerType.IMP3, fused_aggregation=fused_aggregation).train()
+        torch.manual_seed(1)
+        out_nodes_features = gat((node_features, graph))[0]
+        torch.nn.CrossEntropyLoss()(out_nodes_features, node_labels).backward()
+        results[fused_aggregation] = [out_nodes_features.detach()] + [param.grad for param in gat.parameters()]
+
+    max_abs_diff = max((default - fused).abs().max().item() for default, fused in zip(results[False], results[True]))
+    print(f'Max abs difference between the default and the fused {LayerType.IMP3.name} (outputs and gradients, train mode) = {max_abs_diff}')
+    assert max_abs_diff < tolerance, f'Fused {LayerType.IMP3.name} outputs/gradients differ from the default ones.'
+
+    for fused_aggregation in [False, True]:
+        epoch_time, _, peak_memory = profile_training_epochs({'fused_aggregation': fused_aggregation}, torch.int64, num_of_nodes, avg_num_of_neighbors, num_of_features, num_of_epochs)
+        print(f'fused_aggregation = {fused_aggregation}: {epoch_time * 1000:.1f} [ms] per epoch, peak training memory = {peak_memory / 2**20:.1f} MBs')
+
+
+def profile_checkpoint_layers(num_of_nodes=50000, avg_num_of_neighbors=5, num_of_features=64, num_of_epochs=3, tolerance=1e-5):
+    """
+    Checks that the checkpointed layers (activation recomputation + the recomputed fused attention, check out
+    models/definitions/fused_attention.py) compute the same outputs and gradients as the default imp3 in training mode
+    and compares the time and the peak memory of the training epochs: default vs fused vs checkpointed.
+
+    """
+    rng = np.random.default_rng(0)
+    graph = Graph(torch.from_numpy(build_shuffled_local_graph(num_of_nodes, avg_num_of_neighbors, rng)), num_of_nodes)
+    node_features = torch.randn((num_of_nodes, num_of_features))
+    node_labels = torch.from_numpy(rng.integers(0, 7, size=num_of_nodes))
+
+    results = {}
+    for checkpoint_layers in [None, True]:
+        torch.manual_seed(0)
+        gat = GAT(num_of_layers=2, num_heads_per_layer=[8, 1], num_features_per_layer=[num_of_features, 8, 7], dropout=0.6,
+                  layer_type=LayerType.IMP3, checkpoint_layers=checkpoint_layers).train()
+        torch.manual_seed(1)
+        out_nodes_features = gat((node_features, graph))[0]
+        torch.nn.CrossEntropyLoss()(out_nodes_features, node_labels).backward()
+        results[checkpoint_layers] = [out_nodes_features.detach()] + [param.grad for param in gat.parameters()]
+
+    max_abs_diff = max((default - checkpointed).abs().max().item() for default, checkpointed in zip(results[None], results[True]))
+    print(f'Max abs difference between the default and the checkpointed {LayerType.IMP3.name} (outputs and gradients, train mode) = {max_abs_diff}')
+    assert max_abs_diff < tolerance, f'Checkpointed {LayerType.IMP3.name} outputs/gradients differ from the default ones.'
+
+    for gat_kwargs in [{}, {'fused_aggregation': True}, {'checkpoint_layers': True}]:
+        epoch_time, _, peak_memory = profile_training_epochs(gat_kwargs, torch.int64, num_of_nodes, avg_num_of_neighbors, num_of_features, num_of_epochs)
+        print(f'{str(gat_kwargs):>30}: {epoch_time * 1000:.1f} [ms] per epoch, peak training memory = {peak_memory / 2**20:.1f} MBs')
+
+
+def profile_topology_compression(num_of_nodes=1000000, avg_num_of_neighbors=10, nodes_per_block=2**16):
+    """
+    Size and encode/decode speed of the compressed topology (utils/topology_compression.py) vs the raw edge index, on a
+    synthetic graph with shuffled node ids and on the same graph in RCM order (neighbors have nearby ids -> small deltas).
+    Also round-trips Cora's graph store through compress_graph_store_topology.
+
+    """
+    rng = np.random.default_rng(0)
+    edge_index = build_shuffled_local_graph(num_of_nodes, avg_num_of_neighbors, rng)
+    rcm_edge_index = NodeReordering(torch.from_numpy(edge_index), num_of_nodes, NodeOrdering.RCM).reorder_graph(
+        torch.zeros((num_of_nodes, 1)), torch.zeros(num_of_nodes), torch.from_numpy(edge_index))[2].numpy()
+
+    for ordering_name, ordered_edge_index in [('shuffled', edge_index), ('RCM', rcm_edge_index)]:
+        ts = time.time()
+        topology_arrays = compress_topology(ordered_edge_index, num_of_nodes, nodes_per_block)
+        encode_time = time.time() - ts
+
+        ts = time.time()
+        decoded_edge_index = decompress_topology(topology_arrays, nodes_per_block, dtype=np.int32)
+        decode_time = time.time() - ts
+
+        expected_edge_index = ordered_edge_index[:, np.lexsort((ordered_edge_index[0], ordered_edge_index[1]))]
+        assert np.array_equal(decoded_edge_index, expected_edge_index), 'Decoded topology differs from the edge index.'
+
+        num_of_edges = ordered_edge_index.shape[1]
+        compressed_size = sum(array.nbytes for array in topology_arrays.values())
+        print(f'{ordering_name:>8}: int64 = {to_GBs(num_of_edges * 16)}, int32 = {to_GBs(num_of_edges * 8)}, compressed = {to_GBs(compressed_size)} '
+              f'({compressed_size / num_of_edges:.2f} B/edge), encode = {num_of_edges / encode_time / 1e6:.1f} M edges/s, decode = {num_of_edges / decode_time / 1e6:.1f} M edges/s')
+
+    # The graph store route - load_graph_data reads compressed stores via read_edge_index
+    load_or_convert_cora_graph_store()
+    with tempfile.TemporaryDirectory() as store_path:
+        shutil.copytree(CORA_STORE_PATH, store_path, dirs_exist_ok=True)
+        manifest, arrays = open_graph_store(store_path)
+        cora_edge_index = np.array(arrays['edge_index'])
+        del arrays
+
+        compress_graph_store_topology(store_path)
+        manifest, arrays = open_graph_store(store_path)
+        decoded_edge_index = read_edge_index(manifest, arrays)
+        assert np.array_equal(decoded_edge_index, cora_edge_index[:, np.lexsort((cora_edge_index[0], cora_edge_index[1]))]), 'Cora topology round-trip failed.'
+        compressed_size = sum(arrays[name].nbytes for name in compressed_topology_array_names)
+        print(f'Cora store: edge index = {cora_edge_index.nbytes} B, compressed topology = {compressed_size} B.')
+        del arrays
+
+
+def profile_node_reordering(num_of_nodes=100000, avg_num_of_neighbors=5, num_of_features=64, num_of_epochs=10):
+    """
+    Per-epoch (forward + backward + optimizer step) CPU time of the imp3 GAT for every node ordering.
+
+    Cora is way too small for this (all of it fits into the cache), so we use a synthetic graph with local structure
+    (neighbors are nearby on a ring) whose node ids got shuffled - that's what real-world graph ids usually look like.
+
+    """
+    device = torch.device('cpu')
+    rng = np.random.default_rng(0)
+    edge_index = torch.from_numpy(build_shuffled_local_graph(num_of_nodes, avg_num_of_neighbors, rng))
+
+    node_features = torch.randn((num_of_nodes, num_of_features))
+    node_labels = torch.from_numpy(rng.integers(0, 7, size=num_of_nodes))
+    train_indices = torch.arange(num_of_nodes)
+
+    torch.manual_seed(0)
+    gat = GAT(num_of_layers=2, num_heads_per_layer=[8, 1], num_features_per_layer=[num_of_features, 8, 7], dropout=0.6, layer_type=LayerType.IMP3).to(device)
+    initial_state = {name: param.clone() for name, param in gat.state_dict().items()}
+
+    reference_predictions = None
+    for node_ordering in NodeOrdering:
+        ts = time.time()
+        node_reordering = NodeReordering(edge_index, num_of_nodes, node_ordering)
+        reordered_graph = node_reordering.reorder_graph(node_features, node_labels, edge_index, train_indices)
+        reordering_time = time.time() - ts
+        reordered_features, reordered_labels, reordered_edge_index, reordered_train_indices = reordered_graph
+
+        gat.load_state_dict(initial_state)
+        gat.train()
+        optimizer = torch.optim.Adam(gat.parameters(), lr=5e-3)
+        loss_fn = torch.nn.CrossEntropyLoss()
+
+        def training_epoch():
+            nodes_unnormalized_scores = gat((reordered_features, reordered_edge_index))[0].index_select(0, reordered_train_indices)
+            loss = loss_fn(nodes_unnormalized_scores, reordered_labels.index_select(0, reordered_train_indices))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        training_epoch()  # warmup
+        ts = time.time()
+        for _ in range(num_of_epochs):
+            training_epoch()
+        epoch_time = (time.time() - ts) / num_of_epochs
+
+        # GAT is permutation equivariant - mapped back to the original ids the predictions shouldn't change
+        gat.load_state_dict(initial_state)
+        gat.eval()
+        with torch.no_grad():
+            predictions = node_reordering.restore_node_order(gat((reordered_features, reordered_edge_index))[0])
+        if reference_predictions is None:
+            reference_predictions = predictions
+        assert torch.allclose(predictions, reference_predictions, atol=1e-4), f'{node_ordering.name} ordering changed the predictions.'
+
+        # Average |source id - target id| over the edges - a proxy for how far apart in memory the gathered rows are
+        edge_span = (reordered_edge_index[0] - reordered_edge_index[1]).abs().float().mean()
+        print(f'{node_ordering.name:>9}: {epoch_time * 1000:.1f} [ms] per epoch, avg edge span {edge_span:.0f} (reordering took {reordering_time:.2f} [s]).')
+
+
+def validate_connectivity_masks():
+    """
+    Checks that the connectivity masks built from the edge index (utils/connectivity_mask.py) are identical to the ones
+    the original networkx route produces, and compares their construction time and memory.
+
+    """
+    adjacency_list_dict = pickle_read(os.path.join(CORA_PATH, 'adjacency_list.dict'))
+    num_of_nodes = len(adjacency_list_dict)
+    edge_index = torch.from_numpy(build_edge_index(adjacency_list_dict, num_of_nodes, add_self_edges=True))
+
+    # tracemalloc sees NumPy allocations (but not PyTorch ones) - that's why for the new masks we report their size,
+    # which is also their peak as the temporaries are only O(E)
+    tracemalloc.start()
+    ts = time.time()
+    reference_mask = build_connectivity_mask_nx(adjacency_list_dict)
+    print(f'networkx float64 mask: {time.time() - ts:.3f} [s], {to_GBs(reference_mask.nbytes)}, peak memory = {to_GBs(tracemalloc.get_traced_memory()[1])}')
+    tracemalloc.stop()
+
+    reference_edges_mask = reference_mask == 0
+    expected_masks = {
+        torch.float32: torch.from_numpy(np.asarray(reference_mask, dtype=np.float32)),
+        torch.bfloat16: torch.from_numpy(np.asarray(reference_mask, dtype=np.float32)).to(torch.bfloat16),
+        torch.bool: torch.from_numpy(np.asarray(reference_edges_mask)),
+        torch.uint8: torch.from_numpy(np.packbits(np.asarray(reference_edges_mask), axis=1, bitorder='little'))
+    }
+    for dtype, expected_mask in expected_masks.items():
+        ts = time.time()
+        connectivity_mask = build_connectivity_mask(edge_index, num_of_nodes, dtype=dtype)
+        elapsed_time = time.time() - ts
+
+        assert torch.equal(connectivity_mask, expected_mask), f'{dtype} connectivity mask differs from the networkx one.'
+        print(f'{str(dtype):>15} mask: {elapsed_time:.3f} [s], {to_GBs(connectivity_mask.numel() * connectivity_mask.element_size())} (identical to the networkx one)')
+
+
+def profile_incremental_inference(model_name=r'gat_000000.pth', num_of_updates=100, nodes_per_update=5, edges_per_update=5, tolerance=1e-5):
+    """
+    Simulates a slowly changing graph (a couple of nodes get new features and a couple of edges get added per update)
+    and compares the incremental inference engine against rerunning the full-graph forward pass after every update.
+
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    config = {
+        'dataset_name': DatasetType.CORA.name,
+        'layer_type': LayerType.IMP3,
+        'should_visualize': False
+    }
+    node_features, _, graph, _, _, _ = load_graph_data(config, device)
+    edge_index = graph.edge_index
+    num_of_nodes, num_of_features = node_features.shape
+
+    model_state = torch.load(os.path.join(BINARIES_PATH, model_name), map_location=device)
+    gat = GAT(
+        num_of_layers=model_state['num_of_layers'],
+        num_heads_per_layer=model_state['num_heads_per_layer'],
+        num_features_per_layer=model_state['num_features_per_layer'],
+        add_skip_connection=model_state['add_skip_connection'],
+        bias=model_state['bias'],
+        dropout=model_state['dropout'],
+        layer_type=name_to_layer_type(model_state['layer_type'])
+    ).to(device)
+    gat.load_state_dict(model_state["state_dict"], strict=True)
+    gat.eval()
+
+    inference_engine = IncrementalGATInference(gat, node_features, edge_index)
+
+    time_incremental, time_full, max_diff = 0., 0., 0.
+    for _ in range(num_of_updates):
+        node_ids = torch.randint(low=0, high=num_of_nodes, size=(nodes_per_update,), device=device)
+        new_node_features = torch.rand((nodes_per_update, num_of_features), device=device)
+        new_edge_index = torch.randint(low=0, high=num_of_nodes, size=(2, edges_per_update), device=device)
+
+        ts = time.time()
+        incremental_logits = inference_engine.update(node_ids, new_node_features, new_edge_index)
+        time_incremental += time.time() - ts
+
+        # The baseline - apply the same changes and rerun everything
+        node_features = node_features.clone()
+        node_features[node_ids] = new_node_features
+        edge_index = torch.cat([edge_index, new_edge_index], dim=1)
+
+        ts = time.time()
+        with torch.no_grad():
+            full_logits, _ = gat((node_features, edge_index))
+        time_full += time.time() - ts
+
+        # Up to float rounding (check out the note on exactness in utils/incremental_inference.py)
+        max_diff = max(max_diff, (incremental_logits - full_logits).abs().max().item())
+        assert torch.allclose(incremental_logits, full_logits, atol=tolerance), f'Incremental inference diverged from the full recompute (max diff = {max_diff}).'
+
+    print(f'Incremental inference = {time_incremental / num_of_updates * 1000:.2f} [ms] per update.')
+    print(f'Full-graph forward = {time_full / num_of_updates * 1000:.2f} [ms] per update (max logits diff = {max_diff:.2e}).')
+
+
+def profile_distributed_training(worker_counts=(1, 2, 4, 8), num_of_epochs=200, seed=0, acc_tolerance=0.02):
+    """
+    Throughput (training epochs per second) and scaling of the multi-process CPU training (check out
+    utils/distributed.py) as we add more gloo workers, plus the test accuracy compared against the single-process
+    train_gat baseline (same seed i.e. same initial weights, same number of epochs).
+
+    Note: the workers draw their own dropout masks (also for their copies of the halo nodes) so with dropout on this
+    isn't the full-batch model - the test accuracy should match up to the run-to-run noise (acc_tolerance). Check out
+    validate_distributed_training for the exact (dropout = 0) equivalence.
+
+    """
+    training_config = get_training_args()
+    training_config['num_of_epochs'] = num_of_epochs
+    training_config['patience_period'] = num_of_epochs  # we want all of the runs to do the same amount of work
+    training_config['should_test'] = True
+    training_config['should_visualize'] = False
+    training_config['enable_tensorboard'] = False
+    training_config['console_log_freq'] = None
+    training_config['checkpoint_freq'] = None
+    training_config['seed'] = seed
+
+    torch.manual_seed(seed)
+    baseline_stats = train_gat({**training_config, 'should_save_binary': False})
+    print(f'train_gat (single process), throughput = {baseline_stats["num_of_epochs"] / baseline_stats["training_time"]:.2f} [epochs/s], test acc = {baseline_stats["test_acc"]:.3f}')
+
+    results = []
+    for num_of_workers in worker_counts:
+        training_config['num_of_workers'] = num_of_workers
+        results.append(train_gat_distributed(training_config.copy()))
+
+    baseline_throughput = results[0]['epochs_per_second']
+    for stats in results:
+        speedup = stats['epochs_per_second'] / baseline_throughput
+        acc_diff = stats['test_acc'] - baseline_stats['test_acc']
+        print(f'Workers = {stats["num_of_workers"]}, throughput = {stats["epochs_per_second"]:.2f} [epochs/s], speedup = {speedup:.2f}x, '
+              f'parallel efficiency = {speedup / stats["num_of_workers"] * 100:.0f}%, test acc = {stats["test_acc"]:.3f} '
+              f'({acc_diff:+.3f} vs train_gat, {"matches" if abs(acc_diff) <= acc_tolerance else "DOES NOT match"})')
+
+
+def validate_distributed_training(num_of_workers=2, num_of_epochs=50, seed=0, tolerance=1e-4):
+    """
+    With dropout = 0 the multi-process training (check out utils/distributed.py) is the full-batch training - the
+    workers have to end up with the same weights as the single-process train_gat (same seed), up to the float
+    summation order (tolerance).
+
+    With dropout on the two diverge by design: every worker draws its own masks, including for its copies of the halo
+    nodes, so a halo node's features get dropped differently on its owner and on the workers that read them.
+
+    """
+    training_config = get_training_args()
+    training_config.update(num_of_epochs=num_of_epochs, patience_period=num_of_epochs, dropout=0., should_test=True, should_visualize=False,
+                           enable_tensorboard=False, console_log_freq=None, checkpoint_freq=None, seed=seed)
+
+    # Both runs save their final weights, the next free binary name is the one the run is going to use
+    binary_names = []
+    for num_of_run_workers in [1, num_of_workers]:
+        binary_names.append(get_available_binary_name())
+        if num_of_run_workers == 1:
+            torch.manual_seed(seed)
+            train_gat(training_config.copy())
+        else:
+            train_gat_distributed({**training_config, 'num_of_workers': num_of_run_workers})
+
+    single_process_state, distributed_state = [torch.load(os.path.join(BINARIES_PATH, binary_name))['state_dict'] for binary_name in binary_names]
+    max_diff = max((single_process_state[name] - distributed_state[name]).abs().max().item() for name in single_process_state)
+    print(f'Dropout = 0, {num_of_workers} workers vs train_gat after {num_of_epochs} epochs: max weight diff = {max_diff:.2e}')
+    assert max_diff < tolerance, f'Distributed training diverged from the full-batch training (max weight diff = {max_diff}).'
+
+
+def get_process_memory_in_bytes():
+    # (RSS, private memory) of this process - RSS also counts the shared pages we've touched, private memory doesn't
+    memory_stats = {}
+    with open('/proc/self/smaps_rollup', 'r') as file:  # Linux only
+        for line in file:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                memory_stats[fields[0].rstrip(':')] = int(fields[1]) * 1024
+
+    return memory_stats['Rss'], memory_stats['Private_Clean'] + memory_stats['Private_Dirty']
+
+
+def reset_peak_rss_in_bytes():
+    # Resets the peak RSS (VmHWM) of this process to its current RSS and returns it (Linux only)
+    with open('/proc/self/clear_refs', 'w') as file:
+        file.write('5')
+    return get_process_memory_in_bytes()[0]
+
+
+def get_peak_rss_in_bytes():
+    # Peak RSS since the start of the process or since the last reset_peak_rss_in_bytes (Linux only)
+    with open('/proc/self/status', 'r') as file:
+        for line in file:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+
+
+def graph_loading_worker(rank, training_config, shared_graph_data, results_queue):
+    rss_before, private_memory_before = get_process_memory_in_bytes()
+
+    # Note: the shared memory handles were already received (unpickled) before we got here, that cost is in the spawn time
+    ts = time.time()
+    if shared_graph_data is None:
+        node_features, node_labels, topology, train_indices, val_indices, test_indices = load_graph_data(training_config, torch.device('cpu'))
+    else:
+        node_features, node_labels, topology, train_indices, val_indices, test_indices = shared_graph_data.attach()
+    load_time = time.time() - ts
+
+    # Read everything once so that all of the pages get mapped into this process (that's what training would do)
+    _ = [float(tensor.sum()) for tensor in (node_features, node_labels, topology.edge_index, train_indices, val_indices, test_indices)]
+
+    rss, private_memory = get_process_memory_in_bytes()
+    results_queue.put((load_time, rss - rss_before, private_memory - private_memory_before))
+
+
+def profile_shared_graph_loading(num_of_workers=4):
+    """
+    Worker startup latency and per-worker memory when every worker calls load_graph_data vs when the parent loads the
+    graph once into shared memory and the workers attach to it (check out utils/shared_graph.py).
+
+    """
+    training_config = get_training_args()
+    training_config['should_visualize'] = False
+
+    ts = time.time()
+    shared_graph_data = SharedGraphData(*load_graph_data(training_config, torch.device('cpu')))
+    print(f'Parent: loaded the graph into shared memory in {(time.time() - ts) * 1000:.1f} [ms], {shared_graph_data.size_in_bytes / 2**20:.1f} MBs.')
+
+    for name, shared_data in [('load_graph_data per worker', None), ('shared memory', shared_graph_data)]:
+        results_queue = mp.get_context('spawn').SimpleQueue()
+        ts = time.time()
+        mp.spawn(graph_loading_worker, args=(training_config, shared_data, results_queue), nprocs=num_of_workers, join=True)
+        spawn_time = time.time() - ts
+
+        load_times, rss_increases, private_memory_increases = zip(*[results_queue.get() for _ in range(num_of_workers)])
+        print(f'{name:>26}: graph ready in {np.mean(load_times) * 1000:.1f} [ms] per worker (spawn + load of {num_of_workers} workers = {spawn_time:.2f} [s]), '
+              f'per worker RSS += {np.mean(rss_increases) / 2**20:.1f} MBs, private memory += {np.mean(private_memory_increases) / 2**20:.1f} MBs')
+
+
+def profile_sync_free_training(metrics_flush_freqs=(1, 10, 100), num_of_epochs=300):
+    """
+    Training throughput (imp3, full-batch) when the metrics/early stopping state are read from the device every epoch
+    vs every k epochs (check out utils/metrics.py).
+
+    Note: on the CPU the ops run synchronously anyway so expect (almost) no difference, the per-epoch syncs hurt when the
+    device runs asynchronously to the host (GPU).
+
+    """
+    training_config = get_training_args()
+    training_config['num_of_epochs'] = num_of_epochs
+    training_config['patience_period'] = num_of_epochs  # we want all of the runs to do the same amount of work
+    training_config['layer_type'] = LayerType.IMP3
+    training_config['should_test'] = False
+    training_config['should_visualize'] = False
+    training_config['enable_tensorboard'] = False
+    training_config['console_log_freq'] = None
+    training_config['checkpoint_freq'] = None
+
+    existing_binaries = set(os.listdir(BINARIES_PATH))
+    for metrics_flush_freq in metrics_flush_freqs:
+        training_config['metrics_flush_freq'] = metrics_flush_freq
+        ts = time.time()
+        train_gat(training_config.copy())
+        print(f'Metrics flush freq = {metrics_flush_freq:>3}: {num_of_epochs / (time.time() - ts):.1f} [epochs/s] (incl. data loading)')
+
+    # Don't litter the binaries directory with the models we've just trained
+    for binary_name in set(os.listdir(BINARIES_PATH)) - existing_binaries:
+        os.remove(os.path.join(BINARIES_PATH, binary_name))
+
+
+def profile_checkpointing(num_of_checkpoints=20, num_of_hidden_features=8):
+    """
+    Training thread stall per checkpoint: the old synchronous torch.save (+ a git lookup per checkpoint, no optimizer
+    state) vs the CheckpointManager's snapshot + background atomic write (check out utils/checkpointing.py).
+
+    """
+    training_config = get_training_args()
+    training_config['should_visualize'] = False
+    training_config['num_features_per_layer'] = [training_config['num_features_per_layer'][0], num_of_hidden_features, training_config['num_features_per_layer'][-1]]
+    training_config['test_acc'] = -1
+    node_features, node_labels, topology, train_indices, _, _ = load_graph_data(training_config, torch.device('cpu'))
+
+    gat = get_gat(training_config, Precision.FP32)
+    optimizer = torch.optim.Adam(gat.parameters(), lr=training_config['lr'], weight_decay=training_config['weight_decay'])
+
+    def training_step():  # also gives Adam its moments (part of the checkpoint)
+        loss = torch.nn.functional.cross_entropy(gat((node_features, topology))[0].index_select(0, train_indices), node_labels.index_select(0, train_indices))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    training_step()
+    num_of_params = sum(param.numel() for param in gat.parameters())
+
+    with tempfile.TemporaryDirectory() as checkpoints_path:
+        stall_times = []
+        for epoch in range(num_of_checkpoints):
+            training_step()
+            ts = time.time()
+            get_commit_hash.cache_clear()  # the old code looked up the commit every time
+            torch.save(get_training_state(training_config, gat), os.path.join(checkpoints_path, f'gat_ckpt_epoch_{epoch + 1}.pth'))
+            stall_times.append(time.time() - ts)
+        print(f'Synchronous torch.save: {np.median(stall_times) * 1000:.2f} [ms] stall per checkpoint ({num_of_params} params).')
+
+        checkpoint_manager = CheckpointManager(checkpoints_path, training_config)
+        stall_times = []
+        ts_total = time.time()
+        for epoch in range(num_of_checkpoints):
+            training_step()
+            ts = time.time()
+            checkpoint_manager.save(epoch, gat, optimizer, val_acc=torch.tensor(0.))
+            stall_times.append(time.time() - ts)
+        checkpoint_manager.close()
+        print(f'CheckpointManager: {np.median(stall_times) * 1000:.2f} [ms] stall per checkpoint (incl. the optimizer state and the atomic write, '
+              f'{(time.time() - ts_total) / num_of_checkpoints * 1000:.2f} [ms] per training step + checkpoint).')
+
+
+def profile_hyperparameter_sweep(worker_counts=(1, 2, 4), num_of_configs=8, num_of_epochs=200):
+    """
+    Config-runs per hour of the parallel sweep (check out sweep.py) as we add more workers, 1 worker with all of the
+    cores is the sequential baseline (what running training_script.py one config at a time would give us).
+
+    """
+    training_config = get_training_args()
+    training_config['num_of_epochs'] = num_of_epochs
+    training_config['patience_period'] = num_of_epochs  # we want all of the runs to do the same amount of work
+
+    for num_of_workers in worker_counts:
+        ts = time.time()
+        results = run_sweep(training_config, DEFAULT_SEARCH_SPACE, SearchType.RANDOM, num_of_samples=num_of_configs, num_of_workers=num_of_workers)
+        print(f'Workers = {num_of_workers}: {len(results) / (time.time() - ts) * 3600:.0f} config-runs/hour (incl. the graph loading and the pool startup), '
+              f'best val acc = {results[0]["best_val_acc"]:.3f}')
+
+
+def profile_multi_replica_training(num_of_replicas=4, num_of_epochs=200, patience_period=100):
+    """
+    K seeds trained one after the other (torch.manual_seed(k) + train_gat) vs all of them at once as a single batched
+    model (train_gat_replicas, check out ReplicatedGATLayerImp3 in GAT.py). The replicas should end up with exactly
+    the same stats as the standalone runs (on the CPU).
+
+    Note: frozen replicas (out of patience) still go through the batched forward/backward, so with early stopping the
+    batched run does max(epochs) * K work instead of sum(epochs).
+
+    """
+    training_config = get_training_args()
+    training_config.update(num_of_epochs=num_of_epochs, patience_period=patience_period, should_test=True, checkpoint_freq=None,
+                           console_log_freq=None, should_save_binary=False)
+    graph_data = load_graph_data(training_config, torch.device('cpu'))
+
+    ts = time.time()
+    standalone_stats = []
+    for seed in range(num_of_replicas):
+        torch.manual_seed(seed)
+        standalone_stats.append(train_gat(training_config, graph_data))
+    standalone_time = time.time() - ts
+
+    ts = time.time()
+    replicas_stats = train_gat_replicas({**training_config, 'num_of_replicas': num_of_replicas}, graph_data)
+    replicas_time = time.time() - ts
+
+    stats_names = ['num_of_epochs', 'best_val_acc', 'test_acc']
+    for seed, (stats, replica_stats) in enumerate(zip(standalone_stats, replicas_stats)):
+        print(f'Seed {seed}: standalone = {[stats[name] for name in stats_names]}, replica = {[replica_stats[name] for name in stats_names]}')
+    print(f'Identical stats: {all(stats[name] == replica_stats[name] for stats, replica_stats in zip(standalone_stats, replicas_stats) for name in stats_names)}')
+    print(f'Sequential: {num_of_replicas / standalone_time * 3600:.0f} runs/hour, batched replicas: {num_of_replicas / replicas_time * 3600:.0f} runs/hour')
+
+
+def profile_quantized_inference(model_name=r'gat_000000.pth', quantize_scoring_fns=False, num_of_runs=100):
+    """
+    Quantizes a trained GAT binary to int8 (check out utils/quantization.py), saves the int8 artifact and compares it
+    against the fp32 model on the same graph: test accuracy and CPU latency/throughput of the full-graph forward pass.
+
+    """
+    fp32_gat, _, quantized_model_path = quantize_binary(model_name, quantize_scoring_fns)
+    quantized_gat = load_quantized_gat(quantized_model_path)  # go through the saved artifact, that's what we'd serve
+    print(f'Saved the int8 GAT to {quantized_model_path}.')
+    print(f'Binary size: fp32 = {os.path.getsize(os.path.join(BINARIES_PATH, model_name)) / 2**20:.2f} MB, int8 = {os.path.getsize(quantized_model_path) / 2**20:.2f} MB')
+
+    config = {
+        'dataset_name': DatasetType.CORA.name,
+        'layer_type': name_to_layer_type(torch.load(quantized_model_path)['layer_type']),
+        'should_visualize': False
+    }
+    node_features, node_labels, topology, _, _, test_indices = load_graph_data(config, torch.device('cpu'))
+    num_of_nodes = len(node_labels)
+
+    for gat, model_type in [(fp32_gat, 'fp32'), (quantized_gat, 'int8')]:
+        with torch.no_grad():
+            gat((node_features, topology))  # warmup
+
+            ts = time.time()
+            for _ in range(num_of_runs):
+                nodes_unnormalized_scores = gat((node_features, topology))[0]
+            latency = (time.time() - ts) / num_of_runs
+
+        class_predictions = torch.argmax(nodes_unnormalized_scores.index_select(0, test_indices), dim=-1)
+        test_acc = torch.sum(torch.eq(class_predictions, node_labels.index_select(0, test_indices)).long()).item() / len(test_indices)
+        print(f'{model_type} GAT: test acc = {test_acc:.4f}, latency = {latency * 1000:.2f} [ms], throughput = {num_of_nodes / latency:.0f} [nodes/s]')
+
+
 def visualize_gat_properties(model_name=r'gat_000000.pth', dataset_name=DatasetType.CORA.name, visualization_type=VisualizationType.ATTENTION):
     """
     Notes on t-SNE:
@@ -195,11 +1061,12 @@ def visualize_gat_properties(model_name=r'gat_000000.pth', dataset_name=DatasetT
         all_nodes_unnormalized_scores, _ = gat((node_features, topology))  # shape = (N, num of classes)
         all_nodes_unnormalized_scores = all_nodes_unnormalized_scores.cpu().numpy()
 
-    # We'll need the edge index in different for multiple visualization types
-    if config['layer_type'] == LayerType.IMP3:  # imp 3 works with edge index while others work with adjacency info
-        edge_index = topology
+    # We'll need the graph (edge index and its cached CSC view, check out utils/graph.py) for multiple visualization types
+    if config['layer_type'] == LayerType.IMP3:  # imp 3 works with a Graph while others work with adjacency info
+        graph = topology
     else:
-        edge_index = convert_adj_to_edge_index(topology)
+        graph = Graph(convert_adj_to_edge_index(topology), len(node_features))
+    edge_index = graph.edge_index
 
     # Step 4: Perform a specific visualization
     if visualization_type == VisualizationType.ATTENTION:
@@ -224,14 +1091,11 @@ def visualize_gat_properties(model_name=r'gat_000000.pth', dataset_name=DatasetT
         nodes_of_interest_ids = np.append(nodes_of_interest_ids, random_node_ids)
         np.random.shuffle(nodes_of_interest_ids)
 
-        target_node_ids = edge_index[1]
-        source_nodes = edge_index[0]
-
         for target_node_id in nodes_of_interest_ids:
-            # Step 1: Find the neighboring nodes to the target node
+            # Step 1: Find the neighboring nodes to the target node i.e. the edges pointing into it (no O(E) scan needed)
             # Note: self edge for CORA is included so the target node is it's own neighbor (Alexandro yo soy tu madre)
-            src_nodes_indices = torch.eq(target_node_ids, target_node_id)
-            source_node_ids = source_nodes[src_nodes_indices].cpu().numpy()
+            src_nodes_indices = graph.in_edge_ids(torch.tensor([target_node_id], device=graph.device))
+            source_node_ids = graph.src_index.index_select(0, src_nodes_indices).cpu().numpy()
             size_of_neighborhood = len(source_node_ids)
 
             # Step 2: Fetch their labels
@@ -292,7 +1156,8 @@ def visualize_gat_properties(model_name=r'gat_000000.pth', dataset_name=DatasetT
         num_layers = len(num_heads_per_layer)
 
         num_of_nodes = len(node_features)
-        target_node_ids = edge_index[1].cpu().numpy()
+        # Neighborhood of node i = edges trg_sort_permutation[colptr[i]:colptr[i+1]] (Graph's CSC view)
+        colptr, trg_sort_permutation = graph.colptr.cpu().numpy(), graph.trg_sort_permutation.cpu().numpy()
 
         # For every GAT layer and for every GAT attention head plot the entropy histogram
         for layer_id in range(num_layers):
@@ -308,7 +1173,8 @@ def visualize_gat_properties(model_name=r'gat_000000.pth', dataset_name=DatasetT
                 # pseudo: out.scatter_add_(node_dim, -all_attention_weights * log(all_attention_weights), target_index)
                 for target_node_id in range(num_of_nodes):  # find every the neighborhood for every node in the graph
                     # These attention weights sum up to 1 by GAT design so we can treat it as a probability distribution
-                    neigborhood_attention = all_attention_weights[target_node_ids == target_node_id].flatten()
+                    neighborhood_edge_ids = trg_sort_permutation[colptr[target_node_id]:colptr[target_node_id + 1]]
+                    neigborhood_attention = all_attention_weights[neighborhood_edge_ids].flatten()
                     # Reference uniform distribution of the same length
                     ideal_uniform_attention = np.ones(len(neigborhood_attention))/len(neigborhood_attention)
 
@@ -348,10 +1214,50 @@ if __name__ == '__main__':
     # node_features_csr = pickle_read(os.path.join(CORA_PATH, 'node_features.csr'))
     # profile_sparse_matrix_formats(node_features_csr)
 
+    # profile_edge_index_construction(num_of_nodes=200000, avg_num_of_neighbors=10)
+
+    # profile_streaming_ingestion(num_of_nodes=100000, chunk_size=2**18)
+
+    # profile_startup_time(num_of_runs=5)
+
     # Set to True if you want to use the caching mechanism. Once you compute the profiling info it gets stored
     # in data/ dir as timing.dict and memory.dict which you can later just load instead of computing again
     # profile_gat_implementations(skip_if_profiling_info_cached=True)
 
+    # validate_imp3_against_dense_implementation(dense_layer_type=LayerType.IMP2)
+
+    # validate_connectivity_masks()
+
+    # profile_compiled_gat(num_of_epochs=100)
+
+    # profile_node_reordering(num_of_nodes=100000, avg_num_of_neighbors=5)
+
+    # profile_int32_indices(num_of_nodes=100000, avg_num_of_neighbors=5)
+
+    # validate_fused_aggregation(num_of_nodes=20000, avg_num_of_neighbors=5)
+
+    # profile_checkpoint_layers(num_of_nodes=50000, avg_num_of_neighbors=5)
+
+    # profile_topology_compression(num_of_nodes=1000000, avg_num_of_neighbors=10)
+
+    # profile_incremental_inference(model_name=r'gat_000000.pth')
+
+    # profile_quantized_inference(model_name=r'gat_000000.pth', quantize_scoring_fns=True)
+
+    # profile_distributed_training(worker_counts=(1, 2, 4, 8))
+
+    # validate_distributed_training(num_of_workers=2)
+
+    # profile_shared_graph_loading(num_of_workers=4)
+
+    # profile_sync_free_training(metrics_flush_freqs=(1, 10, 100))
+
+    # profile_checkpointing(num_of_checkpoints=20)
+
+    # profile_hyperparameter_sweep(worker_counts=(1, 2, 4))
+
+    # profile_multi_replica_training(num_of_replicas=4)
+
     # visualize_graph_dataset(dataset_name=DatasetType.CORA.name)
 
     visualize_gat_properties(
@@ -0,0 +1,151 @@
+"""
+    Parallel hyperparameter sweeps over train_gat.
+
+    A single Cora training run doesn't keep a many-core CPU busy (check out utils/distributed.py for the same problem
+    from a different angle), so instead of one run at a time with all of the cores we run many configs at the same
+    time in a process pool:
+        * the cores are split between the workers (torch intra-op threads per worker) so they don't fight over them
+        * the graph is loaded once, in this process, and shared with all of the workers (check out utils/shared_graph.py)
+        * every worker returns its training stats and we collect them into a single table, sorted by the val accuracy
+
+    The search space maps training config keys to lists of candidate values, e.g. {'lr': [5e-3, 1e-2], 'dropout': [0.5,
+    0.6]} - grid search tries every combination, random search samples num_of_samples of them.
+
+"""
+
+import argparse
+import csv
+import itertools
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+import torch
+import torch.multiprocessing as mp
+
+
+from training_script import train_gat, get_training_args
+from utils.data_loading import load_graph_data
+from utils.shared_graph import SharedGraphData
+from utils.constants import *
+
+
+# Cora's GAT hyperparameters (check out training_script.py) and their neighbors
+DEFAULT_SEARCH_SPACE = {
+    'lr': [5e-3, 1e-2],
+    'weight_decay': [5e-4, 1e-3],
+    'dropout': [0.5, 0.6],
+    'num_heads_per_layer': [[8, 1], [4, 1]],
+    'num_features_per_layer': [[CORA_NUM_INPUT_FEATURES, 8, CORA_NUM_CLASSES], [CORA_NUM_INPUT_FEATURES, 16, CORA_NUM_CLASSES]]
+}
+
+# Set in every worker process by init_sweep_worker
+_shared_graph_data = None
+
+
+def get_sweep_configs(search_space, search_type, num_of_samples=None, seed=0):
+    """
+    Returns a list of dicts, each one maps the search space keys to a value (a single config to try).
+
+    """
+    names = list(search_space.keys())
+    all_combinations = list(itertools.product(*[search_space[name] for name in names]))
+
+    if search_type == SearchType.GRID:
+        combinations = all_combinations
+    elif search_type == SearchType.RANDOM:
+        assert num_of_samples is not None, 'Random search needs num_of_samples.'
+        combinations = random.Random(seed).sample(all_combinations, min(num_of_samples, len(all_combinations)))
+    else:
+        raise Exception(f'Search type {search_type} not yet supported.')
+
+    return [dict(zip(names, combination)) for combination in combinations]
+
+
+def init_sweep_worker(shared_graph_data, num_of_threads):
+    global _shared_graph_data
+    _shared_graph_data = shared_graph_data
+    torch.set_num_threads(num_of_threads)
+
+
+def run_sweep_config(config):
+    # Runs in a worker process
+    return train_gat(config, _shared_graph_data.attach())
+
+
+def run_sweep(base_config, search_space, search_type=SearchType.GRID, num_of_samples=None, num_of_workers=None, num_of_threads_per_worker=None, seed=0):
+    """
+    Trains a GAT for every config of the search space (on top of base_config), num_of_workers at a time. Returns the
+    results (a dict per config, sweep hyperparameters + training stats) sorted by the best val accuracy.
+
+    """
+    num_of_workers = num_of_workers or os.cpu_count()
+    num_of_threads_per_worker = num_of_threads_per_worker or max(1, os.cpu_count() // num_of_workers)
+    sweep_configs = get_sweep_configs(search_space, search_type, num_of_samples, seed)
+
+    # Parallel runs would race on the binary names, checkpoints and tensorboard runs - they just report their stats
+    base_config = {**base_config, 'should_save_binary': False, 'checkpoint_freq': None, 'resume': False, 'enable_tensorboard': False,
+                   'console_log_freq': None, 'should_visualize': False}
+
+    # The workers are CPU processes - the graph is loaded (and shared) on the CPU, train_gat moves it if needed
+    shared_graph_data = SharedGraphData(*load_graph_data(base_config, torch.device('cpu')))
+
+    time_start = time.time()
+    with ProcessPoolExecutor(max_workers=num_of_workers, mp_context=mp.get_context('spawn'),
+                             initializer=init_sweep_worker, initargs=(shared_graph_data, num_of_threads_per_worker)) as executor:
+        all_stats = list(executor.map(run_sweep_config, [{**base_config, **sweep_config} for sweep_config in sweep_configs]))
+    sweep_time = time.time() - time_start
+
+    results = [{**sweep_config, **stats} for sweep_config, stats in zip(sweep_configs, all_stats)]
+    results.sort(key=lambda result: result['best_val_acc'], reverse=True)
+
+    print(f'Sweep: {len(results)} configs in {sweep_time:.1f} [s] ({num_of_workers} workers x {num_of_threads_per_worker} threads) '
+          f'= {len(results) / sweep_time * 3600:.0f} config-runs/hour')
+
+    return results
+
+
+def get_results_columns(search_space):
+    return list(search_space.keys()) + ['best_val_acc', 'test_acc', 'num_of_epochs', 'training_time']
+
+
+def print_results_table(results, search_space):
+    columns = get_results_columns(search_space)
+    rows = [[str(result[column]) if not isinstance(result[column], float) else f'{result[column]:.4g}' for column in columns] for result in results]
+    column_widths = [max(len(column), *[len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+
+    print(' | '.join(column.ljust(width) for column, width in zip(columns, column_widths)))
+    print('-+-'.join('-' * width for width in column_widths))
+    for row in rows:
+        print(' | '.join(value.ljust(width) for value, width in zip(row, column_widths)))
+
+
+def save_results_table(results, search_space, results_path):
+    columns = get_results_columns(search_space)
+    with open(results_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows([result[column] for column in columns] for result in results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search_type", choices=[el.name for el in SearchType], help='grid (all combinations) or random search', default=SearchType.GRID.name)
+    parser.add_argument("--num_of_samples", type=int, help="number of configs to sample (random search only)", default=None)
+    parser.add_argument("--num_of_workers", type=int, help="number of configs trained in parallel (None - one per core)", default=None)
+    parser.add_argument("--num_of_threads_per_worker", type=int, help="intra-op threads per worker (None - split the cores evenly)", default=None)
+    parser.add_argument("--num_of_epochs", type=int, help="number of training epochs per config", default=10000)
+    parser.add_argument("--patience_period", type=int, help="number of epochs with no improvement on val before terminating", default=100)
+    parser.add_argument("--should_test", action='store_true', help='should test every config on the test dataset? (no by default)')
+    parser.add_argument("--results_path", type=str, help="where to save the results table as CSV (None - just print it)", default=None)
+    args = parser.parse_args()
+
+    # Every other training setting is training_script.py's default
+    training_config = get_training_args([])
+    training_config.update(num_of_epochs=args.num_of_epochs, patience_period=args.patience_period, should_test=args.should_test)
+
+    sweep_results = run_sweep(training_config, DEFAULT_SEARCH_SPACE, SearchType[args.search_type], args.num_of_samples, args.num_of_workers, args.num_of_threads_per_worker)
+    print_results_table(sweep_results, DEFAULT_SEARCH_SPACE)
+    if args.results_path is not None:
+        save_results_table(sweep_results, DEFAULT_SEARCH_SPACE, args.results_path)
@@ -1,137 +1,269 @@
 import argparse
+import socket
 import time
 
 
 import torch
 import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
 from torch.optim import Adam
 
 
 from models.definitions.GAT import GAT
 from utils.data_loading import load_graph_data
+from utils.sampling import NeighborSampler
+from utils.partitioning import ClusterBatcher, load_or_compute_partition
+from utils.reordering import NodeReordering
+from utils.graph import Graph
+from utils.distributed import GraphPartition, all_reduce_gradients, broadcast_parameters
+from utils.shared_graph import SharedGraphData
+from utils.metrics import DeviceMetrics
+from utils.checkpointing import CheckpointManager
+from utils.replicated_adam import ReplicatedAdam
 from utils.constants import *
 import utils.utils as utils
 
 
+class PatienceExhausted(Exception):
+    """Raised by the validation phase once early stopping kicks in (any other exception is a genuine error)."""
+
+
+class MultiSplitEvaluator:
+    """
+    Loss, accuracy and per-class metrics for any number of node splits (e.g. val and test) out of a single forward pass.
+
+    With dropout off (eval mode) the GAT output doesn't depend on the split we're interested in, so a single no-grad
+    forward over the whole graph gives us the logits of every node - they get cached and every split just index_selects
+    its rows. The cache is valid until the weights change, call invalidate() after every optimization step.
+
+    All of the metrics are computed on the device and returned as tensors.
+
+    """
+
+    node_dim = 0
+
+    def __init__(self, gat, graph_data, node_labels, num_of_classes, loss_fn):
+        self.gat = gat
+        self.graph_data = graph_data
+        self.node_labels = node_labels
+        self.num_of_classes = num_of_classes
+        self.loss_fn = loss_fn
+
+        self.cached_logits = None
+
+    def invalidate(self):
+        self.cached_logits = None
+
+    def get_logits(self):
+        if self.cached_logits is None:
+            self.gat.eval()
+            with torch.no_grad():
+                self.cached_logits = self.gat(self.graph_data)[0]  # shape = (N, C)
+        return self.cached_logits
+
+    def evaluate(self, splits):
+        """
+        splits - dict, split name -> node indices. Returns dict, split name -> metrics dict.
+
+        """
+        all_nodes_unnormalized_scores = self.get_logits()
+        return {name: self.compute_metrics(all_nodes_unnormalized_scores.index_select(self.node_dim, node_indices), self.node_labels.index_select(self.node_dim, node_indices))
+                for name, node_indices in splits.items()}
+
+    def compute_metrics(self, nodes_unnormalized_scores, gt_node_labels):
+        class_predictions = torch.argmax(nodes_unnormalized_scores, dim=-1)
+        correct_predictions = torch.eq(class_predictions, gt_node_labels).float()
+
+        # Per-class counts, shape = (C) - index_add_ instead of bincount/masking as those need a host sync on the GPU
+        def count_per_class(class_ids, weights):
+            return torch.zeros(self.num_of_classes, device=weights.device).index_add_(0, class_ids, weights)
+
+        true_positives = count_per_class(gt_node_labels, correct_predictions)
+        per_class_recall = true_positives / count_per_class(gt_node_labels, torch.ones_like(correct_predictions)).clamp(min=1)
+        per_class_precision = true_positives / count_per_class(class_predictions, torch.ones_like(correct_predictions)).clamp(min=1)
+        per_class_f1 = 2 * per_class_precision * per_class_recall / (per_class_precision + per_class_recall).clamp(min=1e-12)
+
+        return {
+            'loss': self.loss_fn(nodes_unnormalized_scores, gt_node_labels),
+            'accuracy': correct_predictions.mean(dtype=torch.float64),
+            'per_class_precision': per_class_precision,
+            'per_class_recall': per_class_recall,  # i.e. per-class accuracy
+            'per_class_f1': per_class_f1,
+            'macro_f1': per_class_f1.mean()
+        }
+
+
 # Simple decorator function so that I don't have to pass arguments that don't change from epoch to epoch
-def get_main_loop(config, gat, cross_entropy_loss, optimizer, node_features, node_labels, edge_index, train_indices, val_indices, test_indices, patience_period, time_start):
+def get_main_loop(config, gat, cross_entropy_loss, optimizer, node_features, node_labels, topology, train_indices, val_indices, test_indices, device_metrics, grad_scaler=None, neighbor_sampler=None, cluster_batcher=None, checkpoint_manager=None):
 
     node_dim = 0  # this will likely change as soon as I add an inductive example (Cora is transductive)
 
     train_labels = node_labels.index_select(node_dim, train_indices)
-    val_labels = node_labels.index_select(node_dim, val_indices)
-    test_labels = node_labels.index_select(node_dim, test_indices)
 
-    # node_features shape = (N, FIN), edge_index shape = (2, E)
-    graph_data = (node_features, edge_index)  # I pack data into tuples because GAT uses nn.Sequential which requires it
+    # node_features shape = (N, FIN), topology - Graph (edge index shape = (2, E)) for imp3 or the connectivity mask
+    graph_data = (node_features, topology)  # I pack data into tuples because GAT uses nn.Sequential which requires it
 
-    def get_node_indices(phase):
-        if phase == LoopPhase.TRAIN:
-            return train_indices
-        elif phase == LoopPhase.VAL:
-            return val_indices
-        else:
-            return test_indices
+    train_nodes_mask = torch.zeros(len(node_labels), dtype=torch.bool, device=node_labels.device)
+    train_nodes_mask[train_indices] = True
 
-    def get_node_labels(phase):
-        if phase == LoopPhase.TRAIN:
-            return train_labels
-        elif phase == LoopPhase.VAL:
-            return val_labels
+    # Val and test metrics come from the same (cached) eval forward pass
+    evaluator = MultiSplitEvaluator(gat, graph_data, node_labels, config['num_features_per_layer'][-1], cross_entropy_loss)
+
+    def optimization_step(loss):
+        evaluator.invalidate()  # the weights are about to change
+        optimizer.zero_grad()  # clean the trainable weights gradients in the computational graph (.grad fields)
+        if grad_scaler is None:
+            loss.backward()  # compute the gradients for every trainable weight in the computational graph
+            optimizer.step()  # apply the gradients to weights
+        else:  # fp16 - scale the loss so that small gradients don't underflow to 0 (bf16 has fp32's range no need)
+            grad_scaler.scale(loss).backward()
+            grad_scaler.step(optimizer)  # unscales the gradients (skips the step if they contain infs/NaNs)
+            grad_scaler.update()
+
+    def get_training_subgraphs():
+        """
+        Yields (subgraph_nodes_ids, subgraph_edge_index, loss_nodes_local_ids, loss_nodes_ids) - the subgraph we run GAT
+        on and the train nodes inside of it that contribute to the loss (in local and in original graph ids).
+
+        """
+        if neighbor_sampler is not None:
+            # Shuffle the train nodes, and for every batch of them (seed nodes) sample a subgraph around them
+            shuffled_train_indices = train_indices[torch.randperm(len(train_indices), device=train_indices.device)]
+            for seed_nodes_ids in torch.split(shuffled_train_indices, config['batch_size']):
+                subgraph_nodes_ids, subgraph_edge_index, seed_nodes_local_ids = neighbor_sampler.sample(seed_nodes_ids)
+                yield subgraph_nodes_ids, subgraph_edge_index, seed_nodes_local_ids, seed_nodes_ids
         else:
-            return test_labels
+            # Cluster-GCN - subgraphs induced by random groups of clusters, the loss is on the train nodes inside of them
+            for subgraph_nodes_ids, subgraph_edge_index in cluster_batcher.iterate_epoch():
+                train_nodes_local_ids = torch.nonzero(train_nodes_mask.index_select(node_dim, subgraph_nodes_ids), as_tuple=True)[0]
+                if len(train_nodes_local_ids) > 0:  # nothing to learn from, skip it
+                    yield subgraph_nodes_ids, subgraph_edge_index, train_nodes_local_ids, subgraph_nodes_ids.index_select(node_dim, train_nodes_local_ids)
 
-    def main_loop(phase, epoch=0):
-        global BEST_VAL_ACC, BEST_VAL_LOSS, PATIENCE_CNT, writer
+    def minibatch_training_epoch():
+        """
+        Mini-batch training: for every subgraph (check out utils/sampling.py and utils/partitioning.py) run GAT on that
+        subgraph only and do an optimization step.
 
-        # Certain modules behave differently depending on whether we're training the model or not.
-        # e.g. nn.Dropout - we only want to drop model weights during the training.
-        if phase == LoopPhase.TRAIN:
-            gat.train()
-        else:
-            gat.eval()
+        """
+        total_loss, num_of_correct_predictions = 0., 0  # become device tensors, no host syncs per subgraph
+
+        for subgraph_nodes_ids, subgraph_edge_index, loss_nodes_local_ids, loss_nodes_ids in get_training_subgraphs():
+            # shape = (M, FIN) and (2, E') where M and E' are the number of nodes and edges in the subgraph
+            subgraph_data = (node_features.index_select(node_dim, subgraph_nodes_ids), subgraph_edge_index)
 
-        node_indices = get_node_indices(phase)
-        gt_node_labels = get_node_labels(phase)  # gt stands for ground truth
+            # shape = (B, C) where B is the number of loss (train) nodes in the subgraph and C is the number of classes
+            nodes_unnormalized_scores = gat(subgraph_data)[0].index_select(node_dim, loss_nodes_local_ids)
+            gt_node_labels = node_labels.index_select(node_dim, loss_nodes_ids)
 
-        # Do a forwards pass and extract only the relevant node scores (train/val or test ones)
-        # Note: [0] just extracts the node_features part of the data (index 1 contains the edge_index)
-        # shape = (N, C) where N is the number of nodes in the split (train/val/test) and C is the number of classes
-        nodes_unnormalized_scores = gat(graph_data)[0].index_select(node_dim, node_indices)
+            loss = cross_entropy_loss(nodes_unnormalized_scores, gt_node_labels)
+            optimization_step(loss)
 
-        # Example: let's take an output for a single node on Cora - it's a vector of size 7 and it contains unnormalized
-        # scores like: V = [-1.393,  3.0765, -2.4445,  9.6219,  2.1658, -5.5243, -4.6247]
-        # What PyTorch's cross entropy loss does is for every such vector it first applies a softmax, and so we'll
-        # have the V transformed into: [1.6421e-05, 1.4338e-03, 5.7378e-06, 0.99797, 5.7673e-04, 2.6376e-07, 6.4848e-07]
-        # secondly, whatever the correct class is (say it's 3), it will then take the element at position 3,
-        # 0.99797 in this case, and the loss will be -log(0.99797). It does this for every node and applies a mean.
-        # You can see that as the probability of the correct class for most nodes approaches 1 we get to 0 loss! <3
-        loss = cross_entropy_loss(nodes_unnormalized_scores, gt_node_labels)
+            total_loss += loss.detach() * len(loss_nodes_ids)
+            num_of_correct_predictions += torch.sum(torch.eq(torch.argmax(nodes_unnormalized_scores, dim=-1), gt_node_labels).long())
 
+        return total_loss / len(train_indices), num_of_correct_predictions / len(train_indices)
+
+    def flush_metrics(epoch):
+        for record_epoch, time_elapsed, metrics in device_metrics.flush(epoch):
+            if config['enable_tensorboard']:
+                for name, value in metrics.items():
+                    get_writer().add_scalar(name, value, record_epoch)
+
+            # Log to console
+            if 'val_acc' in metrics and config['console_log_freq'] is not None and record_epoch % config['console_log_freq'] == 0:
+                print(f'GAT training: time elapsed= {time_elapsed:.2f} [s] | epoch={record_epoch + 1} | val acc={metrics["val_acc"]}')
+
+    def is_checkpoint_due(epoch):
+        return config['checkpoint_freq'] is not None and (epoch + 1) % config['checkpoint_freq'] == 0
+
+    def save_checkpoint(epoch, val_acc):
+        # Written in the background, check out utils/checkpointing.py
+        config['test_acc'] = -1
+        checkpoint_manager.save(epoch, gat, optimizer, val_acc, device_metrics, grad_scaler)
+
+    def main_loop(phase, epoch=0):
+        # Certain modules behave differently depending on whether we're training the model or not.
+        # e.g. nn.Dropout - we only want to drop model weights during the training.
+        # Note: val/test go through the evaluator (it switches to eval mode and caches the eval forward pass)
         if phase == LoopPhase.TRAIN:
-            optimizer.zero_grad()  # clean the trainable weights gradients in the computational graph (.grad fields)
-            loss.backward()  # compute the gradients for every trainable weight in the computational graph
-            optimizer.step()  # apply the gradients to weights
+            gat.train()
 
-        # Finds the index of maximum (unnormalized) score for every node and that's the class prediction for that node.
-        # Compare those to true (ground truth) labels and find the fraction of correct predictions -> accuracy metric.
-        class_predictions = torch.argmax(nodes_unnormalized_scores, dim=-1)
-        accuracy = torch.sum(torch.eq(class_predictions, gt_node_labels).long()).item() / len(gt_node_labels)
+        if phase == LoopPhase.TRAIN and (neighbor_sampler is not None or cluster_batcher is not None):
+            # Mini-batch mode - an optimization step per subgraph, evaluation still runs on the full graph
+            loss, accuracy = minibatch_training_epoch()
+        elif phase == LoopPhase.TRAIN:
+            # Do a forwards pass and extract only the relevant node scores (the train ones)
+            # Note: [0] just extracts the node_features part of the data (index 1 contains the edge_index)
+            # shape = (N, C) where N is the number of nodes in the train split and C is the number of classes
+            nodes_unnormalized_scores = gat(graph_data)[0].index_select(node_dim, train_indices)
+            gt_node_labels = train_labels  # gt stands for ground truth
+
+            # Example: let's take an output for a single node on Cora - it's a vector of size 7 and it contains unnormalized
+            # scores like: V = [-1.393,  3.0765, -2.4445,  9.6219,  2.1658, -5.5243, -4.6247]
+            # What PyTorch's cross entropy loss does is for every such vector it first applies a softmax, and so we'll
+            # have the V transformed into: [1.6421e-05, 1.4338e-03, 5.7378e-06, 0.99797, 5.7673e-04, 2.6376e-07, 6.4848e-07]
+            # secondly, whatever the correct class is (say it's 3), it will then take the element at position 3,
+            # 0.99797 in this case, and the loss will be -log(0.99797). It does this for every node and applies a mean.
+            # You can see that as the probability of the correct class for most nodes approaches 1 we get to 0 loss! <3
+            loss = cross_entropy_loss(nodes_unnormalized_scores, gt_node_labels)
+
+            optimization_step(loss)
+
+            # Finds the index of maximum (unnormalized) score for every node and that's the class prediction for that node.
+            # Compare those to true (ground truth) labels and find the fraction of correct predictions -> accuracy metric.
+            # Note: it stays a device tensor (no .item()), check out utils/metrics.py
+            class_predictions = torch.argmax(nodes_unnormalized_scores, dim=-1)
+            accuracy = torch.sum(torch.eq(class_predictions, gt_node_labels).long()) / len(gt_node_labels)
+        else:
+            # Loss, accuracy (+ per-class metrics) of the val/test nodes from a single eval forward pass
+            metrics = evaluator.evaluate({phase: val_indices if phase == LoopPhase.VAL else test_indices})[phase]
+            loss, accuracy = metrics['loss'], metrics['accuracy']
 
         #
         # Logging
         #
 
         if phase == LoopPhase.TRAIN:
-            # Log metrics
+            # Log metrics (they reach tensorboard on the next flush)
             if config['enable_tensorboard']:
-                writer.add_scalar('training_loss', loss.item(), epoch)
-                writer.add_scalar('training_acc', accuracy, epoch)
+                device_metrics.record(epoch, training_loss=loss, training_acc=accuracy)
 
-            # Save model checkpoint
-            if config['checkpoint_freq'] is not None and (epoch + 1) % config['checkpoint_freq'] == 0:
-                ckpt_model_name = f"gat_ckpt_epoch_{epoch + 1}.pth"
-                config['test_acc'] = -1
-                torch.save(utils.get_training_state(config, gat), os.path.join(CHECKPOINTS_PATH, ckpt_model_name))
+            # No validation this epoch - nothing else will change the training state, checkpoint right away
+            if is_checkpoint_due(epoch) and epoch % config['eval_freq'] != 0:
+                # The val accuracy of the weights we're saving ranks the checkpoints (cached for the next validation)
+                save_checkpoint(epoch, evaluator.evaluate({LoopPhase.VAL: val_indices})[LoopPhase.VAL]['accuracy'])
 
         elif phase == LoopPhase.VAL:
-            # Log metrics
-            if config['enable_tensorboard']:
-                writer.add_scalar('val_loss', loss.item(), epoch)
-                writer.add_scalar('val_acc', accuracy, epoch)
-
-            # Log to console
-            if config['console_log_freq'] is not None and epoch % config['console_log_freq'] == 0:
-                print(f'GAT training: time elapsed= {(time.time() - time_start):.2f} [s] | epoch={epoch + 1} | val acc={accuracy}')
+            # Log metrics (they reach tensorboard and the console on the next flush)
+            device_metrics.record(epoch, val_loss=loss, val_acc=accuracy, val_macro_f1=metrics['macro_f1'])
 
             # The "patience" logic - should we break out from the training loop? If either validation acc keeps going up
-            # or the val loss keeps going down we won't stop
-            if accuracy > BEST_VAL_ACC or loss.item() < BEST_VAL_LOSS:
-                BEST_VAL_ACC = max(accuracy, BEST_VAL_ACC)  # keep track of the best validation accuracy so far
-                BEST_VAL_LOSS = min(loss.item(), BEST_VAL_LOSS)
-                PATIENCE_CNT = 0  # reset the counter every time we encounter new best accuracy
-            else:
-                PATIENCE_CNT += 1  # otherwise keep counting
+            # or the val loss keeps going down we won't stop (the patience is counted in epochs since the last improvement)
+            # Note: computed on the device, we find out whether the patience has run out on the next flush
+            device_metrics.update_patience(accuracy, loss, num_of_epochs=config['eval_freq'])
 
-            if PATIENCE_CNT >= patience_period:
-                raise Exception('Stopping the training, the universe has no more patience for this training.')
+            # Checkpoint only once this epoch's validation has updated the early stopping state, training resumes from
+            # the next epoch so the state has to be exactly what an uninterrupted run would carry over
+            if is_checkpoint_due(epoch):
+                save_checkpoint(epoch, accuracy)
 
-        else:
-            return accuracy  # in the case of test phase we just report back the test accuracy
+            if device_metrics.is_flush_due(epoch):
+                flush_metrics(epoch)
 
-    return main_loop  # return the decorated function
+            if device_metrics.should_stop:
+                raise PatienceExhausted('Stopping the training, the universe has no more patience for this training.')
 
+        else:
+            accuracy = accuracy.item()
+            print(f'Test macro F1 = {metrics["macro_f1"].item():.3f} | per-class accuracy = {[round(class_acc, 3) for class_acc in metrics["per_class_recall"].tolist()]}')
+            return accuracy  # in the case of test phase we just report back the test accuracy
 
-def train_gat(config):
-    global BEST_VAL_ACC, BEST_VAL_LOSS
+    return main_loop, flush_metrics  # return the decorated functions
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # checking whether you have a GPU, I hope so!
 
-    # Step 1: load the graph data
-    node_features, node_labels, edge_index, train_indices, val_indices, test_indices = load_graph_data(config, device)
-
-    # Step 2: prepare the model
-    gat = GAT(
+def get_gat(config, precision, num_of_replicas=None):
+    return GAT(
         num_of_layers=config['num_of_layers'],
         num_heads_per_layer=config['num_heads_per_layer'],
         num_features_per_layer=config['num_features_per_layer'],
@@ -139,46 +271,132 @@ def train_gat(config):
         bias=config['bias'],
         dropout=config['dropout'],
         layer_type=config['layer_type'],
-        log_attention_weights=False  # no need to store attentions, used only in playground.py while visualizing
-    ).to(device)
+        log_attention_weights=False,  # no need to store attentions, used only in playground.py while visualizing
+        fused_aggregation=config['fused_aggregation'],
+        precision=precision,
+        checkpoint_layers=config['checkpoint_layers'],
+        compile=config['compile'],
+        num_of_replicas=num_of_replicas
+    )
+
+
+def train_gat(config, graph_data=None):
+    """
+    graph_data - load_graph_data's outputs if they're already loaded (e.g. shared by the sweep workers, check out
+    sweep.py), otherwise the graph gets loaded here. Returns the training stats.
+
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # checking whether you have a GPU, I hope so!
+    precision = Precision[config['precision']]
+    assert not (precision == Precision.FP16 and device.type == 'cpu'), f'{Precision.FP16.name} needs a GPU, on CPU use {Precision.BF16.name}.'
+
+    # Sparse features can't be sliced into subgraphs (no index_select for sparse CSR tensors)
+    if config['sparse_features']:
+        assert config['layer_type'] == LayerType.IMP3, f'Sparse features need {LayerType.IMP3.name}.'
+        assert config['batch_size'] is None and config['num_of_clusters'] is None and not config['compile'], 'Sparse features support only eager full-batch training.'
+
+    # Step 1: load the graph data (or move the preloaded one to the device - a no-op if it's already there)
+    if graph_data is None:
+        graph_data = load_graph_data(config, device)
+    node_features, node_labels, topology, train_indices, val_indices, test_indices = [data.to(device) for data in graph_data]
+
+    # Relabel the nodes so that neighbors sit close in memory (check out utils/reordering.py), metrics are computed over
+    # the (relabeled) splits so nothing else has to change - node_reordering.restore_node_order maps outputs back
+    node_ordering = NodeOrdering[config['node_ordering']]
+    graph_name = config['dataset_name']
+    if node_ordering != NodeOrdering.NONE:
+        assert config['layer_type'] == LayerType.IMP3, f'Node reordering needs the edge index ({LayerType.IMP3.name}).'
+        node_reordering = NodeReordering(topology.edge_index, len(node_labels), node_ordering)
+        node_features, node_labels, edge_index, train_indices, val_indices, test_indices = node_reordering.reorder_graph(
+            node_features, node_labels, topology.edge_index, train_indices, val_indices, test_indices)
+        topology = Graph(edge_index, len(node_labels))
+        graph_name = f'{graph_name}_{node_ordering.name}'  # node ids changed - cached partitions of the original don't apply
+
+    # Step 2: prepare the model
+    gat = get_gat(config, precision).to(device)
 
     # Step 3: Prepare other training related utilities (loss & optimizer and decorator function)
     loss_fn = nn.CrossEntropyLoss(reduction='mean')
     optimizer = Adam(gat.parameters(), lr=config['lr'], weight_decay=config['weight_decay'])
+    grad_scaler = torch.cuda.amp.GradScaler() if precision == Precision.FP16 else None
+
+    # Mini-batch (neighbor sampling) mode, by default we train full-batch i.e. on the whole graph
+    neighbor_sampler = None
+    if config['batch_size'] is not None:
+        assert config['layer_type'] == LayerType.IMP3, f'Neighbor sampling needs the edge index ({LayerType.IMP3.name}).'
+        fanouts = config['fanouts'] if config['fanouts'] is not None else [-1] * config['num_of_layers']
+        assert len(fanouts) == config['num_of_layers'], f'Expected a fanout per GAT layer got {fanouts}.'
+        neighbor_sampler = NeighborSampler(topology.edge_index, len(node_labels), fanouts)
+
+    # Cluster-GCN mode - the graph is partitioned once (cached on disk) and we train on subgraphs induced by clusters
+    cluster_batcher = None
+    if config['num_of_clusters'] is not None:
+        assert config['layer_type'] == LayerType.IMP3, f'Cluster training needs the edge index ({LayerType.IMP3.name}).'
+        assert neighbor_sampler is None, f'Pick either neighbor sampling (batch_size) or cluster training (num_of_clusters).'
+        cluster_assignment = load_or_compute_partition(graph_name, topology.edge_index, len(node_labels), config['num_of_clusters'])
+        cluster_batcher = ClusterBatcher(topology.edge_index, cluster_assignment, config['clusters_per_batch'])
+
+    # Metrics and early stopping state stay on the device, the host reads them every metrics_flush_freq epochs
+    device_metrics = DeviceMetrics(config['patience_period'], config['metrics_flush_freq'], device, time.time())
+
+    checkpoint_manager = CheckpointManager(CHECKPOINTS_PATH, config, config['keep_last_checkpoints'], config['keep_best_checkpoints'], resume=config['resume'])
+    start_epoch = 0
+    if config['resume']:  # pick up from the newest checkpoint - weights, Adam moments, early stopping and RNG state
+        training_state = checkpoint_manager.load_latest(device)
+        assert training_state is not None, f'No checkpoints to resume from in {CHECKPOINTS_PATH}.'
+        gat.load_state_dict(training_state['state_dict'], strict=True)
+        optimizer.load_state_dict(training_state['optimizer_state_dict'])
+        device_metrics.load_state_dict(training_state['early_stopping_state'])
+        if grad_scaler is not None and training_state['grad_scaler_state_dict'] is not None:
+            grad_scaler.load_state_dict(training_state['grad_scaler_state_dict'])
+        torch.set_rng_state(training_state['rng_state'].cpu())
+        if training_state['cuda_rng_state'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([rng_state.cpu() for rng_state in training_state['cuda_rng_state']])
+        start_epoch = training_state['epoch'] + 1
+        print(f'Resuming the training from epoch {start_epoch + 1} (checkpoint val acc={training_state["val_acc"]}).')
 
     # The decorator function makes things cleaner since there is a lot of redundancy between the train and val loops
-    main_loop = get_main_loop(
+    main_loop, flush_metrics = get_main_loop(
         config,
         gat,
         loss_fn,
         optimizer,
         node_features,
         node_labels,
-        edge_index,
+        topology,
         train_indices,
         val_indices,
         test_indices,
-        config['patience_period'],
-        time.time())
-
-    BEST_VAL_ACC, BEST_VAL_LOSS, PATIENCE_CNT = [0, 0, 0]  # reset vars used for early stopping
+        device_metrics,
+        grad_scaler,
+        neighbor_sampler,
+        cluster_batcher,
+        checkpoint_manager)
 
     # Step 4: Start the training procedure
-    for epoch in range(config['num_of_epochs']):
+    time_start, num_of_epochs = time.time(), 0
+    for epoch in range(start_epoch, config['num_of_epochs']):
+        num_of_epochs += 1
         # Training loop
         main_loop(phase=LoopPhase.TRAIN, epoch=epoch)
 
-        # Validation loop
-        with torch.no_grad():
-            try:
-                main_loop(phase=LoopPhase.VAL, epoch=epoch)
-            except Exception as e:  # "patience has run out" exception :O
-                print(str(e))
-                break  # break out from the training loop
+        # Validation loop (every eval_freq epochs)
+        if epoch % config['eval_freq'] == 0:
+            with torch.no_grad():
+                try:
+                    main_loop(phase=LoopPhase.VAL, epoch=epoch)
+                except PatienceExhausted as e:  # "patience has run out" exception :O
+                    print(str(e))
+                    break  # break out from the training loop
+
+    flush_metrics(config['num_of_epochs'] - 1)  # metrics still pending on the device (if any)
+    checkpoint_manager.close()  # wait for the last checkpoint write
+    training_time = time.time() - time_start
 
     # Step 5: Potentially test your model
     # Don't overfit to the test dataset - only when you've fine-tuned your model on the validation dataset should you
     # report your final loss and accuracy on the test dataset. Friends don't let friends overfit to the test data. <3
+    # Note: if the weights didn't change since the last validation the test metrics come from its (cached) forward pass
     if config['should_test']:
         test_acc = main_loop(phase=LoopPhase.TEST)
         config['test_acc'] = test_acc
@@ -186,11 +404,270 @@ def train_gat(config):
     else:
         config['test_acc'] = -1
 
-    # Save the latest GAT in the binaries directory
-    torch.save(utils.get_training_state(config, gat), os.path.join(BINARIES_PATH, utils.get_available_binary_name()))
+    # Save the latest GAT in the binaries directory (parallel sweep runs don't - they'd race on the binary names)
+    if config.get('should_save_binary', True):
+        torch.save(utils.get_training_state(config, gat), os.path.join(BINARIES_PATH, utils.get_available_binary_name()))
+
+    return {'num_of_epochs': num_of_epochs, 'training_time': training_time, 'best_val_acc': device_metrics.best_val_acc.item(), 'test_acc': config['test_acc']}
+
+
+def train_gat_replicas(config, graph_data=None):
+    """
+    Trains config['num_of_replicas'] (K) GATs, seeded with 0, 1, ..., K-1, at once - as a single batched model (check
+    out ReplicatedGATLayerImp3 in GAT.py). Returns the training stats of every replica.
+
+    Replica k is initialized exactly like torch.manual_seed(k) + train_gat(config) would initialize it, draws the same
+    dropout masks and gets frozen exactly at the epoch its own patience runs out. So (on the CPU, with
+    metrics_flush_freq = 1 and no checkpointing) replica k ends up with the same weights and metrics, bit for bit, as
+    the standalone run. On the GPU nn.Dropout uses a fused kernel with a different random stream - the replicas are
+    still K independent runs, just not the same ones.
+
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    num_of_replicas = config['num_of_replicas']
+    assert config['layer_type'] == LayerType.IMP3, f'Replicas need {LayerType.IMP3.name}.'
+    assert Precision[config['precision']] == Precision.FP32 and config['checkpoint_layers'] is None and not (config['compile'] or config['fused_aggregation']), \
+        'Replicas support only eager FP32 without checkpointing nor fused aggregation.'
+    assert not config['sparse_features'] and config['batch_size'] is None and config['num_of_clusters'] is None, 'Replicas support only dense full-batch training.'
+    assert NodeOrdering[config['node_ordering']] == NodeOrdering.NONE and not config['resume'], 'Replicas support neither node reordering nor resuming.'
+
+    # Step 1: load the graph data (or move the preloaded one to the device)
+    if graph_data is None:
+        graph_data = load_graph_data(config, device)
+    node_features, node_labels, topology, train_indices, val_indices, test_indices = [data.to(device) for data in graph_data]
+
+    # Step 2: prepare the model - replica k gets the weights (and the RNG state that follows them) of the standalone
+    # GAT that train_gat would create after torch.manual_seed(k)
+    gat = get_gat(config, Precision.FP32, num_of_replicas)
+    replica_generators = []
+    for replica_id in range(num_of_replicas):
+        torch.manual_seed(replica_id)
+        gat.load_replica(replica_id, get_gat(config, Precision.FP32))
+        replica_generator = torch.Generator(device)
+        if device.type == 'cpu':
+            replica_generator.set_state(torch.get_rng_state())
+        else:  # the standalone model is initialized on the CPU, the dropout draws from the (untouched) GPU generator
+            replica_generator.manual_seed(replica_id)
+        replica_generators.append(replica_generator)
+    gat = gat.to(device)
+    gat.set_replica_generators(replica_generators)
+
+    # Step 3: Prepare other training related utilities
+    # Note: a single Adam over the stacked weights (check out utils/replicated_adam.py) is the same thing as K optimizers
+    loss_fn = nn.CrossEntropyLoss(reduction='mean')
+    optimizer = ReplicatedAdam(gat.parameters(), lr=config['lr'], weight_decay=config['weight_decay'])
+    device_metrics = DeviceMetrics(config['patience_period'], config['metrics_flush_freq'], device, time.time(), num_of_replicas)
+
+    node_dim, replica_dim = 1, 0  # GAT outputs (K, N, C) scores
+    graph_data = (node_features, topology)
+    train_labels = node_labels.index_select(0, train_indices)
+    evaluator = MultiSplitEvaluator(gat, graph_data, node_labels, config['num_features_per_layer'][-1], loss_fn)
+
+    def evaluate_replicas(node_indices):
+        # Same metrics as MultiSplitEvaluator.evaluate, for every replica, shape = (K) per metric
+        nodes_unnormalized_scores = evaluator.get_logits().index_select(node_dim, node_indices)
+        gt_node_labels = node_labels.index_select(0, node_indices)
+        replicas_metrics = [evaluator.compute_metrics(replica_scores, gt_node_labels) for replica_scores in nodes_unnormalized_scores]
+        return {name: torch.stack([replica_metrics[name] for replica_metrics in replicas_metrics]) for name in ['loss', 'accuracy', 'macro_f1']}
+
+    def flush_metrics(epoch):
+        for record_epoch, time_elapsed, metrics in device_metrics.flush(epoch):
+            if config['enable_tensorboard']:
+                for name, values in metrics.items():
+                    get_writer().add_scalars(name, {f'replica_{replica_id}': value for replica_id, value in enumerate(values)}, record_epoch)
+
+            if 'val_acc' in metrics and config['console_log_freq'] is not None and record_epoch % config['console_log_freq'] == 0:
+                print(f'GAT training ({num_of_replicas} replicas): time elapsed= {time_elapsed:.2f} [s] | epoch={record_epoch + 1} | val acc={[round(acc, 3) for acc in metrics["val_acc"]]}')
+
+    # Step 4: Start the training procedure
+    time_start = time.time()
+    num_of_epochs = torch.zeros(num_of_replicas, dtype=torch.long, device=device)  # per replica, frozen ones don't count
+    for epoch in range(config['num_of_epochs']):
+        gat.train()
+
+        # shape = (K, T, C) where T is the number of train nodes, every replica's loss is the standalone loss
+        nodes_unnormalized_scores = gat(graph_data)[0].index_select(node_dim, train_indices)
+        losses = torch.stack([loss_fn(replica_scores, train_labels) for replica_scores in nodes_unnormalized_scores])
+
+        # Replicas don't share any weights so every replica gets exactly the gradient of its own loss
+        evaluator.invalidate()
+        optimizer.zero_grad()
+        losses.sum().backward()
+
+        # Replicas that ran out of patience are frozen - Adam only updates the ones still training
+        is_training = ~device_metrics.out_of_patience
+        optimizer.step(is_training)
+        num_of_epochs += is_training
+
+        if config['enable_tensorboard']:
+            class_predictions = torch.argmax(nodes_unnormalized_scores, dim=-1)
+            device_metrics.record(epoch, training_loss=losses, training_acc=torch.sum(torch.eq(class_predictions, train_labels).long(), dim=-1) / len(train_labels))
+
+        # Validation loop (every eval_freq epochs), same patience logic as in train_gat - per replica
+        if epoch % config['eval_freq'] == 0:
+            with torch.no_grad():
+                metrics = evaluate_replicas(val_indices)
+            device_metrics.record(epoch, val_loss=metrics['loss'], val_acc=metrics['accuracy'], val_macro_f1=metrics['macro_f1'])
+            device_metrics.update_patience(metrics['accuracy'], metrics['loss'], num_of_epochs=config['eval_freq'])
 
+            if device_metrics.is_flush_due(epoch):
+                flush_metrics(epoch)
 
-def get_training_args():
+            if device_metrics.should_stop:
+                print('Stopping the training, the universe has no more patience for any of the replicas.')
+                break
+
+    flush_metrics(config['num_of_epochs'] - 1)  # metrics still pending on the device (if any)
+    training_time = time.time() - time_start
+
+    # Step 5: Potentially test the replicas, and report the mean/std over the replicas (e.g. for significance testing)
+    test_accs = [-1] * num_of_replicas
+    if config['should_test']:
+        with torch.no_grad():
+            test_accs = evaluate_replicas(test_indices)['accuracy'].tolist()
+        test_accs_tensor = torch.tensor(test_accs)
+        print(f'Test accuracy = {test_accs_tensor.mean().item():.4f} +- {test_accs_tensor.std().item():.4f} ({num_of_replicas} replicas) | per replica = {[round(acc, 3) for acc in test_accs]}')
+
+    # Every replica is saved as a standalone GAT binary
+    if config.get('should_save_binary', True):
+        for replica_id in range(num_of_replicas):
+            training_state = utils.get_training_state({**config, 'test_acc': test_accs[replica_id]}, gat)
+            training_state['state_dict'] = gat.get_replica_state_dict(replica_id)
+            torch.save(training_state, os.path.join(BINARIES_PATH, utils.get_available_binary_name()))
+
+    return [{'seed': replica_id, 'num_of_epochs': replica_num_of_epochs, 'training_time': training_time, 'best_val_acc': best_val_acc, 'test_acc': test_acc}
+            for replica_id, (replica_num_of_epochs, best_val_acc, test_acc) in enumerate(zip(num_of_epochs.tolist(), device_metrics.best_val_acc.tolist(), test_accs))]
+
+
+def train_gat_distributed(config):
+    """
+    Starts config['num_of_workers'] gloo worker processes on this machine, each of them owning a partition of the graph
+    (check out utils/distributed.py). Returns the training stats reported by the first worker.
+
+    """
+    num_of_workers = config['num_of_workers']
+    assert config['layer_type'] == LayerType.IMP3, f'Distributed training needs the edge index ({LayerType.IMP3.name}).'
+    assert Precision[config['precision']] == Precision.FP32 and config['checkpoint_layers'] is None and not config['compile'], 'Distributed training supports only eager FP32 without checkpointing.'
+    assert not config['sparse_features'], 'Distributed training needs dense features.'
+    assert config['batch_size'] is None and config['num_of_clusters'] is None, 'Distributed training is full-batch.'
+    assert NodeOrdering[config['node_ordering']] == NodeOrdering.NONE, 'Distributed training has its own (partition) node ordering.'
+    assert not config['resume'], 'Distributed training does not write (resumable) checkpoints.'
+
+    # Load the graph once and share it with the workers (check out utils/shared_graph.py), partition it once, up front,
+    # so that the workers don't race on the partition cache
+    shared_graph_data = SharedGraphData(*load_graph_data(config, torch.device('cpu')))
+    _, node_labels, graph, _, _, _ = shared_graph_data.attach()
+    node_to_worker = load_or_compute_partition(config['dataset_name'], graph.edge_index, len(node_labels), num_of_workers)
+
+    # Any free port will do, the workers only talk to each other
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        init_method = f'tcp://127.0.0.1:{s.getsockname()[1]}'
+
+    stats_queue = mp.get_context('spawn').SimpleQueue()
+    mp.spawn(train_gat_distributed_worker, args=(num_of_workers, init_method, config, shared_graph_data, node_to_worker, stats_queue), nprocs=num_of_workers, join=True)
+    return stats_queue.get()
+
+
+def train_gat_distributed_worker(rank, num_of_workers, init_method, config, shared_graph_data, node_to_worker, stats_queue):
+    dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=num_of_workers)
+    # Split the cores between the workers otherwise they fight over them
+    torch.set_num_threads(config['num_of_threads_per_worker'] or max(1, os.cpu_count() // num_of_workers))
+
+    # Step 1: attach to the (shared memory) graph data and keep only our partition of it (CPU only - that's the whole point)
+    node_features, node_labels, graph, train_indices, val_indices, test_indices = shared_graph_data.attach()
+    partition = GraphPartition(graph.edge_index, node_to_worker, rank, num_of_workers)
+    owned_nodes_features = node_features.index_select(0, partition.owned_nodes_ids)
+    owned_nodes_labels = node_labels.index_select(0, partition.owned_nodes_ids)
+    del node_features
+
+    # Train/val/test nodes that we own, in local ids. The loss (and metrics) are normalized by the global split sizes
+    # so that once we sum everything up across the workers we get exactly what a single process would get.
+    def get_owned_split(node_indices):
+        return torch.nonzero(torch.isin(partition.owned_nodes_ids, node_indices), as_tuple=True)[0], len(node_indices)
+
+    splits = {LoopPhase.TRAIN: get_owned_split(train_indices), LoopPhase.VAL: get_owned_split(val_indices), LoopPhase.TEST: get_owned_split(test_indices)}
+
+    # Step 2: prepare the model, every worker has a full replica of the (tiny) GAT weights
+    if config.get('seed') is not None:  # same initial weights as torch.manual_seed(seed) + train_gat
+        torch.manual_seed(config['seed'])
+    gat = get_gat(config, Precision.FP32)
+    broadcast_parameters(gat)
+    torch.manual_seed(rank)  # different dropout masks on different workers (halo copies too, check out utils/distributed.py)
+    loss_fn = nn.CrossEntropyLoss(reduction='sum')
+    optimizer = Adam(gat.parameters(), lr=config['lr'], weight_decay=config['weight_decay'])
+
+    def run_phase(phase):
+        local_node_indices, num_of_nodes_in_split = splits[phase]
+        nodes_unnormalized_scores = partition.run_gat(gat, owned_nodes_features).index_select(0, local_node_indices)
+        gt_node_labels = owned_nodes_labels.index_select(0, local_node_indices)
+
+        loss = loss_fn(nodes_unnormalized_scores, gt_node_labels) / num_of_nodes_in_split
+        num_of_correct_predictions = torch.sum(torch.eq(torch.argmax(nodes_unnormalized_scores, dim=-1), gt_node_labels).long())
+
+        if phase == LoopPhase.TRAIN:
+            optimizer.zero_grad()
+            loss.backward()
+            all_reduce_gradients(gat)  # sum of the workers' gradients = gradient of the full-batch loss
+            optimizer.step()
+
+        metrics = torch.stack([loss.detach(), num_of_correct_predictions.to(loss.dtype)])
+        dist.all_reduce(metrics, op=dist.ReduceOp.SUM)
+        return metrics[0].item(), metrics[1].item() / num_of_nodes_in_split
+
+    # Step 3: Start the training procedure, all of the workers see the same (all-reduced) metrics so they stop together
+    best_val_acc, best_val_loss, patience_cnt = [0, 0, 0]
+    time_start = time.time()
+    training_time, num_of_epochs = 0., 0
+    for epoch in range(config['num_of_epochs']):
+        gat.train()
+        epoch_start = time.time()
+        run_phase(LoopPhase.TRAIN)
+        training_time += time.time() - epoch_start
+        num_of_epochs += 1
+
+        if epoch % config['eval_freq'] != 0:
+            continue
+
+        gat.eval()
+        with torch.no_grad():
+            val_loss, val_acc = run_phase(LoopPhase.VAL)
+
+        if rank == 0 and config['console_log_freq'] is not None and epoch % config['console_log_freq'] == 0:
+            print(f'GAT training ({num_of_workers} workers): time elapsed= {(time.time() - time_start):.2f} [s] | epoch={epoch + 1} | val acc={val_acc}')
+
+        if val_acc > best_val_acc or val_loss < best_val_loss:
+            best_val_acc, best_val_loss, patience_cnt = max(val_acc, best_val_acc), min(val_loss, best_val_loss), 0
+        else:
+            patience_cnt += config['eval_freq']
+
+        if patience_cnt >= config['patience_period']:
+            if rank == 0:
+                print('Stopping the training, the universe has no more patience for this training.')
+            break
+
+    # Step 4: Potentially test your model
+    config['test_acc'] = -1
+    if config['should_test']:
+        gat.eval()
+        with torch.no_grad():
+            config['test_acc'] = run_phase(LoopPhase.TEST)[1]
+
+    if rank == 0:
+        if config['should_test']:
+            print(f'Test accuracy = {config["test_acc"]}')
+        # The weights are the same on all of the workers
+        torch.save(utils.get_training_state(config, gat), os.path.join(BINARIES_PATH, utils.get_available_binary_name()))
+        stats_queue.put({'num_of_workers': num_of_workers, 'num_of_epochs': num_of_epochs, 'epochs_per_second': num_of_epochs / training_time, 'test_acc': config['test_acc']})
+
+    dist.destroy_process_group()
+
+
+def get_training_args(args=None):
+    """
+    args - list of command line arguments to parse (None - sys.argv, [] - all of the defaults)
+
+    """
     parser = argparse.ArgumentParser()
 
     # Training related
@@ -199,6 +676,22 @@ def get_training_args():
     parser.add_argument("--lr", type=float, help="model learning rate", default=5e-3)
     parser.add_argument("--weight_decay", type=float, help="L2 regularization on model weights", default=5e-4)
     parser.add_argument("--should_test", action='store_true', help='should test the model on the test dataset? (no by default)')
+    parser.add_argument("--eval_freq", type=int, help="validation (epoch) freq, patience is still counted in epochs", default=1)
+    parser.add_argument("--batch_size", type=int, help="number of train nodes per step - enables neighbor sampling (None for full-batch)", default=None)
+    parser.add_argument("--fanouts", type=int, nargs='+', help="neighbors sampled per node for every hop, -1 for all (all by default)", default=None)
+    parser.add_argument("--num_of_clusters", type=int, help="number of graph partitions - enables Cluster-GCN training (None for full-batch)", default=None)
+    parser.add_argument("--clusters_per_batch", type=int, help="number of clusters whose induced subgraph makes a training step", default=1)
+    parser.add_argument("--num_of_workers", type=int, help="number of gloo worker processes each owning a graph partition (1 - single process)", default=1)
+    parser.add_argument("--num_of_threads_per_worker", type=int, help="intra-op threads per worker (None - split the cores evenly)", default=None)
+    parser.add_argument("--num_of_replicas", type=int, help="number of GATs (seeds 0..K-1) trained at once as a single batched model (None - a single GAT)", default=None)
+    parser.add_argument("--fused_aggregation", action='store_true', help='use the memory-efficient fused imp3 attention (no by default)')
+    parser.add_argument("--precision", choices=[el.name for el in Precision], help='FP32 or mixed precision (BF16 on CPU)', default=Precision.FP32.name)
+    parser.add_argument("--checkpoint_layers", type=int, nargs='+', help='ids of GAT layers whose activations are recomputed in backward (memory saving)', default=None)
+    parser.add_argument("--sparse_features", action='store_true', help='imp3 - keep node features as a sparse CSR tensor (no by default)')
+    parser.add_argument("--compile", action='store_true', help='imp3 - run GAT through torch.compile (no by default)')
+    parser.add_argument("--int32_indices", action='store_true', help='imp3 - store the edge index as int32 (half the memory, no by default)')
+    parser.add_argument("--node_ordering", choices=[el.name for el in NodeOrdering], help='imp3 - relabel nodes for gather/scatter locality', default=NodeOrdering.NONE.name)
+    parser.add_argument("--tiled_attention", action='store_true', help='imp1/imp2 - bit-packed mask + tiled attention instead of NxN tensors (no by default)')
 
     # Dataset related
     parser.add_argument("--dataset_name", choices=[el.name for el in DatasetType], help='dataset to use for training', default=DatasetType.CORA.name)
@@ -207,8 +700,12 @@ def get_training_args():
     # Logging/debugging/checkpoint related (helps a lot with experimentation)
     parser.add_argument("--enable_tensorboard", action='store_true', help="enable tensorboard logging (no by default)")
     parser.add_argument("--console_log_freq", type=int, help="log to output console (epoch) freq (None for no logging)", default=100)
+    parser.add_argument("--metrics_flush_freq", type=int, help="(epoch) freq of reading the metrics from the device (early stopping can overshoot by up to this many epochs)", default=1)
     parser.add_argument("--checkpoint_freq", type=int, help="checkpoint model saving (epoch) freq (None for no logging)", default=1000)
-    args = parser.parse_args()
+    parser.add_argument("--keep_last_checkpoints", type=int, help="number of most recent checkpoints to keep", default=3)
+    parser.add_argument("--keep_best_checkpoints", type=int, help="number of best (val acc) checkpoints to keep", default=1)
+    parser.add_argument("--resume", action='store_true', help='resume the training from the latest checkpoint (no by default)')
+    args = parser.parse_args(args)
 
     # Model architecture related
     gat_config = {
@@ -235,4 +732,10 @@ def get_training_args():
 if __name__ == '__main__':
 
     # Train the graph attention network (GAT)
-    train_gat(get_training_args())
+    training_config = get_training_args()
+    if training_config['num_of_replicas'] is not None:
+        train_gat_replicas(training_config)
+    elif training_config['num_of_workers'] > 1:
+        train_gat_distributed(training_config)
+    else:
+        train_gat(training_config)
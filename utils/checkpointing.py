@@ -0,0 +1,148 @@
+"""
+    Asynchronous, atomic and resumable checkpointing.
+
+    Saving a checkpoint on the training thread means the training stalls for the whole serialization + disk write. So:
+        * the training thread only snapshots the state (model, Adam optimizer, early stopping state, RNG) into CPU
+          copies - the training can keep modifying the weights in-place right after
+        * a background thread serializes the snapshot and writes it to disk, at most one write is in flight (if the
+          previous one isn't done by the next checkpoint we wait for it, so there is never more than 1 extra snapshot)
+        * every file is written to a temporary file first (+ fsync) and then renamed into place - the rename is atomic
+          so a crash (or a kill) mid-write never leaves a truncated checkpoint behind
+        * checkpoints.json (written the same way) lists the checkpoints with their epoch and val accuracy - we keep the
+          last keep_last_k and the best keep_best_k (by val accuracy) ones and delete the rest
+
+    load_latest returns the newest checkpoint so that training can be resumed (check out --resume in training_script.py).
+
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+import torch
+
+
+import utils.utils as utils
+
+
+CHECKPOINTS_MANIFEST_FILE_NAME = 'checkpoints.json'
+
+
+class CheckpointManager:
+    def __init__(self, checkpoints_path, training_config, keep_last_k=3, keep_best_k=1, resume=False):
+        """
+        resume - keep track of the checkpoints listed in the existing manifest, otherwise we start a fresh list (the
+        files of the previous runs are left alone)
+
+        """
+        assert keep_last_k >= 1, f'Expected to keep at least the last checkpoint got keep_last_k={keep_last_k}.'
+        self.checkpoints_path = checkpoints_path
+        self.training_config = training_config
+        self.keep_last_k = keep_last_k
+        self.keep_best_k = keep_best_k
+
+        manifest_path = os.path.join(checkpoints_path, CHECKPOINTS_MANIFEST_FILE_NAME)
+        self.checkpoints = []  # [{'file_name': ..., 'epoch': ..., 'val_acc': ...}, ...] sorted by epoch
+        if resume and os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as file:
+                self.checkpoints = json.load(file)['checkpoints']
+
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint_writer')
+        self.pending_write = None
+
+    def save(self, epoch, gat, optimizer, val_acc, device_metrics=None, grad_scaler=None):
+        """
+        Returns as soon as the state is snapshotted, the write happens in the background.
+        val_acc - val accuracy of the current weights (used to pick the best checkpoints)
+
+        """
+        training_state = utils.get_training_state(self.training_config, gat)
+        training_state.update({
+            'epoch': epoch,
+            'val_acc': float(val_acc),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'early_stopping_state': device_metrics.state_dict() if device_metrics is not None else None,
+            'grad_scaler_state_dict': grad_scaler.state_dict() if grad_scaler is not None else None,
+            'rng_state': torch.get_rng_state(),
+            'cuda_rng_state': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+        })
+        # Copies, not views - the weights/optimizer moments get updated in-place while the write is in flight
+        training_state = snapshot_to_cpu(training_state)
+
+        self.wait()
+        self.pending_write = self.writer.submit(self.write, training_state, f'gat_ckpt_epoch_{epoch + 1}.pth')
+
+    def wait(self):
+        # Blocks until the in-flight write (if any) is done, re-raises its exception if it failed
+        if self.pending_write is not None:
+            self.pending_write.result()
+            self.pending_write = None
+
+    def close(self):
+        self.wait()
+        self.writer.shutdown()
+
+    def write(self, training_state, file_name):
+        # Runs on the writer thread
+        atomic_write(os.path.join(self.checkpoints_path, file_name), lambda file: torch.save(training_state, file))
+
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint['file_name'] != file_name]
+        self.checkpoints.append({'file_name': file_name, 'epoch': training_state['epoch'], 'val_acc': training_state['val_acc']})
+        self.checkpoints.sort(key=lambda checkpoint: checkpoint['epoch'])
+
+        # Last k by epoch + best k by val accuracy (the newer one wins the ties), the manifest is updated before the
+        # files get deleted - it never lists a missing file
+        kept_file_names = {checkpoint['file_name'] for checkpoint in self.checkpoints[-self.keep_last_k:]}
+        best_checkpoints = sorted(self.checkpoints, key=lambda checkpoint: (checkpoint['val_acc'], checkpoint['epoch']), reverse=True)
+        kept_file_names.update(checkpoint['file_name'] for checkpoint in best_checkpoints[:self.keep_best_k])
+
+        removed_file_names = [checkpoint['file_name'] for checkpoint in self.checkpoints if checkpoint['file_name'] not in kept_file_names]
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint['file_name'] in kept_file_names]
+        manifest = {'checkpoints': self.checkpoints}
+        atomic_write(os.path.join(self.checkpoints_path, CHECKPOINTS_MANIFEST_FILE_NAME), lambda file: file.write(json.dumps(manifest, indent=4).encode()))
+
+        for removed_file_name in removed_file_names:
+            removed_file_path = os.path.join(self.checkpoints_path, removed_file_name)
+            if os.path.exists(removed_file_path):
+                os.remove(removed_file_path)
+
+    def load_latest(self, device):
+        """
+        Returns the training state of the newest checkpoint (None if there are none).
+
+        """
+        self.wait()
+        if len(self.checkpoints) == 0:
+            return None
+
+        return torch.load(os.path.join(self.checkpoints_path, self.checkpoints[-1]['file_name']), map_location=device)
+
+
+def snapshot_to_cpu(state):
+    # Recursively copies all of the tensors inside of (nested) dicts/lists/tuples to the CPU
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    elif isinstance(state, dict):
+        return {key: snapshot_to_cpu(value) for key, value in state.items()}
+    elif isinstance(state, (list, tuple)):
+        return type(state)(snapshot_to_cpu(value) for value in state)
+    else:
+        return state
+
+
+def atomic_write(path, write_fn):
+    # Write + fsync a temporary file in the same directory then rename it - readers see either the old or the new file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        write_fn(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+    if os.name == 'posix':  # persist the rename itself (directories can't be opened on Windows)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -5,7 +5,6 @@
 
 import os
 import enum
-from torch.utils.tensorboard import SummaryWriter
 
 
 # Supported datasets - currently only Cora
@@ -26,6 +25,27 @@ class LayerType(enum.Enum):
     IMP3 = 2
 
 
+# FP32 is the default, BF16/FP16 turn on mixed precision (autocast) - BF16 is the one to use on CPUs
+class Precision(enum.Enum):
+    FP32 = 0,
+    BF16 = 1,
+    FP16 = 2
+
+
+# Node relabeling applied before training (utils/reordering.py) - puts neighbors close in memory for imp3's gather/scatter
+class NodeOrdering(enum.Enum):
+    NONE = 0,
+    RCM = 1,
+    DEGREE = 2,
+    COMMUNITY = 3
+
+
+# Hyperparameter sweeps (sweep.py) - every combination of the candidate values or a random sample of them
+class SearchType(enum.Enum):
+    GRID = 0,
+    RANDOM = 1
+
+
 # 3 different model training/eval phases used in train.py
 class LoopPhase(enum.Enum):
     TRAIN = 0,
@@ -39,20 +59,24 @@ class VisualizationType(enum.Enum):
     ENTROPY = 2,
 
 
-writer = SummaryWriter()  # (tensorboard) writer will output to ./runs/ directory by default
+# (tensorboard) writer will output to ./runs/ directory by default. It's created on first use - importing tensorboard is
+# slow and every writer creates a new ./runs/ subdirectory, even if we never log anything
+_writer = None
 
 
-# Global vars used for early stopping. After some number of epochs (as defined by the patience_period var) without any
-# improvement on the validation dataset (measured via accuracy metric), we'll break out from the training loop.
-BEST_VAL_ACC = 0
-BEST_VAL_LOSS = 0
-PATIENCE_CNT = 0
+def get_writer():
+    global _writer
+    if _writer is None:
+        from torch.utils.tensorboard import SummaryWriter
+        _writer = SummaryWriter()
+    return _writer
 
 
 BINARIES_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'models', 'binaries')
 CHECKPOINTS_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'models', 'checkpoints')
 DATA_DIR_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'data')
 CORA_PATH = os.path.join(DATA_DIR_PATH, 'cora')  # this is checked-in no need to make a directory
+CORA_STORE_PATH = os.path.join(CORA_PATH, 'store')  # memory-mapped graph store, converted from the pickles on first use
 
 # Make sure these exist as the rest of the code assumes it
 os.makedirs(BINARIES_PATH, exist_ok=True)
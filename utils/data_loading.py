@@ -36,77 +36,120 @@
 
 """
 
+import itertools
 import pickle
 
 
 import numpy as np
-import networkx as nx
 import scipy.sparse as sp
 import torch
 
 
 from utils.constants import *
-from utils.visualizations import plot_in_out_degree_distributions, visualize_graph
+from utils.graph_store import write_graph_store, graph_store_exists, open_graph_store, read_edge_index, to_tensor
+from utils.connectivity_mask import build_connectivity_mask
+from utils.graph import Graph
 
 
 def load_graph_data(training_config, device):
     dataset_name = training_config['dataset_name'].lower()
     layer_type = training_config['layer_type']
     should_visualize = training_config['should_visualize']
+    tiled_attention = training_config.get('tiled_attention', False)  # only relevant for imp1/imp2
+    sparse_features = training_config.get('sparse_features', False)  # only relevant for imp3
+    # int32 halves the edge index memory and bandwidth (imp3 gather/scatter, samplers) - fine for < 2^31 nodes
+    index_dtype = torch.int32 if training_config.get('int32_indices', False) else torch.long
 
     if dataset_name == DatasetType.CORA.name.lower():
 
-        # shape = (N, FIN), where N is the number of nodes and FIN is the number of input features
-        node_features_csr = pickle_read(os.path.join(CORA_PATH, 'node_features.csr'))
-        # shape = (N, 1)
-        node_labels_npy = pickle_read(os.path.join(CORA_PATH, 'node_labels.npy'))
-        # shape = (N, number of neighboring nodes) <- this is a dictionary not a matrix!
-        adjacency_list_dict = pickle_read(os.path.join(CORA_PATH, 'adjacency_list.dict'))
+        # Memory-mapped arrays, check out utils/graph_store.py (the pickles get converted into it the first time around)
+        manifest, graph_arrays = load_or_convert_cora_graph_store()
+        num_of_nodes = manifest['num_of_nodes']
+
+        # shape = (N, FIN), where N is the number of nodes and FIN is the number of input features (already normalized)
+        node_features_csr = sp.csr_matrix((graph_arrays['features_data'], graph_arrays['features_indices'], graph_arrays['features_indptr']), shape=(num_of_nodes, manifest['num_of_features']))
+        # shape = (N)
+        node_labels_npy = graph_arrays['labels']
+        # Edge index is stored with the self edges already added (faster than nx ~100 times, check out build_edge_index)
+        # shape = (2, E), where E is the number of edges, and 2 for source and target nodes. Basically edge index
+        # contains tuples of the format S->T, e.g. 0->3 means that node with id 0 points to a node with id 3.
+        # Note: the store may hold it compressed, read_edge_index decodes it directly into the index dtype
+        assert index_dtype == torch.long or num_of_nodes < 2**31, f'{num_of_nodes} nodes do not fit into int32 indices.'
+        edge_index = read_edge_index(manifest, graph_arrays, dtype=np.int32 if index_dtype == torch.int32 else np.int64)
+
+        # Convert to PyTorch tensors
+
+        # Needs to be an integer type (int64, or int32 in the int32 index mode) because later functions like PyTorch's
+        # index_select expect it
+        # Note: memory-mapped arrays are wrapped without copying (on CPU, the store already has the right dtypes)
+        edge_index = to_tensor(edge_index).to(device=device, dtype=index_dtype)
+        # Degrees, CSR/CSC views, etc. get computed once per graph and are shared by everybody (check out utils/graph.py)
+        graph = Graph(edge_index, num_of_nodes)
 
-        # Normalize the features
-        node_features_csr = normalize_features_sparse(node_features_csr)
-        num_of_nodes = len(node_labels_npy)
+        if should_visualize:  # network analysis and graph drawing
+            from utils.visualizations import plot_in_out_degree_distributions, visualize_graph  # matplotlib/igraph are slow to import
+            plot_in_out_degree_distributions(graph, num_of_nodes, dataset_name)
+            visualize_graph(graph, node_labels_npy, dataset_name)
 
+        # Note: topology is just a fancy way of naming the graph structure data
+        # (be it a Graph i.e. the edge index format or connectivity mask)
         if layer_type == LayerType.IMP3:
-            # Build edge index explicitly (faster than nx ~100 times and as fast as PyGeometric imp but less complex)
-            # shape = (2, E), where E is the number of edges, and 2 for source and target nodes. Basically edge index
-            # contains tuples of the format S->T, e.g. 0->3 means that node with id 0 points to a node with id 3.
-            topology = build_edge_index(adjacency_list_dict, num_of_nodes, add_self_edges=True)
+            topology = graph
         elif layer_type == LayerType.IMP2 or layer_type == LayerType.IMP1:
-            # adjacency matrix shape = (N, N)
-            topology = nx.adjacency_matrix(nx.from_dict_of_lists(adjacency_list_dict)).todense().astype(np.float)
-            topology += np.identity(topology.shape[0])  # add self connections
-            topology[topology > 0] = 1  # multiple edges not allowed
-            topology[topology == 0] = -np.inf  # make it a mask instead of adjacency matrix (used to mask softmax)
-            topology[topology == 1] = 0
+            # Built directly on the device from the edge index (check out utils/connectivity_mask.py)
+            # Compact bit-packed mask, shape = (N, ceil(N/8)), imp1/imp2 will process it tile by tile
+            # or the additive (0/-inf) float mask, shape = (N, N)
+            topology = build_connectivity_mask(edge_index, num_of_nodes, dtype=torch.uint8 if tiled_attention else torch.float32)
         else:
             raise Exception(f'Layer type {layer_type} not yet supported.')
-
-        # Note: topology is just a fancy way of naming the graph structure data
-        # (be it in the edge index format or adjacency matrix)
-
-        if should_visualize:  # network analysis and graph drawing
-            plot_in_out_degree_distributions(topology, num_of_nodes, dataset_name)
-            visualize_graph(topology, node_labels_npy, dataset_name)
-
-        # Convert to dense PyTorch tensors
-
-        # Needs to be long int type (in implementation 3) because later functions like PyTorch's index_select expect it
-        topology = torch.tensor(topology, dtype=torch.long if layer_type == LayerType.IMP3 else torch.float, device=device)
-        node_labels = torch.tensor(node_labels_npy, dtype=torch.long, device=device)  # Cross entropy expects a long int
-        node_features = torch.tensor(node_features_csr.todense(), device=device)
+        node_labels = to_tensor(node_labels_npy).to(device=device, dtype=torch.long)  # Cross entropy expects a long int
+        if sparse_features:
+            # torch sparse CSR tensor - never densified, GATLayerImp3 projects it with a sparse-dense matmul
+            node_features = torch.sparse_csr_tensor(to_tensor(node_features_csr.indptr), to_tensor(node_features_csr.indices), to_tensor(node_features_csr.data), size=node_features_csr.shape).to(device)
+        else:
+            node_features = torch.tensor(node_features_csr.todense(), device=device)
 
         # Indices that help us extract nodes that belong to the train/val and test splits
-        train_indices = torch.arange(CORA_TRAIN_RANGE[0], CORA_TRAIN_RANGE[1], dtype=torch.long, device=device)
-        val_indices = torch.arange(CORA_VAL_RANGE[0], CORA_VAL_RANGE[1], dtype=torch.long, device=device)
-        test_indices = torch.arange(CORA_TEST_RANGE[0], CORA_TEST_RANGE[1], dtype=torch.long, device=device)
+        train_indices = torch.nonzero(to_tensor(graph_arrays['train_mask']), as_tuple=True)[0].to(device)
+        val_indices = torch.nonzero(to_tensor(graph_arrays['val_mask']), as_tuple=True)[0].to(device)
+        test_indices = torch.nonzero(to_tensor(graph_arrays['test_mask']), as_tuple=True)[0].to(device)
 
         return node_features, node_labels, topology, train_indices, val_indices, test_indices
     else:
         raise Exception(f'{dataset_name} not yet supported.')
 
 
-# All Cora data is stored as pickle
+def convert_cora_to_graph_store(store_path=CORA_STORE_PATH):
+    """
+    Converts the Cora pickles into the memory-mapped graph store (check out utils/graph_store.py). Everything that used
+    to be re-derived on every run (feature normalization, edge index, splits) is done once here.
+
+    """
+    node_features_csr = normalize_features_sparse(pickle_read(os.path.join(CORA_PATH, 'node_features.csr'))).tocsr()
+    node_labels_npy = pickle_read(os.path.join(CORA_PATH, 'node_labels.npy'))
+    adjacency_list_dict = pickle_read(os.path.join(CORA_PATH, 'adjacency_list.dict'))
+
+    num_of_nodes = len(node_labels_npy)
+    edge_index = build_edge_index(adjacency_list_dict, num_of_nodes, add_self_edges=True)
+
+    split_masks = {}
+    for split_name, split_range in [('train', CORA_TRAIN_RANGE), ('val', CORA_VAL_RANGE), ('test', CORA_TEST_RANGE)]:
+        split_masks[split_name] = np.zeros(num_of_nodes, dtype=bool)
+        split_masks[split_name][split_range[0]:split_range[1]] = True
+
+    write_graph_store(store_path, node_features_csr, node_labels_npy, edge_index, split_masks,
+                      dataset_name=DatasetType.CORA.name, features_normalized=True, self_edges=True)
+
+
+def load_or_convert_cora_graph_store(store_path=CORA_STORE_PATH):
+    if not graph_store_exists(store_path):
+        print(f'Converting {DatasetType.CORA.name} pickles into a graph store at {store_path}.')
+        convert_cora_to_graph_store(store_path)
+
+    return open_graph_store(store_path)
+
+
+# All Cora data is stored as pickle (the source format, check out convert_cora_to_graph_store)
 def pickle_read(path):
     with open(path, 'rb') as file:
         data = pickle.load(file)
@@ -151,7 +194,76 @@ def normalize_features_dense(node_features_dense):
     return node_features_dense / np.clip(node_features_dense.sum(1), a_min=1, a_max=None)
 
 
-def build_edge_index(adjacency_list_dict, num_of_nodes, add_self_edges=True):
+def build_edge_index(graph, num_of_nodes, add_self_edges=True, symmetrize=False, keep_input_order=True):
+    """
+    Vectorized edge index construction, shape = (2, E). graph can be any of:
+        * adjacency list dict - {src node id: [trg node ids]} (e.g. Cora's adjacency_list.dict)
+        * scipy sparse adjacency matrix (non-zero at (src, trg) means there is an edge src -> trg)
+        * raw edge arrays - a (2, E) array or a (source node ids, target node ids) pair
+
+    Duplicate edges are removed (coalescing) by packing every edge into a single 64-bit key (src * N + trg) and running
+    np.unique over those - no per-edge Python objects so this scales to 100M+ edges.
+
+    symmetrize - add the reverse of every edge (treat the graph as undirected)
+    keep_input_order - keep the edges in the order of their first occurrence (same as build_edge_index_loop), otherwise
+    they're sorted by (source, target) which is a bit faster
+
+    """
+    source_nodes_ids, target_nodes_ids = flatten_graph(graph)
+    assert num_of_nodes < 2**31, f'Packed edge keys need src * N + trg to fit into int64, got N = {num_of_nodes}.'
+
+    if symmetrize:
+        source_nodes_ids, target_nodes_ids = np.concatenate([source_nodes_ids, target_nodes_ids]), np.concatenate([target_nodes_ids, source_nodes_ids])
+
+    if add_self_edges:  # existing self edges are dropped, every node gets exactly 1 self edge appended at the end
+        non_self_edges_mask = source_nodes_ids != target_nodes_ids
+        source_nodes_ids, target_nodes_ids = source_nodes_ids[non_self_edges_mask], target_nodes_ids[non_self_edges_mask]
+
+    # Coalescing - removing duplicates. After sorting the keys duplicates are neighbors, keep the first of every run
+    edge_keys = source_nodes_ids * num_of_nodes + target_nodes_ids
+    if keep_input_order:
+        sort_permutation = np.argsort(edge_keys, kind='stable')  # stable - the first of every run is its first occurrence
+        sorted_edge_keys = edge_keys[sort_permutation]
+        first_occurrence_ids = np.sort(sort_permutation[get_run_starts_mask(sorted_edge_keys)])
+        unique_edge_keys = edge_keys[first_occurrence_ids]
+    else:
+        sorted_edge_keys = np.sort(edge_keys)
+        unique_edge_keys = sorted_edge_keys[get_run_starts_mask(sorted_edge_keys)]
+    source_nodes_ids, target_nodes_ids = np.divmod(unique_edge_keys, num_of_nodes)
+
+    if add_self_edges:
+        self_edges_ids = np.arange(num_of_nodes, dtype=np.int64)
+        source_nodes_ids, target_nodes_ids = np.concatenate([source_nodes_ids, self_edges_ids]), np.concatenate([target_nodes_ids, self_edges_ids])
+
+    # shape = (2, E), where E is the number of edges in the graph
+    return np.vstack((source_nodes_ids, target_nodes_ids))
+
+
+def get_run_starts_mask(sorted_array):
+    # True at the first element of every run of equal values
+    run_starts_mask = np.ones(len(sorted_array), dtype=bool)
+    run_starts_mask[1:] = sorted_array[1:] != sorted_array[:-1]
+    return run_starts_mask
+
+
+def flatten_graph(graph):
+    # Returns (source node ids, target node ids) int64 arrays for all of the supported graph formats (see above)
+    if isinstance(graph, dict):
+        num_of_neighbors = np.fromiter((len(neighboring_nodes) for neighboring_nodes in graph.values()), dtype=np.int64, count=len(graph))
+        source_nodes_ids = np.repeat(np.fromiter(graph.keys(), dtype=np.int64, count=len(graph)), num_of_neighbors)
+        target_nodes_ids = np.fromiter(itertools.chain.from_iterable(graph.values()), dtype=np.int64, count=num_of_neighbors.sum())
+    elif sp.issparse(graph):
+        graph = graph.tocoo()
+        source_nodes_ids, target_nodes_ids = graph.row, graph.col
+    else:
+        source_nodes_ids, target_nodes_ids = graph
+
+    return np.asarray(source_nodes_ids, dtype=np.int64), np.asarray(target_nodes_ids, dtype=np.int64)
+
+
+# Not used -> the original pure Python implementation, check out playground.py where it's profiled against
+# build_edge_index() (it's a lot slower and needs a Python tuple per edge for the deduplication)
+def build_edge_index_loop(adjacency_list_dict, num_of_nodes, add_self_edges=True):
     source_nodes_ids, target_nodes_ids = [], []
     seen_edges = set()
 
@@ -169,16 +281,18 @@ def build_edge_index(adjacency_list_dict, num_of_nodes, add_self_edges=True):
         target_nodes_ids.extend(np.arange(num_of_nodes))
 
     # shape = (2, E), where E is the number of edges in the graph
-    edge_index = np.row_stack((source_nodes_ids, target_nodes_ids))
+    edge_index = np.vstack((source_nodes_ids, target_nodes_ids))
 
     return edge_index
 
 
 # Not used - this is yet another way to construct the edge index by leveraging the existing package (networkx)
-# (it's just slower than my simple implementation build_edge_index())
+# (it's just slower than build_edge_index())
 def build_edge_index_nx(adjacency_list_dict):
+    import networkx as nx
+
     nx_graph = nx.from_dict_of_lists(adjacency_list_dict)
     adj = nx.adjacency_matrix(nx_graph)
     adj = adj.tocoo()  # convert to COO (COOrdinate sparse format)
 
-    return np.row_stack((adj.row, adj.col))
+    return np.vstack((adj.row, adj.col))
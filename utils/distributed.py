@@ -0,0 +1,147 @@
+"""
+    Graph-partitioned, multi-process (torch.distributed + gloo) GAT training on a single machine.
+
+    A single PyTorch process doesn't keep a many-core CPU busy on scatter/gather heavy workloads like GAT. So instead we
+    start N worker processes and split the nodes between them (using the partitioner from utils/partitioning.py so that
+    most edges stay inside of a worker):
+        * every worker owns a partition of the nodes and computes the GAT outputs only for those nodes
+        * to do that it needs the features of the nodes that point into its partition but are owned by other workers
+          (the halo nodes) - those are exchanged before every GAT layer (and their gradients are sent back in backprop)
+        * every worker computes the gradients of its part of the loss and gradients are all-reduced (summed), so all of
+          the workers end up doing the exact same optimizer step
+
+    Note: with dropout on this isn't exactly the full-batch model - every worker draws its own dropout masks, including
+    for its copies of the halo nodes, so a halo node's features get dropped differently on its owner and on every worker
+    that reads them. With dropout = 0 it is the full-batch training (check out validate_distributed_training in
+    playground.py).
+
+"""
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+class GraphPartition:
+    """
+    The part of the graph owned by a single worker.
+
+    Local node ids: [0, num_of_owned_nodes) are the owned nodes (sorted by their global id), followed by the halo nodes
+    grouped by the worker that owns them (and sorted by global id inside of every group).
+
+    """
+
+    src_nodes_dim = 0  # position of source nodes in edge index
+    trg_nodes_dim = 1  # position of target nodes in edge index
+
+    def __init__(self, edge_index, node_to_worker, rank, world_size):
+        # Every worker computes its partition independently (no communication needed) - edge_index and node_to_worker
+        # (shape = (N), the worker owning every node) are the same on all of the workers
+        self.rank = rank
+        self.world_size = world_size
+
+        edge_index, node_to_worker = edge_index.cpu().numpy(), np.asarray(node_to_worker)
+        src_nodes_ids, trg_nodes_ids = edge_index[self.src_nodes_dim], edge_index[self.trg_nodes_dim]
+        src_workers, trg_workers = node_to_worker[src_nodes_ids], node_to_worker[trg_nodes_ids]
+
+        self.owned_nodes_ids = np.flatnonzero(node_to_worker == rank)
+        self.num_of_owned_nodes = len(self.owned_nodes_ids)
+
+        # Halo nodes we receive from worker q: sources of the edges pointing into our nodes that are owned by q.
+        # Nodes we send to worker q: sources of the edges pointing into q's nodes that we own (q's halo from us).
+        incoming_edges_mask = trg_workers == rank
+        halo_nodes_ids, self.send_ids = [], []
+        for worker in range(world_size):
+            halo_nodes_ids.append(np.unique(src_nodes_ids[incoming_edges_mask & (src_workers == worker)]) if worker != rank else np.zeros(0, dtype=np.int64))
+            sent_nodes_ids = np.unique(src_nodes_ids[(trg_workers == worker) & (src_workers == rank)]) if worker != rank else np.zeros(0, dtype=np.int64)
+            self.send_ids.append(torch.from_numpy(np.searchsorted(self.owned_nodes_ids, sent_nodes_ids)))
+        self.recv_counts = [len(ids) for ids in halo_nodes_ids]
+
+        # Relabel the incoming edges into local ids
+        local_ids_lookup = np.full(len(node_to_worker), -1, dtype=np.int64)
+        local_nodes_ids = np.concatenate([self.owned_nodes_ids] + halo_nodes_ids)
+        local_ids_lookup[local_nodes_ids] = np.arange(len(local_nodes_ids))
+        self.edge_index = torch.from_numpy(local_ids_lookup[edge_index[:, incoming_edges_mask]].astype(edge_index.dtype))  # int64/int32
+        self.owned_nodes_ids = torch.from_numpy(self.owned_nodes_ids)
+
+    def run_gat(self, gat, owned_nodes_features):
+        """
+        Same as gat(data) but for the owned nodes only, shape = (num_of_owned_nodes, FIN) -> (num_of_owned_nodes, C)
+
+        """
+        for layer in gat.gat_net:
+            local_nodes_features = HaloExchange.apply(owned_nodes_features, self)
+            # Halo nodes have no incoming edges in the local graph - their output rows are meaningless, drop them
+            owned_nodes_features = layer((local_nodes_features, self.edge_index))[0][:self.num_of_owned_nodes]
+
+        return owned_nodes_features
+
+    def exchange(self, send_tensors, recv_shapes, dtype):
+        # Point-to-point exchange with every other worker, all of the ops are in flight at the same time (no deadlocks)
+        recv_tensors = [torch.empty(shape, dtype=dtype) for shape in recv_shapes]
+        requests = []
+        for worker in range(self.world_size):
+            if worker == self.rank:
+                continue
+            if recv_tensors[worker].shape[0] > 0:
+                requests.append(dist.irecv(recv_tensors[worker], src=worker))
+            if send_tensors[worker].shape[0] > 0:
+                requests.append(dist.isend(send_tensors[worker].contiguous(), dst=worker))
+
+        for request in requests:
+            request.wait()
+
+        return recv_tensors
+
+
+class HaloExchange(torch.autograd.Function):
+    """
+    Forward: (num_of_owned_nodes, F) -> (num_of_owned_nodes + num_of_halo_nodes, F), appends the halo node features.
+    Backward: the gradients of the halo rows are sent back to their owners and added to the owned nodes' gradients.
+
+    """
+
+    @staticmethod
+    def forward(ctx, owned_nodes_features, partition):
+        ctx.partition = partition
+        num_of_features = owned_nodes_features.shape[1]
+
+        send_tensors = [owned_nodes_features.index_select(0, ids) for ids in partition.send_ids]
+        recv_shapes = [(count, num_of_features) for count in partition.recv_counts]
+        halo_nodes_features = partition.exchange(send_tensors, recv_shapes, owned_nodes_features.dtype)
+
+        return torch.cat([owned_nodes_features] + halo_nodes_features, dim=0)
+
+    @staticmethod
+    def backward(ctx, grad_local_nodes_features):
+        partition = ctx.partition
+        num_of_features = grad_local_nodes_features.shape[1]
+
+        grad_owned_nodes_features, *grad_halo_nodes_features = torch.split(grad_local_nodes_features, [partition.num_of_owned_nodes] + partition.recv_counts)
+        recv_shapes = [(len(ids), num_of_features) for ids in partition.send_ids]
+        grads_from_other_workers = partition.exchange(grad_halo_nodes_features, recv_shapes, grad_local_nodes_features.dtype)
+
+        # A node can be in the halo of many workers - sum up all of the gradient contributions
+        grad_owned_nodes_features = grad_owned_nodes_features.clone()
+        for ids, grad in zip(partition.send_ids, grads_from_other_workers):
+            grad_owned_nodes_features.index_add_(0, ids, grad)
+
+        return grad_owned_nodes_features, None
+
+
+def all_reduce_gradients(model):
+    # A single all-reduce over a flattened buffer is much faster than one per parameter
+    params_with_grad = [param for param in model.parameters() if param.grad is not None]
+    flat_grads = torch.cat([param.grad.reshape(-1) for param in params_with_grad])
+    dist.all_reduce(flat_grads, op=dist.ReduceOp.SUM)
+
+    offset = 0
+    for param in params_with_grad:
+        param.grad.copy_(flat_grads[offset:offset + param.numel()].view_as(param.grad))
+        offset += param.numel()
+
+
+def broadcast_parameters(model, src=0):
+    # Make sure all of the workers start from the same weights
+    for param in model.parameters():
+        dist.broadcast(param.data, src=src)
@@ -0,0 +1,218 @@
+"""
+    Graph - the edge index plus everything we keep re-deriving from it.
+
+    Every consumer of the topology used to rebuild what it needed from the raw (2, E) edge index: the fused imp3 layers
+    sorted the edges by target node on every forward pass, incremental inference built its own CSR indices, the
+    visualizations looped over the edges to get the degrees, etc.
+
+    Graph holds the edge index and computes these lazily, on first use, and caches them for the lifetime of the graph:
+        * in/out degrees, shape = (N)
+        * colptr + trg_sort_permutation (+ the sorted edge index) - CSC view, edges grouped by their target node (i.e.
+          the neighborhoods)
+        * rowptr + src_sort_permutation - CSR view, edges grouped by their source node (i.e. the out-neighbors)
+        * whether the graph has self loops
+
+    The sorts are stable so inside of every group the edges keep their edge index order. The edge index itself is never
+    modified - a graph that changes (e.g. new edges) is just a new Graph. add_edges builds it from the old one's cached
+    views: the new edges go to the end of their groups (where a stable sort would put them) so nothing gets re-sorted.
+
+"""
+
+import numpy as np
+import torch
+
+
+class Graph:
+    __slots__ = ('edge_index', 'num_of_nodes', '_in_degrees', '_out_degrees', '_colptr', '_rowptr',
+                 '_trg_sort_permutation', '_src_sort_permutation', '_trg_sorted_edge_index', '_has_self_loops')
+
+    src_nodes_dim = 0  # position of source nodes in edge index
+    trg_nodes_dim = 1  # position of target nodes in edge index
+
+    def __init__(self, edge_index, num_of_nodes=None):
+        """
+        edge_index - torch tensor or NumPy array, shape = (2, E)
+        num_of_nodes - if None it's inferred from the edge index (max node id + 1)
+
+        """
+        if isinstance(edge_index, np.ndarray):
+            edge_index = torch.from_numpy(edge_index)
+        assert edge_index.dim() == 2 and edge_index.shape[0] == 2, f'Expected edge index with shape=(2,E) got {edge_index.shape}.'
+
+        self.edge_index = edge_index
+        self.num_of_nodes = num_of_nodes if num_of_nodes is not None else (int(edge_index.max()) + 1 if edge_index.numel() > 0 else 0)
+
+        self._in_degrees = None
+        self._out_degrees = None
+        self._colptr = None
+        self._rowptr = None
+        self._trg_sort_permutation = None
+        self._src_sort_permutation = None
+        self._trg_sorted_edge_index = None
+        self._has_self_loops = None
+
+    def __repr__(self):
+        return f'Graph(num_of_nodes={self.num_of_nodes}, num_of_edges={self.num_of_edges}, device={self.device})'
+
+    @property
+    def num_of_edges(self):
+        return self.edge_index.shape[1]
+
+    @property
+    def device(self):
+        return self.edge_index.device
+
+    @property
+    def src_index(self):
+        return self.edge_index[self.src_nodes_dim]
+
+    @property
+    def trg_index(self):
+        return self.edge_index[self.trg_nodes_dim]
+
+    def add_edges(self, new_edge_index):
+        """
+        Returns the graph with new_edge_index (shape = (2, E')) appended to the edge index. The views that this graph
+        has already computed are spliced into the new graph in O(E + N) instead of being recomputed in O(E log E).
+
+        """
+        new_edge_index = new_edge_index.to(device=self.device, dtype=self.edge_index.dtype)
+        new_src_index, new_trg_index = new_edge_index[self.src_nodes_dim], new_edge_index[self.trg_nodes_dim]
+        graph = Graph(torch.cat([self.edge_index, new_edge_index], dim=1), self.num_of_nodes)
+
+        if self._in_degrees is not None:
+            graph._in_degrees = self._in_degrees + torch.bincount(new_trg_index, minlength=self.num_of_nodes)
+        if self._out_degrees is not None:
+            graph._out_degrees = self._out_degrees + torch.bincount(new_src_index, minlength=self.num_of_nodes)
+        if self._trg_sort_permutation is not None:
+            graph._colptr, graph._trg_sort_permutation = splice_groups(self.colptr, self._trg_sort_permutation, new_trg_index)
+        if self._src_sort_permutation is not None:
+            graph._rowptr, graph._src_sort_permutation = splice_groups(self.rowptr, self._src_sort_permutation, new_src_index)
+        if self._trg_sorted_edge_index is not None:
+            graph._trg_sorted_edge_index = graph.edge_index.index_select(1, graph.trg_sort_permutation)
+        if self._has_self_loops is not None:
+            graph._has_self_loops = self._has_self_loops or bool(torch.any(new_src_index == new_trg_index))
+
+        return graph
+
+    def to(self, device):
+        # Cached views are cheap to recompute, the new graph builds them (on the new device) as needed
+        return self if self.device == torch.device(device) else Graph(self.edge_index.to(device), self.num_of_nodes)
+
+    #
+    # Lazily computed (and cached) views
+    #
+
+    @property
+    def in_degrees(self):
+        if self._in_degrees is None:
+            self._in_degrees = torch.bincount(self.trg_index, minlength=self.num_of_nodes)
+        return self._in_degrees
+
+    @property
+    def out_degrees(self):
+        if self._out_degrees is None:
+            self._out_degrees = torch.bincount(self.src_index, minlength=self.num_of_nodes)
+        return self._out_degrees
+
+    @property
+    def trg_sort_permutation(self):
+        # Edge ids sorted by the target node, edges of node i's neighborhood are trg_sort_permutation[colptr[i]:colptr[i+1]]
+        if self._trg_sort_permutation is None:
+            self._trg_sort_permutation = torch.sort(self.trg_index, stable=True)[1]
+        return self._trg_sort_permutation
+
+    @property
+    def src_sort_permutation(self):
+        # Edge ids sorted by the source node, out-edges of node i are src_sort_permutation[rowptr[i]:rowptr[i+1]]
+        if self._src_sort_permutation is None:
+            self._src_sort_permutation = torch.sort(self.src_index, stable=True)[1]
+        return self._src_sort_permutation
+
+    @property
+    def trg_sorted_edge_index(self):
+        # The edge index in the trg_sort_permutation order, shape = (2, E)
+        if self._trg_sorted_edge_index is None:
+            self._trg_sorted_edge_index = self.edge_index.index_select(1, self.trg_sort_permutation)
+        return self._trg_sorted_edge_index
+
+    @property
+    def colptr(self):
+        if self._colptr is None:
+            self._colptr = build_ptr(self.in_degrees)
+        return self._colptr
+
+    @property
+    def rowptr(self):
+        if self._rowptr is None:
+            self._rowptr = build_ptr(self.out_degrees)
+        return self._rowptr
+
+    @property
+    def has_self_loops(self):
+        if self._has_self_loops is None:
+            self._has_self_loops = bool(torch.any(self.src_index == self.trg_index))
+        return self._has_self_loops
+
+    #
+    # Queries built on top of the cached views
+    #
+
+    def in_edge_ids(self, node_ids):
+        # Ids of the edges pointing into node_ids (i.e. their neighborhoods), grouped by node in the node_ids order
+        return gather_groups(self.colptr, self.trg_sort_permutation, node_ids)
+
+    def out_edge_ids(self, node_ids):
+        # Ids of the edges going out of node_ids, grouped by node in the node_ids order
+        return gather_groups(self.rowptr, self.src_sort_permutation, node_ids)
+
+
+def as_graph(topology, num_of_nodes=None):
+    # Lets the consumers take either a Graph or a raw edge index (a wrapped edge index caches only while the wrapper lives)
+    return topology if isinstance(topology, Graph) else Graph(topology, num_of_nodes)
+
+
+def get_edge_index(topology):
+    return topology.edge_index if isinstance(topology, Graph) else topology
+
+
+def build_ptr(counts):
+    ptr = torch.zeros(counts.shape[0] + 1, dtype=torch.long, device=counts.device)
+    ptr[1:] = torch.cumsum(counts, dim=0)
+    return ptr
+
+
+def gather_groups(ptr, sort_permutation, node_ids):
+    # Concatenate sort_permutation[ptr[i]:ptr[i+1]] for every i in node_ids
+    group_starts = ptr.index_select(0, node_ids)
+    group_lengths = ptr.index_select(0, node_ids + 1) - group_starts
+    group_offsets = torch.cumsum(group_lengths, dim=0) - group_lengths  # where each group starts in the output
+
+    positions = torch.arange(int(group_lengths.sum()), device=ptr.device)
+    positions += torch.repeat_interleave(group_starts - group_offsets, group_lengths)
+
+    return sort_permutation.index_select(0, positions)
+
+
+def splice_groups(ptr, sort_permutation, new_group_ids):
+    """
+    Appends new edges (ids E, E + 1, ...) to a grouped view (ptr + sort_permutation) - every new edge goes to the end of
+    its group, in the edge index order. Same result as a stable sort of the concatenated edge index. Returns the new
+    ptr and sort permutation.
+
+    """
+    num_of_edges, num_of_new_edges = sort_permutation.shape[0], new_group_ids.shape[0]
+    group_sizes = ptr[1:] - ptr[:-1]
+    new_ptr = build_ptr(group_sizes + torch.bincount(new_group_ids, minlength=group_sizes.shape[0]))
+
+    # Existing edges shift by the number of new edges in the groups before theirs
+    old_positions = torch.arange(num_of_edges, device=ptr.device) + torch.repeat_interleave((new_ptr - ptr)[:-1], group_sizes)
+    # The j-th new edge (in group order) lands after the old edges of its group and all of the j new edges before it
+    new_edges_order = torch.sort(new_group_ids, stable=True)[1]
+    new_positions = ptr.index_select(0, new_group_ids.index_select(0, new_edges_order) + 1) + torch.arange(num_of_new_edges, device=ptr.device)
+
+    new_sort_permutation = sort_permutation.new_empty(num_of_edges + num_of_new_edges)
+    new_sort_permutation.index_copy_(0, old_positions, sort_permutation)
+    new_sort_permutation.index_copy_(0, new_positions, new_edges_order + num_of_edges)
+
+    return new_ptr, new_sort_permutation
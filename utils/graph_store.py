@@ -0,0 +1,172 @@
+"""
+    Memory-mapped on-disk graph store.
+
+    Unpickling Cora (and re-deriving the normalized features and the edge index from the adjacency list dict) on every
+    run is fine for a toy graph but it doesn't scale: pickles have to be read and deserialized in full by every process.
+
+    The graph store is a directory of raw .npy arrays plus a small JSON manifest:
+        * features_indptr, features_indices, features_data - (normalized) node features in CSR format, shape = (N, FIN)
+        * labels - shape = (N)
+        * edge_index - shape = (2, E), self edges included
+        * train_mask, val_mask, test_mask - shape = (N), boolean split masks
+
+    The arrays are opened with np.load(mmap_mode='r') and wrapped as torch tensors without copying, so opening a big
+    graph takes milliseconds (only the pages we actually touch get read) and the OS page cache is shared between all of
+    the processes that open the same store (e.g. the distributed workers).
+
+    The manifest is written last - a store without it is an incomplete conversion and is never opened.
+
+    Stores can hold extra arrays (e.g. edge_indptr written by utils/ingestion.py), every array listed in the manifest
+    gets opened.
+
+    For big graphs the edge index can be swapped for the compressed topology (compress_graph_store_topology, check out
+    utils/topology_compression.py) - read_edge_index handles both.
+
+"""
+
+import json
+import os
+import warnings
+
+
+import numpy as np
+import torch
+
+
+from utils.topology_compression import compress_topology, decompress_topology
+
+GRAPH_STORE_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = 'manifest.json'
+
+array_names = ['features_indptr', 'features_indices', 'features_data', 'labels', 'edge_index', 'train_mask', 'val_mask', 'test_mask']
+compressed_topology_array_names = ['topology_colptr', 'topology_block_ptr', 'topology_bytes']
+
+
+def write_graph_store(store_path, node_features_csr, node_labels, edge_index, split_masks, **metadata):
+    """
+    split_masks - dict with train/val/test boolean masks, metadata - any extra (JSON serializable) info for the manifest
+
+    """
+    invalidate_graph_store(store_path)
+
+    arrays = {
+        'features_indptr': node_features_csr.indptr,
+        'features_indices': node_features_csr.indices,
+        'features_data': node_features_csr.data,
+        'labels': node_labels,
+        'edge_index': edge_index,
+        'train_mask': split_masks['train'],
+        'val_mask': split_masks['val'],
+        'test_mask': split_masks['test']
+    }
+
+    for name in array_names:
+        np.save(os.path.join(store_path, f'{name}.npy'), np.ascontiguousarray(arrays[name]))
+
+    write_graph_store_manifest(store_path, array_names, num_of_nodes=node_features_csr.shape[0], num_of_features=node_features_csr.shape[1], num_of_edges=edge_index.shape[1], **metadata)
+
+
+def invalidate_graph_store(store_path):
+    # Remove the old manifest first - if we crash half-way through (re)writing the store it won't look valid
+    os.makedirs(store_path, exist_ok=True)
+    manifest_path = os.path.join(store_path, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def create_graph_store_array(store_path, name, dtype, shape):
+    # Writable memory-mapped .npy file - for stores that get written out-of-core, piece by piece
+    return np.lib.format.open_memmap(os.path.join(store_path, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+
+
+def write_graph_store_manifest(store_path, names, num_of_nodes, num_of_features, num_of_edges, **metadata):
+    """
+    Call this once all of the arrays (names) are written, the store becomes valid only after this call.
+
+    """
+    manifest = {
+        'format_version': GRAPH_STORE_FORMAT_VERSION,
+        'num_of_nodes': num_of_nodes,
+        'num_of_features': num_of_features,
+        'num_of_edges': num_of_edges,
+        'arrays': {},
+        **metadata
+    }
+    for name in names:
+        array = np.load(os.path.join(store_path, f'{name}.npy'), mmap_mode='r')  # only reads the header
+        manifest['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    with open(os.path.join(store_path, MANIFEST_FILE_NAME), 'w') as file:
+        json.dump(manifest, file, indent=4)
+
+
+def graph_store_exists(store_path):
+    manifest_path = os.path.join(store_path, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return False
+
+    with open(manifest_path, 'r') as file:
+        return json.load(file)['format_version'] == GRAPH_STORE_FORMAT_VERSION
+
+
+def open_graph_store(store_path):
+    """
+    Returns (manifest, arrays) where arrays maps array names to read-only memory-mapped NumPy arrays.
+
+    """
+    with open(os.path.join(store_path, MANIFEST_FILE_NAME), 'r') as file:
+        manifest = json.load(file)
+    assert manifest['format_version'] == GRAPH_STORE_FORMAT_VERSION, \
+        f'Expected graph store format version {GRAPH_STORE_FORMAT_VERSION} got {manifest["format_version"]}, rerun the conversion.'
+
+    arrays = {}
+    for name, array_info in manifest['arrays'].items():
+        array = np.load(os.path.join(store_path, f'{name}.npy'), mmap_mode='r')
+        assert array.dtype.str == array_info['dtype'] and list(array.shape) == array_info['shape'], f'Graph store array {name} does not match the manifest.'
+        arrays[name] = array
+
+    return manifest, arrays
+
+
+def compress_graph_store_topology(store_path, nodes_per_block=2**16):
+    """
+    Replaces the store's edge index with the compressed topology (delta-encoded sorted neighbor lists). Note: the edge
+    index gets read into RAM for the (one-off) compression.
+
+    """
+    manifest, arrays = open_graph_store(store_path)
+    assert 'edge_index' in arrays, f'Graph store {store_path} has no edge index to compress.'
+    topology_arrays = compress_topology(arrays['edge_index'], manifest['num_of_nodes'], nodes_per_block)
+    del arrays  # close the memory maps before we start deleting files
+
+    invalidate_graph_store(store_path)
+    for name, array in topology_arrays.items():
+        np.save(os.path.join(store_path, f'{name}.npy'), array)
+    # The edge order changes to (target, source) so ingestion's (source-sorted) edge_indptr doesn't apply anymore
+    names = [name for name in manifest['arrays'] if name not in ('edge_index', 'edge_indptr')] + compressed_topology_array_names
+    for name in set(manifest['arrays']) - set(names):
+        os.remove(os.path.join(store_path, f'{name}.npy'))
+
+    metadata = {key: value for key, value in manifest.items() if key not in ('format_version', 'num_of_nodes', 'num_of_features', 'num_of_edges', 'arrays')}
+    metadata['topology_nodes_per_block'] = nodes_per_block
+    write_graph_store_manifest(store_path, names, manifest['num_of_nodes'], manifest['num_of_features'], manifest['num_of_edges'], **metadata)
+
+
+def read_edge_index(manifest, arrays, dtype=np.int64):
+    """
+    Returns the edge index, shape = (2, E), from either the raw (memory-mapped, no copy if the dtype matches) or the
+    compressed topology (decoded block by block straight into dtype).
+
+    """
+    if 'edge_index' in arrays:
+        return arrays['edge_index'] if arrays['edge_index'].dtype == dtype else arrays['edge_index'].astype(dtype)
+
+    return decompress_topology(arrays, manifest['topology_nodes_per_block'], dtype)
+
+
+def to_tensor(array):
+    # Zero-copy - the tensor shares the (read-only) memory map. PyTorch warns about non-writable arrays but we never
+    # write into these tensors (ops that need a copy, e.g. .to(device) or dtype changes, make one anyway).
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        return torch.from_numpy(array)
@@ -0,0 +1,147 @@
+"""
+    Incremental inference for a trained (implementation #3) GAT.
+
+    In production graphs change a little at a time - a couple of nodes get new features, a couple of edges get added.
+    Rerunning the full-graph forward pass after every such change is wasteful since a GAT layer's output for node i
+    only depends on i's own input features and on the inputs of the nodes that point to i.
+
+    So we cache, for every GAT layer, the layer's inputs, projected features and source/target scores. When the caller
+    reports the changes we walk the layers and recompute only what's affected:
+        * nodes whose inputs changed get their projections and scores recomputed
+        * their out-neighbors (and the targets of the new edges) get their outputs recomputed
+        * those outputs are the changed inputs of the next layer - the frontier grows by 1 hop per layer (k-hop)
+
+    Every recomputation goes through exactly the same ops (and the same per-neighborhood edge order) as the full pass.
+
+    Note on exactness: BLAS libraries pick different (GEMV/small-matrix) kernels for matmuls with only a couple of rows
+    and those accumulate in a different order than the kernel used for the full (N, FIN) matrix (on the GPU so do the
+    atomics in index_add_). So the results match a full recompute up to float rounding, not bit for bit.
+
+"""
+
+import torch
+
+
+from models.definitions.GAT import GATLayerImp3
+from utils.graph import Graph, get_edge_index
+
+
+class IncrementalGATInference:
+    src_nodes_dim = 0  # position of source nodes in edge index
+    trg_nodes_dim = 1  # position of target nodes in edge index
+
+    def __init__(self, gat, node_features, edge_index):
+        """
+        edge_index - Graph or a raw edge index, shape = (2, E)
+
+        """
+        assert all(isinstance(layer, GATLayerImp3) for layer in gat.gat_net), f'Only implementation #3 is supported.'
+        assert not gat.training, f'Expected a GAT in eval mode (dropout must be off otherwise there is nothing to cache).'
+
+        self.gat = gat
+        # Graph's CSR/CSC views give us the out-neighbors and the neighborhoods (check out utils/graph.py)
+        self.graph = Graph(get_edge_index(edge_index), node_features.shape[0])
+
+        # layer_inputs[i] is the input of the i-th GAT layer, layer_inputs[-1] is the output of the whole GAT (logits)
+        self.layer_inputs = [node_features.clone()] + [None] * len(gat.gat_net)
+        self.nodes_features_proj = [None] * len(gat.gat_net)
+        self.scores_source = [None] * len(gat.gat_net)
+        self.scores_target = [None] * len(gat.gat_net)
+
+        self.recompute_all()
+
+    def get_logits(self):
+        return self.layer_inputs[-1]
+
+    @torch.no_grad()
+    def recompute_all(self):
+        all_node_ids = torch.arange(self.graph.num_of_nodes, device=self.graph.device)
+
+        for layer_id, layer in enumerate(self.gat.gat_net):
+            in_nodes_features = self.layer_inputs[layer_id]
+            self.nodes_features_proj[layer_id], self.scores_source[layer_id], self.scores_target[layer_id] = self.project_and_score(layer, in_nodes_features)
+            self.layer_inputs[layer_id + 1] = self.attend_and_aggregate(layer_id, layer, all_node_ids)
+
+        return self.get_logits()
+
+    @torch.no_grad()
+    def update(self, node_ids=None, new_node_features=None, new_edge_index=None):
+        """
+        node_ids shape = (M), new_node_features shape = (M, FIN) - the nodes whose input features changed
+        new_edge_index shape = (2, E') - edges that were added to the graph (S->T format same as the edge index)
+
+        Returns the updated logits (N, C), C being the number of classes.
+
+        """
+        device = self.graph.device
+        changed_node_ids = torch.zeros(0, dtype=torch.long, device=device)
+        new_edges_target_ids = torch.zeros(0, dtype=torch.long, device=device)
+
+        if node_ids is not None:
+            self.layer_inputs[0].index_copy_(0, node_ids, new_node_features.to(self.layer_inputs[0].dtype))
+            changed_node_ids = torch.unique(node_ids)
+
+        if new_edge_index is not None:
+            # New edges go to the end - the order in which the (full) forward pass would see them as well. The cached
+            # CSR/CSC views are spliced, not re-sorted (check out Graph.add_edges)
+            self.graph = self.graph.add_edges(new_edge_index)
+            new_edges_target_ids = torch.unique(new_edge_index[self.trg_nodes_dim])
+
+        for layer_id, layer in enumerate(self.gat.gat_net):
+            # Step 1: per-node quantities (projection and scores) only depend on the node's own input
+            if changed_node_ids.numel() > 0:
+                in_nodes_features = self.layer_inputs[layer_id].index_select(0, changed_node_ids)
+                nodes_features_proj, scores_source, scores_target = self.project_and_score(layer, in_nodes_features)
+                self.nodes_features_proj[layer_id].index_copy_(0, changed_node_ids, nodes_features_proj)
+                self.scores_source[layer_id].index_copy_(0, changed_node_ids, scores_source)
+                self.scores_target[layer_id].index_copy_(0, changed_node_ids, scores_target)
+
+            # Step 2: outputs change for the changed nodes (skip connection, target score), the nodes they point to and
+            # the targets of the new edges - and that's the set of changed inputs for the next layer (1 more hop)
+            out_neighbors_ids = self.graph.trg_index.index_select(0, self.graph.out_edge_ids(changed_node_ids))
+            affected_node_ids = torch.unique(torch.cat([changed_node_ids, out_neighbors_ids, new_edges_target_ids]))
+
+            if affected_node_ids.numel() > 0:
+                self.layer_inputs[layer_id + 1].index_copy_(0, affected_node_ids, self.attend_and_aggregate(layer_id, layer, affected_node_ids))
+
+            changed_node_ids = affected_node_ids
+
+        return self.get_logits()
+
+    #
+    # Helper functions
+    #
+
+    def project_and_score(self, layer, in_nodes_features):
+        # Same as step 1 and the first part of step 2 in GATLayerImp3.forward (dropout is a no-op in eval mode)
+        # shape = (M, FIN) -> (M, NH, FOUT) and scores shape = (M, NH), M being the number of nodes we recompute
+        nodes_features_proj = layer.linear_proj(in_nodes_features).view(-1, layer.num_of_heads, layer.num_out_features)
+        scores_source = (nodes_features_proj * layer.scoring_fn_source).sum(dim=-1)
+        scores_target = (nodes_features_proj * layer.scoring_fn_target).sum(dim=-1)
+
+        return nodes_features_proj, scores_source, scores_target
+
+    def attend_and_aggregate(self, layer_id, layer, target_node_ids):
+        """
+        Recomputes the outputs of the layer for the (sorted, unique) target nodes. Same as the rest of
+        GATLayerImp3.forward, but only for the edges pointing into the target nodes.
+
+        """
+        # Keep the global edge order so that every neighborhood is summed up in the same order as in the full pass
+        edge_ids = torch.sort(self.graph.in_edge_ids(target_node_ids))[0]
+        src_index = self.graph.src_index.index_select(0, edge_ids)
+        trg_index = self.graph.trg_index.index_select(0, edge_ids)
+        # Relabel target nodes into [0, M) so that everything below is O(M) and not O(N)
+        local_edge_index = torch.stack([src_index, torch.searchsorted(target_node_ids, trg_index)])
+        num_of_target_nodes = target_node_ids.shape[0]
+
+        scores_per_edge = layer.leakyReLU(self.scores_source[layer_id].index_select(0, src_index) + self.scores_target[layer_id].index_select(0, trg_index))
+        attentions_per_edge = layer.neighborhood_aware_softmax(scores_per_edge, local_edge_index[layer.trg_nodes_dim], num_of_target_nodes)
+
+        nodes_features_proj_lifted = self.nodes_features_proj[layer_id].index_select(0, src_index)
+        nodes_features_proj_lifted_weighted = nodes_features_proj_lifted * attentions_per_edge.to(nodes_features_proj_lifted.dtype)
+
+        in_nodes_features = self.layer_inputs[layer_id].index_select(0, target_node_ids)
+        out_nodes_features = layer.aggregate_neighbors(nodes_features_proj_lifted_weighted, local_edge_index, in_nodes_features, num_of_target_nodes)
+
+        return layer.skip_concat_bias(attentions_per_edge, in_nodes_features, out_nodes_features)
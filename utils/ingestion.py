@@ -0,0 +1,344 @@
+"""
+    Out-of-core (streaming) ingestion of big graphs from text files into the memory-mapped graph store (graph_store.py).
+
+    Input files (whitespace, tab or comma separated columns, lines starting with # are skipped):
+        * edge list - "src trg" per line
+        * node features - sparse "node_id feature_id value" triplets per line
+        * labels (optional) - "node_id label" or "node_id label split" per line, split being one of train/val/test
+
+    The full edge list (or feature list) is never held in RAM, memory is bounded by chunk_size (+ O(N) per-node arrays):
+        1. Files are read chunk by chunk (generators), every chunk is sorted by its packed 64-bit (row << 32 | col) key,
+           deduplicated and spilled to disk as a sorted run (that's the "external sort")
+        2. k-way merge of the runs, block by block: we take a block from every run and emit everything <= the smallest of
+           the blocks' last keys (no run can produce a smaller key anymore), those get sorted, deduplicated and streamed
+           into the store arrays
+
+    The merged output comes out sorted by (row, col) so it's directly the CSR topology (edge_index + edge_indptr) and the
+    CSR node features. Duplicate edges/features are dropped, the first occurrence wins (same as build_edge_index).
+
+"""
+
+import itertools
+import os
+import tempfile
+import time
+
+
+import numpy as np
+
+
+from utils.data_loading import get_run_starts_mask
+from utils.graph_store import invalidate_graph_store, create_graph_store_array, write_graph_store_manifest, array_names
+
+
+split_names = ['train', 'val', 'test']  # split column values in the labels file
+
+
+def ingest_graph(store_path, edge_list_path, features_path, labels_path=None, num_of_nodes=None, add_self_edges=True,
+                 symmetrize=False, normalize_features=True, chunk_size=2**22):
+    """
+    Builds a graph store (check out graph_store.py) from the text files, plus an extra edge_indptr array - shape = (N+1),
+    edges of source node i are edge_index[:, edge_indptr[i]:edge_indptr[i+1]].
+
+    chunk_size - number of lines (or array elements) processed at once, this is what bounds the memory usage
+    Returns ingestion stats (rows/sec, peak RSS).
+
+    """
+    ts = time.time()
+    invalidate_graph_store(store_path)
+
+    with tempfile.TemporaryDirectory(dir=store_path) as tmp_dir_path:
+        # Step 1: spill sorted runs (and find out how many nodes/features there are)
+        edge_runs, num_of_edge_rows, max_edge_node_id, _ = spill_sorted_runs(
+            (edge_list_chunk(chunk, add_self_edges, symmetrize) for chunk in read_chunks(edge_list_path, 2, chunk_size)),
+            tmp_dir_path, 'edges')
+        feature_runs, num_of_feature_rows, max_feature_node_id, max_feature_id = spill_sorted_runs(
+            ((chunk[:, 0].astype(np.int64), chunk[:, 1].astype(np.int64), chunk[:, 2].astype(np.float32)) for chunk in read_chunks(features_path, 3, chunk_size)),
+            tmp_dir_path, 'features')
+
+        if num_of_nodes is None:
+            num_of_nodes = int(max(max_edge_node_id, max_feature_node_id)) + 1
+        assert max(max_edge_node_id, max_feature_node_id) < num_of_nodes, f'Found node ids >= num_of_nodes ({num_of_nodes}).'
+        num_of_features = int(max_feature_id) + 1
+
+        if add_self_edges:  # every node gets exactly 1 self edge (the input ones were dropped)
+            edge_runs.append(write_self_edges_run(tmp_dir_path, num_of_nodes, chunk_size))
+
+        # Step 2: merge the runs straight into the store arrays
+        num_of_edges = write_edges(store_path, tmp_dir_path, edge_runs, num_of_nodes, chunk_size)
+        num_of_nonzeros = write_features(store_path, tmp_dir_path, feature_runs, num_of_nodes, num_of_features, normalize_features, chunk_size)
+
+    num_of_label_rows = write_labels(store_path, labels_path, num_of_nodes, chunk_size)
+
+    write_graph_store_manifest(store_path, array_names + ['edge_indptr'], num_of_nodes=num_of_nodes, num_of_features=num_of_features, num_of_edges=num_of_edges,
+                               features_normalized=normalize_features, self_edges=add_self_edges)
+
+    elapsed_time = time.time() - ts
+    num_of_rows = num_of_edge_rows + num_of_feature_rows + num_of_label_rows
+    stats = {
+        'num_of_nodes': num_of_nodes,
+        'num_of_edges': num_of_edges,
+        'num_of_nonzero_features': num_of_nonzeros,
+        'num_of_rows': num_of_rows,
+        'rows_per_second': num_of_rows / elapsed_time,
+        'peak_rss_bytes': get_peak_rss_in_bytes()
+    }
+    print(f'Ingested {num_of_rows} rows into {store_path} in {elapsed_time:.2f} [s] ({stats["rows_per_second"]:.0f} rows/s): '
+          f'N = {num_of_nodes}, E = {num_of_edges}, nnz = {num_of_nonzeros}.')
+
+    return stats
+
+
+def read_chunks(path, num_of_columns, chunk_size, replacements=()):
+    """
+    Yields (chunk_size, num_of_columns) float64 arrays (the last one may be smaller). Node/feature ids are exact in
+    float64 (up to 2^53). replacements - (old, new) string pairs applied before parsing (e.g. split names -> numbers).
+
+    """
+    with open(path, 'r') as file:
+        while True:
+            lines = list(itertools.islice(file, chunk_size))
+            if len(lines) == 0:
+                break
+
+            text = ''.join(line for line in lines if not line.startswith('#')).replace(',', ' ')
+            for old, new in replacements:
+                text = text.replace(old, new)
+
+            # Parsing happens in C - much faster than splitting the lines in Python
+            values = np.fromstring(text, sep=' ')
+            assert len(values) % num_of_columns == 0, f'Expected {num_of_columns} columns per line in {path}.'
+            yield values.reshape(-1, num_of_columns)
+
+
+def edge_list_chunk(chunk, add_self_edges, symmetrize):
+    source_nodes_ids, target_nodes_ids = chunk[:, 0].astype(np.int64), chunk[:, 1].astype(np.int64)
+
+    if symmetrize:
+        source_nodes_ids, target_nodes_ids = np.concatenate([source_nodes_ids, target_nodes_ids]), np.concatenate([target_nodes_ids, source_nodes_ids])
+
+    if add_self_edges:  # same as in build_edge_index, self edges get added (exactly once) at the merge stage
+        non_self_edges_mask = source_nodes_ids != target_nodes_ids
+        source_nodes_ids, target_nodes_ids = source_nodes_ids[non_self_edges_mask], target_nodes_ids[non_self_edges_mask]
+
+    return source_nodes_ids, target_nodes_ids, None
+
+
+def pack_keys(rows, cols):
+    assert rows.max(initial=0) < 2**31 and cols.max(initial=0) < 2**32, 'Ids must fit into the packed 64-bit keys.'
+    return (rows << 32) | cols
+
+
+def spill_sorted_runs(chunks, tmp_dir_path, name):
+    """
+    chunks yields (rows, cols, values or None). Returns (run paths, number of rows, max row id, max col id), every run is
+    a pair of (keys, values) .npy files, sorted by key and without duplicates.
+
+    """
+    runs, num_of_rows, max_row_id, max_col_id = [], 0, -1, -1
+
+    for chunk_id, (rows, cols, values) in enumerate(chunks):
+        num_of_rows += len(rows)
+        if len(rows) == 0:
+            continue
+        max_row_id, max_col_id = max(max_row_id, rows.max()), max(max_col_id, cols.max())
+
+        keys = pack_keys(rows, cols)
+        sort_permutation = np.argsort(keys, kind='stable')  # stable - the first occurrence of a duplicate stays first
+        keys = keys[sort_permutation]
+        unique_mask = get_run_starts_mask(keys)
+
+        keys_path = os.path.join(tmp_dir_path, f'{name}_run_{chunk_id}_keys.npy')
+        np.save(keys_path, keys[unique_mask])
+        values_path = None
+        if values is not None:
+            values_path = os.path.join(tmp_dir_path, f'{name}_run_{chunk_id}_values.npy')
+            np.save(values_path, values[sort_permutation][unique_mask])
+        runs.append((keys_path, values_path))
+
+    return runs, num_of_rows, max_row_id, max_col_id
+
+
+def write_self_edges_run(tmp_dir_path, num_of_nodes, chunk_size):
+    keys_path = os.path.join(tmp_dir_path, 'edges_run_self_keys.npy')
+    keys = np.lib.format.open_memmap(keys_path, mode='w+', dtype=np.int64, shape=(num_of_nodes,))
+    for start in range(0, num_of_nodes, chunk_size):
+        nodes_ids = np.arange(start, min(start + chunk_size, num_of_nodes), dtype=np.int64)
+        keys[start:start + len(nodes_ids)] = pack_keys(nodes_ids, nodes_ids)
+    keys.flush()
+
+    return keys_path, None
+
+
+def merge_sorted_runs(runs, chunk_size):
+    """
+    Yields (keys, values or None) blocks - globally sorted and without duplicates (first occurrence, in run order, wins).
+
+    """
+    keys_runs = [np.load(keys_path, mmap_mode='r') for keys_path, _ in runs]
+    values_runs = [np.load(values_path, mmap_mode='r') if values_path is not None else None for _, values_path in runs]
+    has_values = any(values_run is not None for values_run in values_runs)
+    block_size = max(chunk_size // max(len(runs), 1), 1)  # all of the blocks together are ~chunk_size big
+
+    positions = [0] * len(runs)
+    last_key = None
+    while True:
+        active_runs = [run_id for run_id in range(len(runs)) if positions[run_id] < len(keys_runs[run_id])]
+        if len(active_runs) == 0:
+            break
+
+        blocks = {run_id: keys_runs[run_id][positions[run_id]:positions[run_id] + block_size] for run_id in active_runs}
+        # Everything <= bound is safe to emit: the rest of every run is > its block's last key >= bound
+        bound = min(block[-1] for block in blocks.values())
+
+        keys_parts, values_parts = [], []
+        for run_id in active_runs:  # in run order - so that the stable sort below keeps the first occurrences first
+            num_of_safe_keys = np.searchsorted(blocks[run_id], bound, side='right')
+            keys_parts.append(blocks[run_id][:num_of_safe_keys])
+            if has_values:
+                values_parts.append(values_runs[run_id][positions[run_id]:positions[run_id] + num_of_safe_keys])
+            positions[run_id] += num_of_safe_keys
+
+        keys = np.concatenate(keys_parts)
+        sort_permutation = np.argsort(keys, kind='stable')
+        keys = keys[sort_permutation]
+        unique_mask = get_run_starts_mask(keys)
+        if last_key is not None:
+            unique_mask[0] = keys[0] != last_key  # a duplicate of the last key of the previous block
+        last_key = keys[-1]
+
+        yield keys[unique_mask], np.concatenate(values_parts)[sort_permutation][unique_mask] if has_values else None
+
+
+def merge_runs_to_raw_files(runs, raw_file_paths, num_of_rows_total, chunk_size, row_weights=False):
+    """
+    Merges the runs and appends (rows, cols, values) to the raw (headerless) files. Returns (number of merged entries,
+    per-row counts, per-row sums of the values if row_weights else None), counts/sums have shape = (num_of_rows_total).
+
+    """
+    num_of_entries = 0
+    counts = np.zeros(num_of_rows_total, dtype=np.int64)
+    sums = np.zeros(num_of_rows_total, dtype=np.float64) if row_weights else None
+
+    raw_files = [open(path, 'wb') for path in raw_file_paths]
+    try:
+        for keys, values in merge_sorted_runs(runs, chunk_size):
+            rows, cols = keys >> 32, keys & (2**32 - 1)
+            counts += np.bincount(rows, minlength=num_of_rows_total)
+            if row_weights:
+                sums += np.bincount(rows, weights=values, minlength=num_of_rows_total)
+
+            raw_files[0].write(rows.tobytes())
+            raw_files[1].write(cols.tobytes())
+            if values is not None:
+                raw_files[2].write(values.tobytes())
+            num_of_entries += len(keys)
+    finally:
+        for raw_file in raw_files:
+            raw_file.close()
+
+    return num_of_entries, counts, sums
+
+
+def write_edges(store_path, tmp_dir_path, edge_runs, num_of_nodes, chunk_size):
+    raw_file_paths = [os.path.join(tmp_dir_path, f'edges_{name}.bin') for name in ['src', 'trg']]
+    num_of_edges, out_degrees, _ = merge_runs_to_raw_files(edge_runs, raw_file_paths, num_of_nodes, chunk_size)
+
+    # shape = (2, E), sorted by (source, target)
+    edge_index = create_graph_store_array(store_path, 'edge_index', np.int64, (2, num_of_edges))
+    for dim, raw_file_path in enumerate(raw_file_paths):
+        copy_raw_file(raw_file_path, np.int64, num_of_edges, edge_index[dim], chunk_size)
+    edge_index.flush()
+
+    edge_indptr = create_graph_store_array(store_path, 'edge_indptr', np.int64, (num_of_nodes + 1,))
+    edge_indptr[0] = 0
+    np.cumsum(out_degrees, out=edge_indptr[1:])
+    edge_indptr.flush()
+
+    return num_of_edges
+
+
+def write_features(store_path, tmp_dir_path, feature_runs, num_of_nodes, num_of_features, normalize_features, chunk_size):
+    raw_file_paths = [os.path.join(tmp_dir_path, f'features_{name}.bin') for name in ['rows', 'cols', 'values']]
+    num_of_nonzeros, row_counts, row_sums = merge_runs_to_raw_files(feature_runs, raw_file_paths, num_of_nodes, chunk_size, row_weights=True)
+
+    # torch sparse CSR tensors need the same dtype for indptr and indices - stick to int32 while it's big enough
+    index_dtype = np.int32 if max(num_of_nonzeros, num_of_features) < 2**31 else np.int64
+
+    features_indptr = create_graph_store_array(store_path, 'features_indptr', index_dtype, (num_of_nodes + 1,))
+    features_indptr[0] = 0
+    features_indptr[1:] = np.cumsum(row_counts)
+    features_indptr.flush()
+
+    features_indices = create_graph_store_array(store_path, 'features_indices', index_dtype, (num_of_nonzeros,))
+    copy_raw_file(raw_file_paths[1], np.int64, num_of_nonzeros, features_indices, chunk_size)
+    features_indices.flush()
+
+    # Same normalization as normalize_features_sparse (feature vectors sum up to 1), rows are known only after the merge
+    features_data = create_graph_store_array(store_path, 'features_data', np.float32, (num_of_nonzeros,))
+    copy_raw_file(raw_file_paths[2], np.float32, num_of_nonzeros, features_data, chunk_size)
+    if normalize_features:
+        row_inv_sums = np.ones(num_of_nodes, dtype=np.float64)
+        np.divide(1., row_sums, out=row_inv_sums, where=row_sums != 0)
+        rows = np.memmap(raw_file_paths[0], dtype=np.int64, mode='r', shape=(num_of_nonzeros,))
+        for start in range(0, num_of_nonzeros, chunk_size):
+            end = min(start + chunk_size, num_of_nonzeros)
+            features_data[start:end] *= row_inv_sums[rows[start:end]].astype(np.float32)
+        del rows
+    features_data.flush()
+
+    return num_of_nonzeros
+
+
+def write_labels(store_path, labels_path, num_of_nodes, chunk_size):
+    # Nodes without a label get -1 and aren't part of any split
+    labels = create_graph_store_array(store_path, 'labels', np.int64, (num_of_nodes,))
+    labels[:] = -1
+    split_masks = [create_graph_store_array(store_path, f'{split_name}_mask', bool, (num_of_nodes,)) for split_name in split_names]
+    for split_mask in split_masks:
+        split_mask[:] = False
+
+    num_of_rows = 0
+    if labels_path is not None:
+        num_of_columns = count_columns(labels_path)
+        assert num_of_columns in (2, 3), f'Expected "node_id label [split]" lines in {labels_path}.'
+
+        split_replacements = [(split_name, str(split_id)) for split_id, split_name in enumerate(split_names)]
+        for chunk in read_chunks(labels_path, num_of_columns, chunk_size, split_replacements):
+            nodes_ids = chunk[:, 0].astype(np.int64)
+            assert nodes_ids.max(initial=0) < num_of_nodes, f'Found labels for node ids >= num_of_nodes ({num_of_nodes}).'
+            labels[nodes_ids] = chunk[:, 1].astype(np.int64)
+            if num_of_columns == 3:
+                for split_id, split_mask in enumerate(split_masks):
+                    split_mask[nodes_ids[chunk[:, 2] == split_id]] = True
+            num_of_rows += len(chunk)
+
+    for array in [labels] + split_masks:
+        array.flush()
+
+    return num_of_rows
+
+
+def count_columns(path):
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.startswith('#') and line.strip():
+                return len(line.replace(',', ' ').split())
+    return 0
+
+
+def copy_raw_file(raw_file_path, dtype, num_of_elements, out_array, chunk_size):
+    raw_array = np.memmap(raw_file_path, dtype=dtype, mode='r', shape=(num_of_elements,)) if num_of_elements > 0 else np.zeros(0, dtype=dtype)
+    for start in range(0, num_of_elements, chunk_size):
+        end = min(start + chunk_size, num_of_elements)
+        out_array[start:end] = raw_array[start:end]
+    del raw_array
+
+
+def get_peak_rss_in_bytes():
+    try:
+        import resource  # Unix only
+    except ImportError:
+        return None
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux reports it in KBs
@@ -0,0 +1,94 @@
+"""
+    Sync-free training metrics - running values stay on the device and the host reads them only every flush_freq epochs.
+
+    Every .item() call (and every Python comparison against a tensor) makes the host wait until the device has finished
+    all of the queued work. Doing that a couple of times per epoch (loss/accuracy logging, early stopping) means the
+    host can never queue up the next epoch while the device is still busy with the current one.
+
+    So instead:
+        * metrics are recorded as (detached) device tensors and read in a single transfer once per flush
+        * the early stopping state (best val acc/loss, patience counter) lives on the device and is updated with tensor
+          ops, the host learns that the patience has run out at the next flush
+
+    Note: with flush_freq > 1 training can run up to flush_freq - 1 epochs past the epoch where the patience ran out
+    (with flush_freq = 1 it's exactly the old per-epoch behavior).
+
+    With num_of_replicas (K GATs trained at once, check out train_gat_replicas in training_script.py) every metric and
+    the early stopping state is a (K) tensor - every replica runs out of patience on its own, should_stop only once all
+    of them have.
+
+"""
+
+import time
+
+
+import torch
+
+
+class DeviceMetrics:
+    def __init__(self, patience_period, flush_freq, device, time_start, num_of_replicas=None):
+        self.patience_period = patience_period
+        self.flush_freq = flush_freq
+
+        # Early stopping state - best val acc/loss so far and the number of epochs since the last improvement
+        shape = () if num_of_replicas is None else (num_of_replicas,)
+        self.best_val_acc = torch.zeros(shape, dtype=torch.float64, device=device)
+        self.best_val_loss = torch.zeros(shape, dtype=torch.float64, device=device)
+        self.patience_cnt = torch.zeros(shape, dtype=torch.long, device=device)
+        self.out_of_patience = torch.zeros(shape, dtype=torch.bool, device=device)
+
+        self.pending_records = []  # (epoch, time elapsed, {metric name: 0-dim (or (K)) device tensor})
+        self.last_flush_epoch = -1
+        self.should_stop = False  # host copy of out_of_patience, refreshed on every flush
+        self.time_start = time_start
+
+    def record(self, epoch, **metrics):
+        self.pending_records.append((epoch, time.time() - self.time_start, {name: value.detach() for name, value in metrics.items()}))
+
+    def update_patience(self, val_acc, val_loss, num_of_epochs=1):
+        """
+        If either validation acc keeps going up or the val loss keeps going down the patience counter is reset,
+        otherwise it grows by num_of_epochs (the number of epochs since the last update).
+
+        """
+        improved = (val_acc > self.best_val_acc) | (val_loss < self.best_val_loss)
+        # If there was no improvement max/min leave the best values as they are - no need to branch on the host
+        self.best_val_acc = torch.maximum(self.best_val_acc, val_acc.to(self.best_val_acc.dtype))
+        self.best_val_loss = torch.minimum(self.best_val_loss, val_loss.to(self.best_val_loss.dtype))
+        self.patience_cnt = torch.where(improved, torch.zeros_like(self.patience_cnt), self.patience_cnt + num_of_epochs)
+        self.out_of_patience |= self.patience_cnt >= self.patience_period
+
+    def state_dict(self):
+        # Early stopping state, for checkpointing (check out utils/checkpointing.py)
+        return {'best_val_acc': self.best_val_acc, 'best_val_loss': self.best_val_loss, 'patience_cnt': self.patience_cnt, 'out_of_patience': self.out_of_patience}
+
+    def load_state_dict(self, state_dict):
+        for name, value in state_dict.items():
+            getattr(self, name).copy_(value)
+
+    def is_flush_due(self, epoch):
+        return epoch - self.last_flush_epoch >= self.flush_freq
+
+    def flush(self, epoch):
+        """
+        Moves all of the pending metrics (and the early stopping flags) to the host with a single sync.
+        Returns [(epoch, time elapsed, {metric name: float (list of floats for (K) metrics)}), ...] in the order they
+        were recorded.
+
+        """
+        values = [value.to(torch.float64).reshape(-1) for _, _, metrics in self.pending_records for value in metrics.values()]
+        values = torch.cat(values + [self.out_of_patience.to(torch.float64).reshape(-1)]).tolist()
+
+        flushed_records = []
+        for record_epoch, time_elapsed, metrics in self.pending_records:
+            flushed_metrics = {}
+            for name, value in metrics.items():
+                flushed_metrics[name] = values[0] if value.dim() == 0 else values[:value.numel()]
+                values = values[value.numel():]
+            flushed_records.append((record_epoch, time_elapsed, flushed_metrics))
+
+        self.should_stop = all(values)
+        self.pending_records = []
+        self.last_flush_epoch = epoch
+
+        return flushed_records
@@ -0,0 +1,130 @@
+"""
+    Dynamic int8 quantization of trained GAT binaries for (CPU) inference.
+
+    With high-dimensional input features (1433 on Cora) the FLOPs are dominated by the linear projections (linear_proj
+    and skip_proj). Dynamic quantization stores their weights in int8 and quantizes the activations on the fly (per
+    batch) so no calibration data is needed - we go straight from a binary saved by utils.get_training_state to an int8
+    artifact.
+
+    Optionally the scoring vectors ("a" in the paper) get stored in int8 as well. They're tiny (NH * FOUT per layer) so
+    that only makes the artifact smaller - at inference time they're dequantized back into fp32.
+
+"""
+
+import os
+
+
+import torch
+import torch.nn as nn
+
+
+from models.definitions.GAT import GAT
+from utils.constants import BINARIES_PATH, LayerType
+from utils.utils import name_to_layer_type
+
+
+scoring_fn_names = ['scoring_fn_source', 'scoring_fn_target']
+
+
+def build_gat(model_state):
+    # Eval mode GAT on the CPU (that's the only device dynamic quantization supports)
+    return GAT(
+        num_of_layers=model_state['num_of_layers'],
+        num_heads_per_layer=model_state['num_heads_per_layer'],
+        num_features_per_layer=model_state['num_features_per_layer'],
+        add_skip_connection=model_state['add_skip_connection'],
+        bias=model_state['bias'],
+        dropout=model_state['dropout'],
+        layer_type=name_to_layer_type(model_state['layer_type'])
+    ).eval()
+
+
+def load_gat(model_state):
+    gat = build_gat(model_state)
+    gat.load_state_dict(model_state['state_dict'], strict=True)
+    return gat
+
+
+def quantize_scoring_fn(scoring_fn):
+    # Symmetric per-tensor quantization, returns (int8 values, scale)
+    scale = max(scoring_fn.abs().max().item() / 127, 1e-12)
+    return torch.clamp(torch.round(scoring_fn / scale), -127, 127).to(torch.int8), scale
+
+
+def quantize_gat(gat, quantize_scoring_fns=False):
+    """
+    Returns (int8 GAT, quantized scoring vectors) where the latter maps parameter names to (int8 values, scale) and is
+    empty unless quantize_scoring_fns is set. The original (CPU) gat's weights are left untouched.
+
+    """
+    assert all(hasattr(layer, 'linear_proj') for layer in gat.gat_net), \
+        f'{LayerType.IMP1.name} uses raw projection params, only nn.Linear projections can be quantized.'
+
+    quantized_gat = torch.ao.quantization.quantize_dynamic(gat.eval(), {nn.Linear}, dtype=torch.qint8, inplace=False)
+
+    quantized_scoring_fns = {}
+    if quantize_scoring_fns:
+        for name, param in quantized_gat.named_parameters():
+            if name.split('.')[-1] in scoring_fn_names:
+                quantized_scoring_fns[name] = quantize_scoring_fn(param.data)
+        load_quantized_scoring_fns(quantized_gat, quantized_scoring_fns)
+
+    return quantized_gat, quantized_scoring_fns
+
+
+def load_quantized_scoring_fns(quantized_gat, quantized_scoring_fns):
+    # The model runs with the dequantized values i.e. exactly what the int8 artifact can represent
+    params = dict(quantized_gat.named_parameters())
+    for name, (values, scale) in quantized_scoring_fns.items():
+        params[name].data.copy_(values.float() * scale)
+
+
+def get_quantized_state(model_state, quantized_gat, quantized_scoring_fns):
+    # Same metadata as the fp32 binary (check out utils.get_training_state) plus the quantized weights
+    quantized_state = {key: value for key, value in model_state.items() if key != 'state_dict'}
+    state_dict = quantized_gat.state_dict()
+    for name in quantized_scoring_fns:
+        del state_dict[name]  # stored in int8 below, no need to keep the fp32 copy around
+
+    quantized_state['quantized'] = True
+    quantized_state['state_dict'] = state_dict
+    quantized_state['quantized_scoring_fns'] = quantized_scoring_fns
+
+    return quantized_state
+
+
+def get_quantized_binary_name(model_name):
+    # e.g. gat_000000.pth -> gat_000000_int8.pth (doesn't clash with utils.get_available_binary_name)
+    return f'{os.path.splitext(model_name)[0]}_int8.pth'
+
+
+def quantize_binary(model_name, quantize_scoring_fns=False):
+    """
+    Loads a GAT binary (from the binaries directory), quantizes it and saves the int8 artifact next to it.
+    Returns (fp32 GAT, int8 GAT, path of the int8 artifact).
+
+    """
+    model_state = torch.load(os.path.join(BINARIES_PATH, model_name), map_location='cpu')
+    gat = load_gat(model_state)
+    quantized_gat, quantized_scoring_fns = quantize_gat(gat, quantize_scoring_fns)
+
+    quantized_model_path = os.path.join(BINARIES_PATH, get_quantized_binary_name(model_name))
+    torch.save(get_quantized_state(model_state, quantized_gat, quantized_scoring_fns), quantized_model_path)
+
+    return gat, quantized_gat, quantized_model_path
+
+
+def load_quantized_gat(quantized_model_path):
+    quantized_state = torch.load(quantized_model_path, map_location='cpu')
+    assert quantized_state.get('quantized', False), f'{quantized_model_path} is not a quantized GAT binary.'
+
+    # Rebuild the int8 module structure first so that the packed int8 weights have somewhere to go
+    quantized_gat = torch.ao.quantization.quantize_dynamic(build_gat(quantized_state), {nn.Linear}, dtype=torch.qint8, inplace=False)
+
+    # The only keys allowed to be missing are the scoring vectors stored in int8
+    quantized_scoring_fns = quantized_state['quantized_scoring_fns']
+    missing_keys, unexpected_keys = quantized_gat.load_state_dict(quantized_state['state_dict'], strict=False)
+    assert set(missing_keys) == set(quantized_scoring_fns) and not unexpected_keys, f'Invalid quantized state dict {missing_keys}, {unexpected_keys}.'
+    load_quantized_scoring_fns(quantized_gat, quantized_scoring_fns)
+
+    return quantized_gat
@@ -0,0 +1,93 @@
+"""
+    Locality-improving node reordering for GATLayerImp3's gather (index_select) and scatter (scatter_add_) ops.
+
+    Node ids usually come in whatever order the dataset was collected in, so neighbors end up far apart in memory and
+    every gather/scatter over a big graph is a cache miss. Relabeling the nodes so that neighbors get nearby ids fixes
+    that (the model doesn't care - GAT is permutation equivariant):
+        * RCM - Reverse Cuthill-McKee, minimizes the bandwidth of the adjacency matrix
+        * DEGREE - high degree (hot) nodes first, their rows get reused all of the time
+        * COMMUNITY - label propagation clusters from utils/partitioning.py, nodes of a cluster get contiguous ids
+
+    On top of that, the edges get sorted by (target, source) so that the scatter writes are sequential as well.
+
+"""
+
+import numpy as np
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+import torch
+
+
+from utils.constants import NodeOrdering
+from utils.partitioning import get_symmetric_adjacency_matrix, partition_graph
+
+
+class NodeReordering:
+    """
+    permutation[new id] = original id, inverse_permutation[original id] = new id
+
+    """
+
+    src_nodes_dim = 0  # position of source nodes in edge index
+    trg_nodes_dim = 1  # position of target nodes in edge index
+
+    nodes_per_community = 1024  # roughly the number of nodes whose features fit into the L2 cache
+
+    def __init__(self, edge_index, num_of_nodes, ordering):
+        assert isinstance(ordering, NodeOrdering), f'Expected {NodeOrdering} got {type(ordering)}.'
+        device = edge_index.device
+        edge_index = edge_index.cpu().numpy()
+
+        if ordering == NodeOrdering.NONE:
+            permutation = np.arange(num_of_nodes)
+        elif ordering == NodeOrdering.RCM:
+            permutation = reverse_cuthill_mckee(get_symmetric_adjacency_matrix(edge_index, num_of_nodes), symmetric_mode=True)
+        elif ordering == NodeOrdering.DEGREE:
+            in_degrees = np.bincount(edge_index[self.trg_nodes_dim], minlength=num_of_nodes)
+            permutation = np.argsort(-in_degrees, kind='stable')
+        elif ordering == NodeOrdering.COMMUNITY:
+            num_of_communities = max(1, num_of_nodes // self.nodes_per_community)
+            permutation = np.argsort(partition_graph(edge_index, num_of_nodes, num_of_communities), kind='stable')
+        else:
+            raise Exception(f'Node ordering {ordering} not yet supported.')
+
+        self.permutation = torch.as_tensor(permutation.astype(np.int64), device=device)
+        self.inverse_permutation = torch.empty_like(self.permutation)
+        self.inverse_permutation[self.permutation] = torch.arange(num_of_nodes, device=device)
+
+    def reorder_graph(self, node_features, node_labels, edge_index, *node_indices_splits):
+        """
+        Returns (node_features, node_labels, edge_index, *node_indices_splits) in the new node ids. The order of the nodes
+        inside of every split is kept (only their ids change).
+
+        """
+        node_features = permute_rows(node_features, self.permutation)
+        node_labels = node_labels.index_select(0, self.permutation)
+
+        # Relabel and sort the edges by (target, source) - scatter_add_ then writes to memory sequentially
+        index_dtype = edge_index.dtype  # int64/int32, the sort keys below are always 64 bit
+        edge_index = self.inverse_permutation[edge_index]
+        num_of_nodes = self.permutation.shape[0]
+        edge_index = edge_index.index_select(1, torch.argsort(edge_index[self.trg_nodes_dim] * num_of_nodes + edge_index[self.src_nodes_dim])).to(index_dtype)
+
+        return (node_features, node_labels, edge_index) + tuple(self.inverse_permutation[node_indices] for node_indices in node_indices_splits)
+
+    def restore_node_order(self, nodes_tensor):
+        # shape = (N, ...) in the new node ids -> (N, ...) in the original node ids
+        return nodes_tensor.index_select(0, self.inverse_permutation)
+
+
+def permute_rows(node_features, permutation):
+    if node_features.layout != torch.sparse_csr:
+        return node_features.index_select(0, permutation)
+
+    # Sparse CSR has no index_select - gather the (contiguous) column/value ranges of the permuted rows ourselves
+    crow_indices = node_features.crow_indices().long()
+    row_lengths = (crow_indices[1:] - crow_indices[:-1]).index_select(0, permutation)
+    new_crow_indices = torch.zeros_like(crow_indices)
+    new_crow_indices[1:] = torch.cumsum(row_lengths, dim=0)
+
+    # positions[k] = start of the original row + offset of k inside of its (new) row
+    positions = torch.repeat_interleave(crow_indices.index_select(0, permutation) - new_crow_indices[:-1], row_lengths) + torch.arange(int(new_crow_indices[-1]), device=crow_indices.device)
+    index_dtype = node_features.crow_indices().dtype
+    return torch.sparse_csr_tensor(new_crow_indices.to(index_dtype), node_features.col_indices().index_select(0, positions),
+                                   node_features.values().index_select(0, positions), size=node_features.shape)
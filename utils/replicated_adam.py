@@ -0,0 +1,61 @@
+"""
+    Adam over the stacked weights of K replicas (check out ReplicatedGATLayerImp3 in GAT.py), where a replica can be
+    frozen on its own.
+
+    Adam is element-wise so a single optimizer over the stacked weights is the same thing as K optimizers - as long as
+    every replica takes every step. Once a replica runs out of patience it has to keep its weights as they are, but the
+    early stopping state lives on the device (check out utils/metrics.py) and the host only learns about it on a flush.
+
+    So instead of branching on the host, step takes the (K) is_training mask and masks the update on the device: the
+    training replicas take exactly the step torch.optim.Adam would take (same ops in the same order, bit-identical on
+    the CPU), frozen ones get a zero update.
+
+    Note: the moments of a frozen replica keep moving, they're never used again (running out of patience is final).
+
+"""
+
+import torch
+from torch.optim import Adam
+
+
+class ReplicatedAdam(Adam):
+    def __init__(self, params, lr, weight_decay=0.):
+        super().__init__(params, lr=lr, weight_decay=weight_decay)
+
+    @torch.no_grad()
+    def step(self, is_training):
+        """
+        is_training is a (K) bool device tensor, the replica dim is the first dim of every parameter.
+
+        """
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for param in group['params']:
+                if param.grad is None:
+                    continue
+
+                state = self.state[param]
+                if len(state) == 0:  # same state as torch.optim.Adam so that state_dict stays compatible
+                    state['step'] = torch.tensor(0.)
+                    state['exp_avg'] = torch.zeros_like(param, memory_format=torch.preserve_format)
+                    state['exp_avg_sq'] = torch.zeros_like(param, memory_format=torch.preserve_format)
+                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+
+                state['step'] += 1
+                step = state['step'].item()
+
+                grad = param.grad
+                if group['weight_decay'] != 0:
+                    grad = grad.add(param, alpha=group['weight_decay'])
+
+                exp_avg.lerp_(grad, 1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+                bias_correction1 = 1 - beta1 ** step
+                bias_correction2 = 1 - beta2 ** step
+                step_size = group['lr'] / bias_correction1
+                denom = (exp_avg_sq.sqrt() / bias_correction2 ** 0.5).add_(group['eps'])
+
+                # Frozen replicas add (-)0 to their weights, i.e. they stay exactly as they were
+                training_mask = is_training.view(-1, *[1] * (param.dim() - 1))
+                param.addcdiv_(exp_avg * training_mask, denom, value=-step_size)
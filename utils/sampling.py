@@ -0,0 +1,97 @@
+"""
+    Neighbor sampling (GraphSAGE style) for mini-batch GAT training.
+
+    Full-batch training runs the whole graph through GAT on every step. For Cora that's fine, for graphs with millions
+    of nodes it's not - especially since only a handful of nodes (the train split) carry labels.
+
+    Instead, for every batch of seed (train) nodes, we sample a fixed number of in-neighbors (fanout) per node, hop by
+    hop, as many hops as there are GAT layers. The union of the sampled edges is relabeled into a compact edge index
+    that GATLayerImp3 can consume as is. The cost of a step is bounded by batch_size * prod(fanouts) and not the graph
+    size.
+
+"""
+
+import torch
+
+
+class NeighborSampler:
+    src_nodes_dim = 0  # position of source nodes in edge index
+    trg_nodes_dim = 1  # position of target nodes in edge index
+
+    def __init__(self, edge_index, num_of_nodes, fanouts):
+        """
+        fanouts[i] is the max number of neighbors sampled for the nodes that are i hops away from the seed nodes,
+        -1 stands for "take all of the neighbors". len(fanouts) should equal the number of GAT layers.
+
+        """
+        self.num_of_nodes = num_of_nodes
+        self.fanouts = fanouts
+
+        # Self edges are handled separately (every sampled node always gets one) so that sampling never drops them
+        src_nodes_ids, trg_nodes_ids = edge_index[self.src_nodes_dim], edge_index[self.trg_nodes_dim]
+        non_self_edges_mask = src_nodes_ids != trg_nodes_ids
+        src_nodes_ids, trg_nodes_ids = src_nodes_ids[non_self_edges_mask], trg_nodes_ids[non_self_edges_mask]
+
+        # CSR over target nodes: in-neighbors of node i are neighbors[rowptr[i]:rowptr[i+1]]
+        sort_permutation = torch.sort(trg_nodes_ids, stable=True)[1]
+        self.neighbors = src_nodes_ids.index_select(0, sort_permutation)
+        self.rowptr = torch.zeros(num_of_nodes + 1, dtype=torch.long, device=edge_index.device)
+        self.rowptr[1:] = torch.cumsum(torch.bincount(trg_nodes_ids, minlength=num_of_nodes), dim=0)
+
+    def sample(self, seed_nodes_ids):
+        """
+        Returns:
+            * node_ids shape = (M) - ids (in the original graph) of all of the sampled nodes, M - subgraph size
+            * edge_index shape = (2, E') - the sampled subgraph in local ids i.e. in [0, M), with self edges
+            * seed_nodes_local_ids shape = (B) - where the seed nodes ended up in the subgraph, B - batch size
+
+        """
+        all_src_nodes_ids, all_trg_nodes_ids = [], []
+        sampled_nodes_ids = seed_nodes_ids  # nodes whose neighborhoods we've already sampled
+        frontier_nodes_ids = seed_nodes_ids
+
+        for fanout in self.fanouts:
+            src_nodes_ids, trg_nodes_ids = self.sample_in_neighbors(frontier_nodes_ids, fanout)
+            all_src_nodes_ids.append(src_nodes_ids)
+            all_trg_nodes_ids.append(trg_nodes_ids)
+
+            # Next hop - only the nodes we haven't expanded so far (every node gets a single neighborhood)
+            new_nodes_ids = torch.unique(src_nodes_ids)
+            frontier_nodes_ids = new_nodes_ids[~torch.isin(new_nodes_ids, sampled_nodes_ids)]
+            sampled_nodes_ids = torch.cat([sampled_nodes_ids, frontier_nodes_ids])
+
+        # Relabel - map the global node ids into [0, M)
+        node_ids, local_ids = torch.unique(torch.cat([sampled_nodes_ids] + all_src_nodes_ids + all_trg_nodes_ids), return_inverse=True)
+        num_of_sampled_nodes, num_of_sampled_edges = sampled_nodes_ids.shape[0], sum(ids.shape[0] for ids in all_src_nodes_ids)
+        seed_nodes_local_ids = local_ids[:seed_nodes_ids.shape[0]]
+
+        src_local_ids = local_ids[num_of_sampled_nodes:num_of_sampled_nodes + num_of_sampled_edges]
+        trg_local_ids = local_ids[num_of_sampled_nodes + num_of_sampled_edges:]
+        self_edges = torch.arange(node_ids.shape[0], device=node_ids.device)
+        # Same index dtype (int64/int32) as the graph we sample from
+        edge_index = torch.stack([torch.cat([src_local_ids, self_edges]), torch.cat([trg_local_ids, self_edges])]).to(self.neighbors.dtype)
+
+        return node_ids, edge_index, seed_nodes_local_ids
+
+    def sample_in_neighbors(self, nodes_ids, fanout):
+        # shape = (B), number of in-neighbors and how many of them we'll sample for every node
+        row_starts = self.rowptr.index_select(0, nodes_ids)
+        degrees = self.rowptr.index_select(0, nodes_ids + 1) - row_starts
+        num_of_samples = degrees if fanout < 0 else torch.clamp(degrees, max=fanout)
+
+        # Every sample needs to know which node it belongs to and its rank among that node's samples
+        owners = torch.repeat_interleave(torch.arange(nodes_ids.shape[0], device=nodes_ids.device), num_of_samples)
+        ranks = torch.arange(owners.shape[0], device=nodes_ids.device) - torch.repeat_interleave(torch.cumsum(num_of_samples, dim=0) - num_of_samples, num_of_samples)
+        owner_degrees = degrees.index_select(0, owners)
+
+        # Small neighborhoods are taken as a whole, big ones are sampled (with replacement so that the cost is O(fanout)
+        # and not O(degree), duplicates are removed below - so a node may end up with slightly fewer than fanout edges)
+        random_offsets = (torch.rand(owners.shape[0], device=nodes_ids.device) * owner_degrees).long()
+        offsets = torch.where(owner_degrees <= num_of_samples.index_select(0, owners), ranks, random_offsets)
+
+        src_nodes_ids = self.neighbors.index_select(0, row_starts.index_select(0, owners) + offsets)
+        trg_nodes_ids = nodes_ids.index_select(0, owners)
+
+        # Remove duplicate edges (packed into a single 64 bit key, the neighbors may be stored as int32)
+        edge_keys = torch.unique(trg_nodes_ids.long() * self.num_of_nodes + src_nodes_ids.long())
+        return edge_keys % self.num_of_nodes, edge_keys // self.num_of_nodes
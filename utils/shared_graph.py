@@ -0,0 +1,68 @@
+"""
+    Shared-memory graph data for multi-process setups (distributed workers, sweep workers, etc.).
+
+    The graph store (utils/graph_store.py) already shares the raw arrays through the OS page cache, but every process
+    that calls load_graph_data still builds its own tensors from them: densifies the features (the biggest tensor by
+    far), decodes the edge index, builds the connectivity mask, etc. With W workers that's W times the work and W
+    private copies of the same data.
+
+    Instead, the parent process loads the graph once and moves the tensors into shared memory (SharedGraphData), the
+    handle is passed to the workers (e.g. through mp.spawn's args) and torch.multiprocessing sends only the
+    shared memory handles over - no data gets copied or deserialized. The workers call attach() and get exactly what
+    load_graph_data would've returned.
+
+    Note: the parent has to keep the handle alive until the workers have attached. The shared tensors should be treated
+    as read-only (a write in one process is seen by all of them).
+
+"""
+
+import torch
+
+
+from utils.graph import Graph
+
+
+class SharedGraphData:
+    def __init__(self, node_features, node_labels, topology, train_indices, val_indices, test_indices):
+        """
+        Takes load_graph_data's outputs (CPU tensors), moves them into shared memory in-place.
+
+        """
+        tensors = {'node_labels': node_labels, 'train_indices': train_indices, 'val_indices': val_indices, 'test_indices': test_indices}
+
+        # Sparse CSR tensors can't be shared directly - share their components and reassemble them on attach
+        self.sparse_features_shape = tuple(node_features.shape) if node_features.layout == torch.sparse_csr else None
+        if self.sparse_features_shape is not None:
+            tensors.update(features_crow_indices=node_features.crow_indices(), features_col_indices=node_features.col_indices(), features_values=node_features.values())
+        else:
+            tensors['node_features'] = node_features
+
+        # Only the edge index of a Graph is shared, its cached views are cheap to recompute (and are per-process anyway)
+        self.num_of_nodes = topology.num_of_nodes if isinstance(topology, Graph) else None
+        tensors['topology'] = topology.edge_index if isinstance(topology, Graph) else topology
+
+        for name, tensor in tensors.items():
+            assert tensor.device.type == 'cpu', f'Only CPU tensors can be shared, {name} is on {tensor.device}.'
+            tensor.share_memory_()
+        self.tensors = tensors
+
+    @property
+    def size_in_bytes(self):
+        return sum(tensor.numel() * tensor.element_size() for tensor in self.tensors.values())
+
+    def attach(self):
+        """
+        Returns (node_features, node_labels, topology, train_indices, val_indices, test_indices) - same as
+        load_graph_data, backed by the shared memory.
+
+        """
+        tensors = self.tensors
+        if self.sparse_features_shape is not None:
+            node_features = torch.sparse_csr_tensor(tensors['features_crow_indices'], tensors['features_col_indices'], tensors['features_values'], size=self.sparse_features_shape)
+        else:
+            node_features = tensors['node_features']
+
+        topology = Graph(tensors['topology'], self.num_of_nodes) if self.num_of_nodes is not None else tensors['topology']
+
+        return node_features, tensors['node_labels'], topology, tensors['train_indices'], tensors['val_indices'], tensors['test_indices']
+
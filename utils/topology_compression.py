@@ -0,0 +1,131 @@
+"""
+    Compressed on-disk topology - delta-encoded sorted neighbor lists.
+
+    A raw int64 edge index costs 16 bytes per edge. Grouped by the target node (CSC, i.e. every node's neighborhood) and
+    with the neighbors (source nodes) sorted:
+        * the target ids are implicit - colptr (shape = (N+1)) tells us where every neighborhood starts
+        * consecutive source ids are close to each other (especially after a locality-improving node ordering, check out
+          utils/reordering.py) so we store their differences (deltas), the first neighbor of a neighborhood is stored as is
+        * deltas are written as varints (LEB128) - 7 bits per byte, the high bit says "more bytes follow", so small
+          deltas take a single byte
+
+    Neighborhoods are grouped into blocks of nodes_per_block nodes, block_ptr holds the byte offset where every block
+    starts - blocks can be decoded independently, each one with a couple of vectorized NumPy ops (no Python loop over
+    the edges), and peak memory while decoding is the output + a single block.
+
+    The decoded edge index comes out sorted by (target, source).
+
+"""
+
+import numpy as np
+
+
+max_varint_bytes = 10  # ceil(64 / 7)
+
+
+def compress_topology(edge_index, num_of_nodes, nodes_per_block=2**16):
+    """
+    edge_index - NumPy array, shape = (2, E)
+
+    Returns the dict of arrays that make up the compressed topology (check out the module docstring).
+
+    """
+    src_nodes_ids, trg_nodes_ids = np.asarray(edge_index[0], dtype=np.int64), np.asarray(edge_index[1], dtype=np.int64)
+    sort_permutation = np.lexsort((src_nodes_ids, trg_nodes_ids))
+    src_nodes_ids, trg_nodes_ids = src_nodes_ids[sort_permutation], trg_nodes_ids[sort_permutation]
+
+    colptr = np.zeros(num_of_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(trg_nodes_ids, minlength=num_of_nodes), out=colptr[1:])
+
+    # First neighbor of every neighborhood stays absolute, the rest become deltas (>= 0 as the neighbors are sorted)
+    deltas = src_nodes_ids.copy()
+    neighborhood_starts_mask = np.ones(len(deltas), dtype=bool)
+    neighborhood_starts_mask[1:] = trg_nodes_ids[1:] != trg_nodes_ids[:-1]
+    deltas[~neighborhood_starts_mask] -= src_nodes_ids[:-1][~neighborhood_starts_mask[1:]]
+
+    topology_bytes, byte_offsets = encode_varints(deltas)
+
+    # Byte offset of the first edge of every block (and the total number of bytes at the end)
+    block_first_nodes = np.append(np.arange(0, num_of_nodes, nodes_per_block), num_of_nodes)
+    block_ptr = byte_offsets[colptr[block_first_nodes]]
+
+    return {'topology_colptr': colptr, 'topology_block_ptr': block_ptr, 'topology_bytes': topology_bytes}
+
+
+def decompress_topology(topology_arrays, nodes_per_block, dtype=np.int64):
+    """
+    topology_arrays - arrays returned by compress_topology (can be memory-mapped, only one block is read at a time)
+
+    Returns the edge index, shape = (2, E), sorted by (target, source).
+
+    """
+    colptr = np.asarray(topology_arrays['topology_colptr'])
+    edge_index = np.empty((2, colptr[-1]), dtype=dtype)
+
+    num_of_nodes = len(colptr) - 1
+    for block_id in range(len(topology_arrays['topology_block_ptr']) - 1):
+        # Edges of the block's neighborhoods are contiguous in the (target, source) order
+        first_edge_id, last_edge_id = colptr[block_id * nodes_per_block], colptr[min((block_id + 1) * nodes_per_block, num_of_nodes)]
+        edge_index[0, first_edge_id:last_edge_id], edge_index[1, first_edge_id:last_edge_id] = decompress_topology_block(topology_arrays, nodes_per_block, block_id)
+
+    return edge_index
+
+
+def decompress_topology_block(topology_arrays, nodes_per_block, block_id):
+    """
+    Returns (source node ids, target node ids) of the edges pointing into the nodes of the block.
+
+    """
+    colptr, block_ptr = topology_arrays['topology_colptr'], topology_arrays['topology_block_ptr']
+    num_of_nodes = len(colptr) - 1
+    first_node, last_node = block_id * nodes_per_block, min((block_id + 1) * nodes_per_block, num_of_nodes)
+
+    deltas = decode_varints(np.asarray(topology_arrays['topology_bytes'][block_ptr[block_id]:block_ptr[block_id + 1]]))
+    block_colptr = np.asarray(colptr[first_node:last_node + 1]) - colptr[first_node]
+    degrees = np.diff(block_colptr)
+
+    # Undo the deltas - running sum over the block, minus the running sum up to the start of every neighborhood
+    running_sums = np.cumsum(deltas)
+    non_empty_starts = block_colptr[:-1][degrees > 0]
+    src_nodes_ids = running_sums - np.repeat(running_sums[non_empty_starts] - deltas[non_empty_starts], degrees[degrees > 0])
+    trg_nodes_ids = np.repeat(np.arange(first_node, last_node), degrees)
+
+    return src_nodes_ids, trg_nodes_ids
+
+
+def encode_varints(values):
+    """
+    values - non-negative int64 NumPy array
+
+    Returns the LEB128 encoded bytes (uint8) and the byte offset of every value, shape = (len(values) + 1).
+
+    """
+    values = values.astype(np.uint64)
+    num_of_bytes = np.ones(len(values), dtype=np.int64)
+    for byte_id in range(1, max_varint_bytes):
+        num_of_bytes += values >= (np.uint64(1) << np.uint64(7 * byte_id))
+
+    byte_offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(num_of_bytes, out=byte_offsets[1:])
+
+    encoded_bytes = np.empty(byte_offsets[-1], dtype=np.uint8)
+    for byte_id in range(int(num_of_bytes.max(initial=0))):
+        has_byte = num_of_bytes > byte_id
+        low_bits = (values[has_byte] >> np.uint64(7 * byte_id)) & np.uint64(0x7f)
+        continuation_bit = np.where(num_of_bytes[has_byte] > byte_id + 1, 0x80, 0).astype(np.uint64)
+        encoded_bytes[byte_offsets[:-1][has_byte] + byte_id] = (low_bits | continuation_bit).astype(np.uint8)
+
+    return encoded_bytes, byte_offsets
+
+
+def decode_varints(encoded_bytes):
+    # Every value ends with a byte whose high bit is 0, the byte's position inside of its value tells us the shift
+    if len(encoded_bytes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    is_last_byte = encoded_bytes < 0x80
+    value_starts = np.flatnonzero(np.concatenate([[True], is_last_byte[:-1]]))
+    byte_positions = np.arange(len(encoded_bytes)) - np.repeat(value_starts, np.diff(np.append(value_starts, len(encoded_bytes))))
+
+    shifted_bits = (encoded_bytes & 0x7f).astype(np.int64) << (7 * byte_positions)
+    return np.add.reduceat(shifted_bits, value_starts)
@@ -1,8 +1,8 @@
+import functools
 import re
 import os
 
 
-import git
 import numpy as np
 
 
@@ -45,9 +45,17 @@ def name_to_layer_type(name):
         raise Exception(f'Name {name} not supported.')
 
 
+@functools.lru_cache(maxsize=None)
+def get_commit_hash():
+    import git  # GitPython is slow to import and only needed here
+
+    # Looked up once per process - it doesn't change while we're training (and the lookup isn't free)
+    return git.Repo(search_parent_directories=True).head.object.hexsha
+
+
 def get_training_state(training_config, model):
     training_state = {
-        "commit_hash": git.Repo(search_parent_directories=True).head.object.hexsha,
+        "commit_hash": get_commit_hash(),
 
         # Training details
         "dataset_name": training_config['dataset_name'],
@@ -2,40 +2,33 @@ import matplotlib.pyplot as plt
 import numpy as np
 import networkx as nx
 import igraph as ig
+import torch
 
 
 from utils.constants import DatasetType, GraphVisualizationTool, network_repository_cora_url, cora_label_to_color_map
 from utils.utils import convert_adj_to_edge_index
+from utils.graph import as_graph, get_edge_index
 
 
-def plot_in_out_degree_distributions(edge_index, num_of_nodes, dataset_name):
+def plot_in_out_degree_distributions(topology, num_of_nodes, dataset_name):
     """
+        topology - Graph (utils/graph.py), edge index or (NumPy) adjacency matrix/connectivity mask
+
         Note: It would be easy to do various kinds of powerful network analysis using igraph/networkx, etc.
         I chose to explicitly calculate only the node degree statistics here, but you can go much further if needed and
         calculate the graph diameter, number of triangles and many other concepts from the network analysis field.
 
     """
-    assert isinstance(edge_index, np.ndarray), f'Expected NumPy array got {type(edge_index)}.'
-    if edge_index.shape[0] == edge_index.shape[1]:
-        edge_index = convert_adj_to_edge_index(edge_index)
-
-    # Store each node's input and output degree (they're the same for undirected graphs such as Cora)
-    in_degrees = np.zeros(num_of_nodes, dtype=np.int)
-    out_degrees = np.zeros(num_of_nodes, dtype=np.int)
-
-    # Edge index shape = (2, E), the first row contains the source nodes, the second one target/sink nodes
-    # Note on terminology: source nodes point to target/sink nodes
-    num_of_edges = edge_index.shape[1]
-    for cnt in range(num_of_edges):
-        source_node_id = edge_index[0, cnt]
-        target_node_id = edge_index[1, cnt]
+    if isinstance(topology, np.ndarray) and topology.shape[0] == topology.shape[1]:
+        topology = convert_adj_to_edge_index(topology)
+    graph = as_graph(topology, num_of_nodes)
 
-        out_degrees[source_node_id] += 1  # source node points towards some other node -> increment it's out degree
-        in_degrees[target_node_id] += 1  # similarly here
+    # Each node's input and output degree (they're the same for undirected graphs such as Cora)
+    # Note on terminology: source nodes point to target/sink nodes, a source node's out degree counts its edges
+    in_degrees = graph.in_degrees.cpu().numpy()
+    out_degrees = graph.out_degrees.cpu().numpy()
 
-    hist = np.zeros(np.max(out_degrees) + 1)
-    for out_degree in out_degrees:
-        hist[out_degree] += 1
+    hist = np.bincount(out_degrees)  # number of nodes for every out degree
 
     fig = plt.figure()
     fig.subplots_adjust(hspace=0.6)
@@ -65,6 +58,9 @@ def visualize_graph(edge_index, node_labels, dataset_name, visualization_tool=Gr
     Basically depending on how big your graph is there may be better drawing tools than igraph.
 
     """
+    edge_index = get_edge_index(edge_index)  # Graph (utils/graph.py) works as well
+    if torch.is_tensor(edge_index):
+        edge_index = edge_index.cpu().numpy()
     assert isinstance(edge_index, np.ndarray), f'Expected NumPy array got {type(edge_index)}.'
     if edge_index.shape[0] == edge_index.shape[1]:
         edge_index = convert_adj_to_edge_index(edge_index)